@@ -23,9 +23,53 @@ from common import neo4j_resources as neo_resource
 from occi.exceptions import HTTPError
 from py2neo import Relationship
 import json
+import re
 
 
-def _get_physical_resource_by_type_and_uuid(graph_db, pop, resource_type, uuid):
+# Labels of the OpenStack resources not stored as virtual_resource
+VIRTUAL_LABELS = {
+    'hypervisor': 'hypervisor',
+    'controller-service': 'controller_service'
+}
+
+FIELD_NAME = re.compile(r'^[A-Za-z0-9_.\-]+$')
+
+
+def _get_return_clause(fields=None):
+    """
+    Return the Cypher return clause projecting only the given
+    properties of the node, or the whole node if no field is given
+    :param fields: optional list of properties to be retrieved
+    :return string: return clause
+    """
+    if not fields:
+        return 'return node'
+    for field in fields:
+        if not FIELD_NAME.match(field):
+            raise HTTPError(400, 'Bad field name: ' + field)
+    return 'return ' + ', '.join('node.`{0}` as `{0}`'.format(field) for field in fields)
+
+
+def _get_node_properties(data, fields=None):
+    """
+    Return the properties of the first node of the result of a query
+    built with _get_return_clause
+    :param data: Cypher query result
+    :param fields: optional list of projected properties
+    :return dict: Node properties, None if no node was found
+    """
+    for record in data.records:
+        if not fields:
+            return dict(record.node.properties)
+        node_properties = {}
+        for field in fields:
+            if record[field] is not None:
+                node_properties[field] = record[field]
+        return node_properties
+    return None
+
+
+def _get_physical_resource_by_type_and_uuid(graph_db, pop, resource_type, uuid, fields=None):
     """
     Retrieve properties of a given physical node, given its type and
     its unique ID
@@ -33,23 +77,25 @@ def _get_physical_resource_by_type_and_uuid(graph_db, pop, resource_type, uuid):
     :param pop: PoP Name
     :param resource_type: Type of the resource
     :param uuid: Node uuid
+    :param fields: optional list of properties to be retrieved
     :return dict: Node properties
     """
     query = 'match node where node.type=~"(?i){}" and node.pop="{}" ' \
-            'and node.physical_name = "{}" return node'.format(resource_type, pop, uuid)
+            'and node.physical_name = "{}" '.format(resource_type, pop, uuid)
+    query += _get_return_clause(fields)
 
     try:
         data = graph_db.cypher.execute(query)
     except Exception:
         raise HTTPError(400, "Error connecting to graph url ")
-    for record in data.records:
-        node_properties = dict(record.node.properties)
+    node_properties = _get_node_properties(data, fields)
+    if node_properties is not None:
         return node_properties
 
     raise HTTPError(404, 'Resource not found: /' + str(resource_type) + '/' + uuid)
 
 
-def _get_resource_by_type_and_uuid(graph_db, pop, resource_type, uuid):
+def _get_resource_by_type_and_uuid(graph_db, pop, resource_type, uuid, fields=None):
     """
     Retrieve properties of a given virtual node, given its type and
     its unique ID
@@ -57,23 +103,25 @@ def _get_resource_by_type_and_uuid(graph_db, pop, resource_type, uuid):
     :param pop: PoP Name
     :param resource_type: Type of the resource
     :param uuid: Node uuid
+    :param fields: optional list of properties to be retrieved
     :return dict: Node properties
     """
     query = 'match node where node.type="{}" and node.pop="{}" ' \
-            'and node.openstack_uuid = "{}" return node'.format(resource_type, pop, uuid)
+            'and node.openstack_uuid = "{}" '.format(resource_type, pop, uuid)
+    query += _get_return_clause(fields)
 
     try:
         data = graph_db.cypher.execute(query)
     except Exception:
         raise HTTPError(400, "Error connecting to graph url ")
-    for record in data.records:
-        node_properties = dict(record.node.properties)
+    node_properties = _get_node_properties(data, fields)
+    if node_properties is not None:
         return node_properties
 
     raise HTTPError(404, 'Resource not found: /' + str(resource_type) + '/' + uuid)
 
 
-def get_resource(pop_url, pop_id, resource_type, uuid, physical=False):
+def get_resource(pop_url, pop_id, resource_type, uuid, physical=False, fields=None):
     """
     Retrieve properties of a given node and sanitize them given its type and
     its unique ID
@@ -83,14 +131,16 @@ def get_resource(pop_url, pop_id, resource_type, uuid, physical=False):
     :param uuid: Node uuid
     :param physical: Boolean default False.
     It is True if the node that should be retrieved is a physical node
+    :param fields: optional list of properties to be retrieved,
+    all the properties are retrieved by default
     :return dict: Node properties
     """
     graph_url, pop = _get_graph_url(pop_url, pop_id)
     graph_db = neo4j.Graph(graph_url)
     if physical:
-        node_properties = _get_physical_resource_by_type_and_uuid(graph_db, pop, resource_type, uuid)
+        node_properties = _get_physical_resource_by_type_and_uuid(graph_db, pop, resource_type, uuid, fields)
     else:
-        node_properties = _get_resource_by_type_and_uuid(graph_db, pop, resource_type, uuid)
+        node_properties = _get_resource_by_type_and_uuid(graph_db, pop, resource_type, uuid, fields)
     results = {}
     for key in node_properties:
         if isinstance(node_properties[key], str):
@@ -213,6 +263,26 @@ def get_links_target_uuid(pop_url, pop_id, source_uuid):
     return results
 
 
+def _get_attribute_conditions(query_params):
+    """
+    Translate query parameters in Cypher conditions on the
+    indexed attribute properties of the node
+    :param query_params: list of (key, value)s used as query parameters
+    :return tuple: (conditions string, dict of Cypher parameters)
+    """
+    conditions = ''
+    parameters = {}
+    for q in query_params:
+        if len(q[0]) > 0 and len(q[1]) > 0:
+            key = q[0]
+            if key.startswith('occi.epa.'):
+                key = key[len('occi.epa.'):]
+            parameter = 'p' + str(len(parameters))
+            conditions += 'and node.`' + neo_resource.get_attribute_property(key) + '` = {' + parameter + '} '
+            parameters[parameter] = neo_resource.get_attribute_value(q[1])
+    return conditions, parameters
+
+
 def get_resource_openstack_ids(pop_url, pop_id, resource_type, query_params=list()):
     """
     Retrive list of nodes uuid of a given type
@@ -223,18 +293,15 @@ def get_resource_openstack_ids(pop_url, pop_id, resource_type, query_params=list
     :return list: list of nodes uuids
     """
     graph_url, pop = _get_graph_url(pop_url, pop_id)
+    conditions, parameters = _get_attribute_conditions(query_params)
+    label = VIRTUAL_LABELS.get(resource_type, 'virtual_resource')
 
-    query = 'match node where node.type="{}" and node.pop="{}" '.format(resource_type, pop)
-
-    for q in query_params:
-        if len(q[0]) > 0 and len(q[1]) > 0:
-            val = '(?i).*%s.*' % (q[1])
-            query += 'and node.attributes=~"{}"'.format(val)
-
+    query = 'match (node:{}) where node.type="{}" and node.pop="{}" '.format(label, resource_type, pop)
+    query += conditions
     query += ' return node.openstack_uuid'
     graph_db = neo4j.Graph(graph_url)
     try:
-        data = graph_db.cypher.execute(query)
+        data = graph_db.cypher.execute(query, parameters)
     except Exception:
         raise HTTPError(400, "Error connecting to graph url " + graph_url)
     results = []
@@ -242,17 +309,12 @@ def get_resource_openstack_ids(pop_url, pop_id, resource_type, query_params=list
         if record['node.openstack_uuid']:
             results.append(record['node.openstack_uuid'])
 
-    query = 'match node where node.type=~"(?i){}" and node.pop="{}" '.format(resource_type, pop)
-
-    for q in query_params:
-        if len(q[0]) > 0 and len(q[1]) > 0:
-            val = '(?i).*%s.*' % (q[1])
-            query += 'and node.attributes=~"{}"'.format(val)
-
+    query = 'match (node:physical_resource) where node.type=~"(?i){}" and node.pop="{}" '.format(resource_type, pop)
+    query += conditions
     query += ' return node.physical_name'
 
     try:
-        data = graph_db.cypher.execute(query)
+        data = graph_db.cypher.execute(query, parameters)
     except Exception:
         raise HTTPError(400, "Error connecting to graph url " + graph_url)
 
@@ -347,6 +409,29 @@ def delete_pop(pop_url, uuid):
     neo_resource.delete_node(graph_db, index=index)
 
 
+def _get_pop_conditions(query_params):
+    """
+    Translate query parameters in Cypher conditions on the PoP node.
+    Values are compared case-insensitive, as strings
+    since PoP properties are not necessarily strings.
+    :param query_params: list of (key, value)s used as query parameters
+    :return tuple: (conditions string, dict of Cypher parameters)
+    """
+    conditions = ''
+    parameters = {}
+    for q in query_params:
+        if len(q[0]) > 0 and len(q[1]) > 0:
+            key = q[0]
+            if key == 'name':
+                key = 'occi.epa.pop.name'
+            if not FIELD_NAME.match(key):
+                raise HTTPError(400, 'Bad query parameter: ' + q[0])
+            parameter = 'p' + str(len(parameters))
+            conditions += 'and lower(toString(node.`' + key + '`)) = {' + parameter + '} '
+            parameters[parameter] = q[1].lower()
+    return conditions, parameters
+
+
 def get_pop_ids(pop_url, query_params=list()):
     """
     Retrieve list of PoPs uuids
@@ -354,28 +439,48 @@ def get_pop_ids(pop_url, query_params=list()):
     :param query_params:  optional list of (key, value)s used as query parameters
     :return list: List of PoPs uuids
     """
-    query = 'match node where node.type="{}" return node'.format('pop')
+    conditions, parameters = _get_pop_conditions(query_params)
+    query = 'match (node:pop) where node.type="pop" ' + conditions + 'return node.uuid as uuid'
 
     graph_db = neo4j.Graph(pop_url)
     try:
-        data = graph_db.cypher.execute(query)
+        data = graph_db.cypher.execute(query, parameters)
+    except Exception:
+        raise HTTPError(400, "Error connecting to graph url " + pop_url)
+    results = []
+    for record in data.records:
+        if record['uuid']:
+            results.append(record['uuid'])
+    return results
+
+
+def get_pops_links_target_uuid(pop_url, query_params=list()):
+    """
+    Retrieve PoPs and all their outgoing links with a single query
+    :param pop_url: Url of the PoP DB
+    :param query_params:  optional list of (key, value)s used as query parameters
+    :return list: List of tuples (PoP uuid, list of links information)
+    as returned by get_pop_links_target_uuid
+    """
+    conditions, parameters = _get_pop_conditions(query_params)
+    query = 'match (node:pop) where node.type="pop" ' + conditions + \
+            'optional match (node)-[r]->(m) ' \
+            'return node.uuid as uuid, collect([m.uuid, m.type, r.uuid]) as links'
+
+    graph_db = neo4j.Graph(pop_url)
+    try:
+        data = graph_db.cypher.execute(query, parameters)
     except Exception:
         raise HTTPError(400, "Error connecting to graph url " + pop_url)
     results = []
     for record in data.records:
-        prop = dict(record.node.properties)
-        filtered = False
-        for q in query_params:
-            if len(q[0]) > 0 and len(q[1]) > 0:
-                if q[0] == 'name' or q[0] == 'occi.epa.pop.name':
-                    if prop['occi.epa.pop.name'].lower() != q[1].lower():
-                        filtered = True
-                else:
-                    tmp = repr(prop[q[0]]).lower()
-                    if tmp != q[1].lower():
-                        filtered = True
-        if not filtered:
-            results.append(prop['uuid'])
+        if not record['uuid']:
+            continue
+        links = []
+        for target_uuid, target_type, link_uuid in record['links']:
+            if target_uuid and target_type and link_uuid:
+                links.append((target_uuid, target_type.lower(), link_uuid))
+        results.append((record['uuid'], links))
     return results
 
 
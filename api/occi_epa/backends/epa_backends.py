@@ -65,6 +65,13 @@ class CoreBackend(EpaResourceBackend):
         self.physical = True
 
 
+class CPUModelBackend(EpaResourceBackend):
+    def __init__(self):
+        super(CPUModelBackend, self).__init__()
+        self.type = 'cpumodel'
+        self.physical = True
+
+
 class FloatingIpBackend(EpaResourceBackend):
     def __init__(self):
         super(FloatingIpBackend, self).__init__()
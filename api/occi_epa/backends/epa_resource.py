@@ -36,11 +36,15 @@ class EpaResourceBackend(KindBackend, ActionBackend):
         """
         Respond to GET call
         :param entity: Entity to be retrieved
-        :param extras: Any extra arguments. It should contain at least PoP Url
+        :param extras: Any extra arguments. It should contain at least PoP Url.
+        If it contains fields, only those attributes are retrieved
         """
         uuid = entity.identifier[1:].split('/')[3]
         pop_id = extras['pop_id']
-        resource = epa_glue.get_resource(extras['pop_url'], pop_id, self.type, uuid, physical=self.physical)
+        fields = extras.get('fields')
+        resource = epa_glue.get_resource(extras['pop_url'], pop_id, self.type, uuid,
+                                         physical=self.physical, fields=fields)
         for key in resource:
             entity.attributes['occi.epa.' + key] = resource[key]
-        entity.attributes['occi.epa.' + 'pop_id'] = pop_id
\ No newline at end of file
+        if not fields or 'pop_id' in fields:
+            entity.attributes['occi.epa.' + 'pop_id'] = pop_id
\ No newline at end of file
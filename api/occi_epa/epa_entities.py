@@ -0,0 +1,96 @@
+# Copyright 2015 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compact OCCI entities used by the EPA registry.
+
+Entities declare every field in __slots__ and their identifiers
+are built once, PoP prefix included. They still subclass the OCCI
+core model Resource and Link, which the OCCI renderers dispatch on,
+so instances keep a __dict__ slot: CPython allocates that dict lazily,
+on the first access to it (hasattr(entity, '__dict__') included),
+and nothing in the rendering path reads it, so it stays unallocated.
+See benchmarks/occi_entities.py for the memory held per entity.
+"""
+
+__author__ = 'gpetralia'
+
+from occi.core_model import Resource, Link
+
+# EPA entities expose no actions: share one immutable placeholder
+NO_ACTIONS = ()
+
+
+class KindTemplate(object):
+    """
+    Kind and link kind of an EPA resource type,
+    with their locations cached per PoP
+    """
+    __slots__ = ('kind', 'link_kind', '_prefixes')
+
+    def __init__(self, kind, link_kind):
+        self.kind = kind
+        self.link_kind = link_kind
+        self._prefixes = {}
+
+    def prefixes(self, pop_id=None):
+        """
+        Return the locations of resources and links of this kind
+        :param pop_id: optional PoP ID prepended to the locations
+        :return tuple: (resource location, link location)
+        """
+        prefixes = self._prefixes.get(pop_id)
+        if prefixes is None:
+            pop_prefix = '/pop/' + pop_id if pop_id else ''
+            prefixes = (pop_prefix + self.kind.location, pop_prefix + self.link_kind.location)
+            self._prefixes[pop_id] = prefixes
+        return prefixes
+
+
+class EpaResource(Resource):
+    """
+    OCCI Resource storing its fields in slots
+    """
+    __slots__ = ('identifier', 'title', 'kind', 'mixins', 'attributes',
+                 'actions', 'extras', 'links', 'summary')
+
+    def __init__(self, identifier, kind):
+        self.identifier = identifier
+        self.title = None
+        self.kind = kind
+        self.mixins = []
+        self.attributes = {}
+        self.actions = NO_ACTIONS
+        self.extras = None
+        self.links = []
+        self.summary = None
+
+
+class EpaLink(Link):
+    """
+    OCCI Link storing its fields in slots
+    """
+    __slots__ = ('identifier', 'title', 'kind', 'mixins', 'attributes',
+                 'actions', 'extras', 'source', 'target')
+
+    def __init__(self, identifier, kind, source, target):
+        self.identifier = identifier
+        self.title = None
+        self.kind = kind
+        self.mixins = []
+        self.attributes = {}
+        self.actions = NO_ACTIONS
+        self.extras = None
+        self.source = source
+        self.target = target
@@ -18,13 +18,27 @@ OCCI Registry implementation
 
 __author__ = 'gpetralia'
 
+from multiprocessing.pool import ThreadPool
+import multiprocessing
+import threading
+import time
+
 from occi import registry as occi_registry
 from api import epa_glue
 from api import opendaylight_glue as odl_glue
 from api.occi_epa.extensions import epa_addon
 from occi import core_model
 from occi.exceptions import HTTPError
-from occi.core_model import Resource, Link
+from api.occi_epa.epa_entities import KindTemplate, EpaResource, EpaLink
+
+# PoP ID used to query the EPA DBs of all the PoPs
+FANOUT_POP_ID = '*'
+
+# Default seconds granted to each PoP of a fan-out query
+FANOUT_TIMEOUT = 10
+
+# Default maximum number of PoPs queried concurrently
+FANOUT_WORKERS = 8
 
 KIND_TYPE_MAPPING = {
     'stack': epa_addon.STACK,
@@ -65,6 +79,8 @@ KIND_TYPE_MAPPING = {
     'pcidev_link': epa_addon.PCI_DEV_LINK,
     'pu': epa_addon.PU,
     'pu_link': epa_addon.PU_LINK,
+    'cpumodel': epa_addon.CPU_MODEL,
+    'cpumodel_link': epa_addon.CPU_MODEL_LINK,
     'osdev': epa_addon.OS_DEV,
     'osdev_link': epa_addon.OS_DEV_LINK,
     'pop': epa_addon.POP,
@@ -75,6 +91,47 @@ KIND_TYPE_MAPPING = {
     'switch-interface_link': epa_addon.SWITCH_INTERFACE_LINK
 }
 
+# Kinds and link kinds of each resource type, built once at import
+KIND_TEMPLATES = dict((kind, KindTemplate(KIND_TYPE_MAPPING[kind], KIND_TYPE_MAPPING[kind + '_link']))
+                      for kind in KIND_TYPE_MAPPING if not kind.endswith('_link'))
+
+
+class FanoutPool(object):
+    """
+    Thread pool shared by the fan-out queries of an application.
+    Queries have no timeout and keep running after their request
+    gave up on them, so at most one query per PoP is in the pool:
+    a slow PoP holds a single worker and the threads stay bounded.
+    """
+    def __init__(self, workers=FANOUT_WORKERS):
+        self.pool = ThreadPool(workers)
+        self.lock = threading.Lock()
+        self.running = set()
+
+    def apply_async(self, pop_id, func, args):
+        """
+        Queue a query on a PoP
+        :param pop_id: PoP ID
+        :param func: function querying the PoP
+        :param args: arguments of the function
+        :return AsyncResult: None if the previous query on the PoP is still running
+        """
+        with self.lock:
+            if pop_id in self.running:
+                return None
+            self.running.add(pop_id)
+        return self.pool.apply_async(self._run, (pop_id, func, args))
+
+    def _run(self, pop_id, func, args):
+        """
+        Run a query on a PoP and release the PoP
+        """
+        try:
+            return func(*args)
+        finally:
+            with self.lock:
+                self.running.discard(pop_id)
+
 
 class EPARegistry(occi_registry.NonePersistentRegistry):
 
@@ -102,6 +159,15 @@ class EPARegistry(occi_registry.NonePersistentRegistry):
         if splitted_url[0] != 'pop' and not pop_id:
             raise HTTPError(400, "Pop-Id missing")
 
+        if pop_id == FANOUT_POP_ID:
+            raise HTTPError(400, "Pop-Id " + FANOUT_POP_ID + " is supported only listing resources")
+
+        # Identifiers of PoPs and PoPs links are not prefixed
+        if splitted_url[0] != 'pop':
+            entity_pop_id = pop_id
+        else:
+            entity_pop_id = None
+
         # Get Resource
         if len(splitted_url) == 2:
             resource_type = splitted_url[0]
@@ -110,73 +176,10 @@ class EPARegistry(occi_registry.NonePersistentRegistry):
             if uuid not in uuids:
                 raise HTTPError(404, "Resource not found")
 
-            result = self.get_occi_resource(resource_type, uuid)
-
-            # Identify PoP Link
-            if resource_type == 'pop':
-                for target_link in epa_glue.get_pop_links_target_uuid(pop_url, uuid):
-                    self.get_link(resource_type,
-                                  result,
-                                  target_link[0],
-                                  target_link[1],
-                                  target_link[2])
-
-            # Identify switch link
-            elif resource_type == 'switch':
-                for target_uuid in odl_glue.get_switch_interfaces_by_switch_id(pop_url, pop_id, uuid):
-                    link_uuid = uuid + '->' + target_uuid
-                    self.get_link(resource_type,
-                                  result,
-                                  target_uuid,
-                                  'switch-interface',
-                                  link_uuid)
-
-            # Identify switch interface link
-            # A switch interface is connected to the switch
-            # and can be connected to an osdev
-            elif resource_type == 'switch-interface':
-                switch_uuid = odl_glue.get_switch_by_interface(pop_url, pop_id, uuid)
-                # Link to the switch
-                if switch_uuid:
-                    switch_link_uuid = uuid + '->' + switch_uuid
-                    self.get_link(resource_type,
-                                  result,
-                                  switch_uuid,
-                                  'switch',
-                                  switch_link_uuid)
+            result = self.get_occi_resource(resource_type, uuid, entity_pop_id)
 
-                osdev_uuid = odl_glue.get_os_dev_by_switch_interface(pop_url, pop_id, uuid)
-                # Link to the osdev
-                if osdev_uuid:
-                    osdev_link_uuid = uuid + '->' + osdev_uuid
-                    self.get_link(resource_type,
-                                  result,
-                                  osdev_uuid,
-                                  'osdev',
-                                  osdev_link_uuid)
-            # Identify osdev link
-            # An osdev can be connected to a switch interface
-            elif resource_type == 'osdev':
-                mac = epa_glue.get_mac_by_osdev_uuid(pop_url, pop_id, uuid)
-                if mac:
-                    switch_interface = odl_glue.get_switch_interface_by_mac(pop_url, pop_id, mac)
-                    if switch_interface:
-                        link_uuid = uuid + '->' + switch_interface
-                        self.get_link(resource_type,
-                                      result,
-                                      switch_interface,
-                                      'switch-interface',
-                                      link_uuid)
-
-            # Indentify link for all other resources
-            else:
-                for target_link in epa_glue.get_links_target_uuid(extras['pop_url'], pop_id, uuid):
-                    link_uuid = uuid + '->' + target_link[0]
-                    self.get_link(resource_type,
-                                  result,
-                                  target_link[0],
-                                  target_link[1],
-                                  link_uuid)
+            if extras.get('links', True):
+                self.add_resource_links(result, resource_type, uuid, pop_url, pop_id, entity_pop_id)
 
         # Get Link
         elif len(splitted_url) == 3 and splitted_url[1] == 'link':
@@ -217,12 +220,13 @@ class EPARegistry(occi_registry.NonePersistentRegistry):
                 # the required link does not exist
                 if not link_prop:
                     raise HTTPError(404, "Resource Not Found")
-                source_entity = self.get_occi_resource(source_type, source_uuid)
+                source_entity = self.get_occi_resource(source_type, source_uuid, entity_pop_id)
                 result = self.get_link(source_type,
                                        source_entity,
                                        target_uuid,
                                        link_prop['target_type'],
-                                       link_uuid)
+                                       link_uuid,
+                                       entity_pop_id)
 
             # PoP Link
             else:
@@ -230,25 +234,98 @@ class EPARegistry(occi_registry.NonePersistentRegistry):
                 if link_result and len(link_result) == 2:
                     source = link_result[0]
                     target = link_result[1]
-                    source_entity = self.get_occi_resource(splitted_url[0], source)
-                    target_entity = self.get_occi_resource(splitted_url[0], target)
-                    result = self.get_occi_link(splitted_url[0] + '_link', link_uuid, source_entity, target_entity)
+                    source_entity = self.get_occi_resource(splitted_url[0], source, entity_pop_id)
+                    target_entity = self.get_occi_resource(splitted_url[0], target, entity_pop_id)
+                    result = self.get_occi_link(splitted_url[0], link_uuid, source_entity, target_entity,
+                                                entity_pop_id)
 
         # If requested resource does not exist
         # raise Resource not found exception
         if result:
-            if isinstance(result, Resource) and result.kind.term != 'pop':
-                EPARegistry.add_pop_id_to_resource(result, pop_id)
-                EPARegistry.add_pop_id_to_links(result.links, pop_id)
-            if isinstance(result, Link) and result.kind.term != 'poplink':
-                EPARegistry.add_pop_id_to_resource(result, pop_id)
-                EPARegistry.add_pop_id_to_link_source(result, pop_id)
-                EPARegistry.add_pop_id_to_link_target(result, pop_id)
-
-
             return result
         raise HTTPError(404, 'Resource not found: ' + str(key))
 
+    def add_resource_links(self, result, resource_type, uuid, pop_url, pop_id, entity_pop_id):
+        """
+        Add to a single resource the links to its neighbours
+        :param result: Resource entity
+        :param resource_type: kind of the resource
+        :param uuid: resource uuid
+        :param pop_url: Url of PoP DB
+        :param pop_id: PoP ID
+        :param entity_pop_id: PoP ID prefixed to the identifiers, None for PoPs
+        """
+        # Identify PoP Link
+        if resource_type == 'pop':
+            for target_link in epa_glue.get_pop_links_target_uuid(pop_url, uuid):
+                self.get_link(resource_type,
+                              result,
+                              target_link[0],
+                              target_link[1],
+                              target_link[2])
+
+        # Identify switch link
+        elif resource_type == 'switch':
+            for target_uuid in odl_glue.get_switch_interfaces_by_switch_id(pop_url, pop_id, uuid):
+                link_uuid = uuid + '->' + target_uuid
+                self.get_link(resource_type,
+                              result,
+                              target_uuid,
+                              'switch-interface',
+                              link_uuid,
+                              entity_pop_id)
+
+        # Identify switch interface link
+        # A switch interface is connected to the switch
+        # and can be connected to an osdev
+        elif resource_type == 'switch-interface':
+            switch_uuid = odl_glue.get_switch_by_interface(pop_url, pop_id, uuid)
+            # Link to the switch
+            if switch_uuid:
+                switch_link_uuid = uuid + '->' + switch_uuid
+                self.get_link(resource_type,
+                              result,
+                              switch_uuid,
+                              'switch',
+                              switch_link_uuid,
+                              entity_pop_id)
+
+            osdev_uuid = odl_glue.get_os_dev_by_switch_interface(pop_url, pop_id, uuid)
+            # Link to the osdev
+            if osdev_uuid:
+                osdev_link_uuid = uuid + '->' + osdev_uuid
+                self.get_link(resource_type,
+                              result,
+                              osdev_uuid,
+                              'osdev',
+                              osdev_link_uuid,
+                              entity_pop_id)
+        # Identify osdev link
+        # An osdev can be connected to a switch interface
+        elif resource_type == 'osdev':
+            mac = epa_glue.get_mac_by_osdev_uuid(pop_url, pop_id, uuid)
+            if mac:
+                switch_interface = odl_glue.get_switch_interface_by_mac(pop_url, pop_id, mac)
+                if switch_interface:
+                    link_uuid = uuid + '->' + switch_interface
+                    self.get_link(resource_type,
+                                  result,
+                                  switch_interface,
+                                  'switch-interface',
+                                  link_uuid,
+                                  entity_pop_id)
+
+        # Indentify link for all other resources
+        else:
+            for target_link in epa_glue.get_links_target_uuid(pop_url, pop_id, uuid):
+                link_uuid = uuid + '->' + target_link[0]
+                self.get_link(resource_type,
+                              result,
+                              target_link[0],
+                              target_link[1],
+                              link_uuid,
+                              entity_pop_id)
+
     def get_resources(self, extras):
         """
         Get list of resources
@@ -260,10 +337,61 @@ class EPARegistry(occi_registry.NonePersistentRegistry):
         if extras['kind'] != 'pop':
             if 'pop_id' not in extras:
                 raise HTTPError(400, "Pop-Id missing")
-            results = self.get_resource_entities(extras['pop_url'], extras['pop_id'], [extras['kind']], query)
+            if extras['pop_id'] == FANOUT_POP_ID:
+                return self.get_fanout_resource_entities(extras)
+            results = self.get_resource_entities(extras['pop_url'], extras['pop_id'], [extras['kind']], query,
+                                                 extras.get('links', True))
 
         elif extras['kind'] == 'pop':
-            results = self.get_pops(extras['pop_url'], query)
+            results = self.get_pops(extras['pop_url'], query, extras.get('links', True))
+        return results
+
+    @staticmethod
+    def get_fanout_resource_entities(extras):
+        """
+        Retrieve the entities of the requested kind from the EPA DBs
+        of all the PoPs, querying them concurrently on extras['fanout_pool'].
+        PoPs that fail, do not answer within the fan-out timeout
+        or are still busy with a previous query
+        are appended to extras['failed_pops'], if present.
+        :param extras: any extras parameter to the call
+        :return list: entities of all the PoPs that answered
+        """
+        pop_url = extras['pop_url']
+        pop_ids = epa_glue.get_pop_ids(pop_url)
+        if not pop_ids:
+            return []
+
+        timeout = extras.get('fanout_timeout', FANOUT_TIMEOUT)
+        pool = extras['fanout_pool']
+        args = ([extras['kind']], extras['query'], extras.get('links', True))
+
+        results = []
+        failed_pops = []
+        pending = []
+        for pop_id in pop_ids:
+            result = pool.apply_async(pop_id, EPARegistry.get_resource_entities, (pop_url, pop_id) + args)
+            if result is None:
+                print 'PoP ' + pop_id + ' is still busy'
+                failed_pops.append(pop_id)
+            else:
+                pending.append((pop_id, result))
+
+        # Every PoP has the same deadline, so the request
+        # takes at most timeout seconds. Late answers are discarded
+        deadline = time.time() + timeout
+        for pop_id, result in pending:
+            try:
+                results.extend(result.get(max(deadline - time.time(), 0)))
+            except multiprocessing.TimeoutError:
+                print 'PoP ' + pop_id + ' timed out'
+                failed_pops.append(pop_id)
+            except Exception as e:
+                print 'PoP ' + pop_id + ' failed: ' + str(e)
+                failed_pops.append(pop_id)
+
+        if 'failed_pops' in extras:
+            extras['failed_pops'].extend(failed_pops)
         return results
 
     def get_renderer(self, mime_type):
@@ -277,7 +405,7 @@ class EPARegistry(occi_registry.NonePersistentRegistry):
             mime_type = mime_type.split(';')[0]
         return super(EPARegistry, self).get_renderer(mime_type)
 
-    def get_link(self, source_type, source_entity, target_uuid, target_type, link_uuid):
+    def get_link(self, source_type, source_entity, target_uuid, target_type, link_uuid, pop_id=None):
         """
         Get Link given the link parameters
         :param source_type: kind of the source of the link
@@ -285,51 +413,44 @@ class EPARegistry(occi_registry.NonePersistentRegistry):
         :param target_uuid: target uuid
         :param target_type: target kind
         :param link_uuid: link identifier
+        :param pop_id: optional PoP ID prefixed to the identifiers
         :return link:
         """
-        target_entity = EPARegistry.get_occi_resource(target_type, target_uuid)
-        link = self.get_occi_link(source_type + '_link', link_uuid, source_entity, target_entity)
+        target_entity = EPARegistry.get_occi_resource(target_type, target_uuid, pop_id)
+        link = self.get_occi_link(source_type, link_uuid, source_entity, target_entity, pop_id)
         return link
 
-
-    @staticmethod
-    def add_pop_id_to_link_source(link, pop_id):
-        EPARegistry.add_pop_id_to_resource(link.source, pop_id)
-
-    @staticmethod
-    def add_pop_id_to_link_target(link, pop_id):
-        EPARegistry.add_pop_id_to_resource(link.target, pop_id)
-
     @staticmethod
-    def get_pops(pop_url, query):
+    def get_pops(pop_url, query, links=True):
         """
         Get a dict containg PoPs and PoPs links
 
         :param pop_url: url of the PoP DB
         :param query: query parameters
+        :param links: if False links are not retrieved
         :return dict: key: pop UUID, values Resource entity
         """
         results = {}
-        for uuid in epa_glue.get_pop_ids(pop_url, query):
-            entity = EPARegistry.get_occi_resource('pop', uuid)
-            results[uuid] = entity
+        if not links:
+            for uuid in epa_glue.get_pop_ids(pop_url, query):
+                results[uuid] = EPARegistry.get_occi_resource('pop', uuid)
+            return results.values()
 
+        # PoPs and their links are retrieved with a single query
         links = {}
-        for uuid in results:
-            for target_link in epa_glue.get_pop_links_target_uuid(pop_url, uuid):
-                target_uuid = target_link[0]
-                target_type = target_link[1]
-                link_uuid = target_link[2]
-                source_entity = results[uuid]
-                kind = source_entity.kind.term + '_link'
+        for uuid, target_links in epa_glue.get_pops_links_target_uuid(pop_url, query):
+            source_entity = EPARegistry.get_occi_resource('pop', uuid)
+            results[uuid] = source_entity
+            for target_uuid, target_type, link_uuid in target_links:
                 target_entity = EPARegistry.get_occi_resource(target_type, target_uuid)
-                links[link_uuid] = EPARegistry.get_occi_link(kind, link_uuid, source_entity, target_entity)
+                links[link_uuid] = EPARegistry.get_occi_link(source_entity.kind.term, link_uuid,
+                                                             source_entity, target_entity)
 
         results.update(links)
         return results.values()
 
     @staticmethod
-    def get_resource_entities(pop_url, pop_id, openstack_types, query):
+    def get_resource_entities(pop_url, pop_id, openstack_types, query, links=True):
         """
         Retrieve a list of entities and their links
         for a given list of types
@@ -337,58 +458,69 @@ class EPARegistry(occi_registry.NonePersistentRegistry):
         :param pop_id: PoP ID
         :param openstack_types: list of type
         :param query: optional query parameters
+        :param links: if False links are not retrieved
         :return dict: keys resources' uuids, values resources' properties
         """
         results = {}
         for resource_type in openstack_types:
             # For switches call Opendaylight
             if resource_type == 'switch':
-                for uuid in odl_glue.get_switches_ids(pop_url, pop_id):
-                    entity = EPARegistry.get_occi_resource(resource_type, uuid)
-                    results[uuid] = entity
+                uuids = odl_glue.get_switches_ids(pop_url, pop_id)
 
             # For switches' interfaces call Opendaylight
             elif resource_type == 'switch-interface':
-                for uuid in odl_glue.get_switch_interfaces(pop_url, pop_id):
-                    entity = EPARegistry.get_occi_resource(resource_type, uuid)
-                    results[uuid] = entity
+                uuids = odl_glue.get_switch_interfaces(pop_url, pop_id)
+
             # For all others resources query EPA DB
             else:
-                for uuid in epa_glue.get_resource_openstack_ids(pop_url, pop_id, resource_type, query):
-                    entity = EPARegistry.get_occi_resource(resource_type, uuid)
-                    results[uuid] = entity
+                uuids = epa_glue.get_resource_openstack_ids(pop_url, pop_id, resource_type, query)
+
+            EPARegistry.add_occi_resources(resource_type, uuids, pop_id, results)
 
         # Retrieve links for the resources that should be returned
+        if links:
+            results.update(EPARegistry.get_resource_links(pop_url, pop_id, results))
+
+        return results.values()
+
+    @staticmethod
+    def get_resource_links(pop_url, pop_id, results):
+        """
+        Retrieve the links of a list of entities
+        :param pop_url: Url of PoP DB
+        :param pop_id: PoP ID
+        :param results: dict of resources, keys resources' uuids
+        :return dict: keys links' uuids, values Link entities
+        """
         links = {}
         for source_uuid in results:
-            if results[source_uuid].kind.term == 'switch':
+            source_entity = results[source_uuid]
+            source_type = source_entity.kind.term
+            if source_type == 'switch':
                 for target_uuid in odl_glue.get_switch_interfaces_by_switch_id(pop_url, pop_id, source_uuid):
                     target_type = 'switch-interface'
                     link_uuid = source_uuid + '->' + target_uuid
-                    source_entity = results[source_uuid]
-                    kind = source_entity.kind.term + '_link'
-                    target_entity = EPARegistry.get_occi_resource(target_type, target_uuid)
-                    links[link_uuid] = EPARegistry.get_occi_link(kind, link_uuid, source_entity, target_entity)
-            elif results[source_uuid].kind.term == 'switch-interface':
+                    target_entity = EPARegistry.get_occi_resource(target_type, target_uuid, pop_id)
+                    links[link_uuid] = EPARegistry.get_occi_link(source_type, link_uuid, source_entity,
+                                                                 target_entity, pop_id)
+            elif source_type == 'switch-interface':
                 switch_uuid = odl_glue.get_switch_by_interface(pop_url, pop_id, source_uuid)
                 if switch_uuid:
                     switch_type = 'switch'
-                    source_entity = results[source_uuid]
-                    kind = source_entity.kind.term + '_link'
-                    switch_entity = EPARegistry.get_occi_resource(switch_type, switch_uuid)
-                    switch_link_uuid = uuid + '->' + switch_uuid
-                    links[switch_link_uuid] = EPARegistry.get_occi_link(kind, switch_link_uuid,
-                                                                        results[source_uuid], switch_entity)
+                    switch_entity = EPARegistry.get_occi_resource(switch_type, switch_uuid, pop_id)
+                    switch_link_uuid = source_uuid + '->' + switch_uuid
+                    links[switch_link_uuid] = EPARegistry.get_occi_link(source_type, switch_link_uuid,
+                                                                        source_entity, switch_entity, pop_id)
 
                 osdev_uuid = odl_glue.get_os_dev_by_switch_interface(pop_url, pop_id, source_uuid)
 
                 if osdev_uuid:
                     osdev_type = 'osdev'
-                    osdev_entity = EPARegistry.get_occi_resource(osdev_type, osdev_uuid)
-                    osdev_link_uuid = uuid + '->' + osdev_uuid
-                    links[osdev_link_uuid] = EPARegistry.get_occi_link(kind, osdev_link_uuid,
-                                                                       results[source_uuid], osdev_entity)
-            elif results[source_uuid].kind.term == 'osdev':
+                    osdev_entity = EPARegistry.get_occi_resource(osdev_type, osdev_uuid, pop_id)
+                    osdev_link_uuid = source_uuid + '->' + osdev_uuid
+                    links[osdev_link_uuid] = EPARegistry.get_occi_link(source_type, osdev_link_uuid,
+                                                                       source_entity, osdev_entity, pop_id)
+            elif source_type == 'osdev':
                 mac = epa_glue.get_mac_by_osdev_uuid(pop_url, pop_id, source_uuid)
                 if mac:
                     switch_interface = odl_glue.get_switch_interface_by_mac(pop_url, pop_id, mac)
@@ -396,66 +528,73 @@ class EPARegistry(occi_registry.NonePersistentRegistry):
                         target_uuid = switch_interface
                         target_type = 'switch-interface'
                         link_uuid = source_uuid + '->' + target_uuid
-                        source_entity = results[source_uuid]
-                        kind = source_entity.kind.term + '_link'
-                        target_entity = EPARegistry.get_occi_resource(target_type, target_uuid)
-                        links[link_uuid] = EPARegistry.get_occi_link(kind, link_uuid, source_entity, target_entity)
+                        target_entity = EPARegistry.get_occi_resource(target_type, target_uuid, pop_id)
+                        links[link_uuid] = EPARegistry.get_occi_link(source_type, link_uuid, source_entity,
+                                                                     target_entity, pop_id)
             else:
                 for target_link in epa_glue.get_links_target_uuid(pop_url, pop_id, source_uuid):
                     target_uuid = target_link[0]
                     target_type = target_link[1]
                     link_uuid = source_uuid + '->' + target_uuid
-                    source_entity = results[source_uuid]
-                    kind = source_entity.kind.term + '_link'
-                    target_entity = EPARegistry.get_occi_resource(target_type, target_uuid)
-                    links[link_uuid] = EPARegistry.get_occi_link(kind, link_uuid, source_entity, target_entity)
+                    target_entity = EPARegistry.get_occi_resource(target_type, target_uuid, pop_id)
+                    links[link_uuid] = EPARegistry.get_occi_link(source_type, link_uuid, source_entity,
+                                                                 target_entity, pop_id)
 
-        results.update(links)
-
-        EPARegistry.add_pop_id_to_resources(results, pop_id)
-
-        return results.values()
-
-    @staticmethod
-    def add_pop_id_to_resources(results, pop_id):
-        for result in results:
-            results[result].identifier = '/pop/' + pop_id + results[result].identifier
+        return links
 
     @staticmethod
-    def add_pop_id_to_links(results, pop_id):
-        for result in results:
-            result.identifier = '/pop/' + pop_id + result.identifier
-            EPARegistry.add_pop_id_to_link_target(result, pop_id)
+    def get_kind_template(kind):
+        """
+        Get the precomputed kinds of a resource type
+        :param kind: kind of the resource
+        :return KindTemplate: kinds and locations of the resource type
+        """
+        template = KIND_TEMPLATES.get(kind)
+        if template is None:
+            template = KIND_TEMPLATES[kind.lower()]
+        return template
 
     @staticmethod
-    def add_pop_id_to_resource(result, pop_id):
-        result.identifier = '/pop/' + pop_id + result.identifier
+    def add_occi_resources(kind, uuids, pop_id, results):
+        """
+        Add the occi instances of resources of the same kind
+        to the given dict
+        :param kind: kind of the resources
+        :param uuids: UUIDs of the resources
+        :param pop_id: PoP ID prefixed to the identifiers
+        :param results: dict where resources are added by UUID
+        """
+        template = EPARegistry.get_kind_template(kind)
+        occi_kind = template.kind
+        location = template.prefixes(pop_id)[0]
+        for uuid in uuids:
+            results[uuid] = EpaResource(location + uuid, occi_kind)
 
     @staticmethod
-    def get_occi_resource(kind, uuid):
+    def get_occi_resource(kind, uuid, pop_id=None):
         """
         Get the occi instance of a resource
         :param kind: kind of the resource
         :param uuid: UUID of the resource
+        :param pop_id: optional PoP ID prefixed to the identifier
         :return Resource: OCCI resource
         """
-        kind = kind.lower()
-        iden = KIND_TYPE_MAPPING[kind].location + uuid
-        entity = core_model.Resource(iden, KIND_TYPE_MAPPING[kind], [])
-        return entity
+        template = EPARegistry.get_kind_template(kind)
+        return EpaResource(template.prefixes(pop_id)[0] + uuid, template.kind)
 
     @staticmethod
-    def get_occi_link(kind, link_uuid, source, target):
+    def get_occi_link(kind, link_uuid, source, target, pop_id=None):
         """
         Get the OCCI Link
-        :param kind: type of the link
+        :param kind: kind of the source of the link
         :param link_uuid: uuid of the link
         :param source: source entity
         :param target: target entity
+        :param pop_id: optional PoP ID prefixed to the identifier
         :return Link: OCCI Link
         """
-        iden = KIND_TYPE_MAPPING[kind].location + link_uuid
-        link = core_model.Link(iden, KIND_TYPE_MAPPING[kind], [], source, target)
+        template = EPARegistry.get_kind_template(kind)
+        link = EpaLink(template.prefixes(pop_id)[1] + link_uuid, template.link_kind, source, target)
         source.links.append(link)
         return link
 
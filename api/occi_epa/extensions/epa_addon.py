@@ -437,6 +437,26 @@ PU_LINK = core_model.Kind(
     '/pu/link/'
 )
 
+CPU_MODEL = core_model.Kind(
+    'http://schemas.ogf.org/occi/epa#',
+    'cpumodel',
+    [core_model.Resource.kind],
+    [],
+    'CPU model shared by processing units',
+    EPA_RESOURCES_ATTRIBUTES,
+    '/cpumodel/'
+)
+
+CPU_MODEL_LINK = core_model.Kind(
+    'http://schemas.ogf.org/occi/epa#',
+    'cpumodellink',
+    [core_model.Link.kind],
+    [],
+    'Link between a CPU model and its resources',
+    EPA_LINK_ATTRIBUTES,
+    '/cpumodel/link/'
+)
+
 OS_DEV = core_model.Kind(
     'http://schemas.ogf.org/occi/epa#',
     'osdev',
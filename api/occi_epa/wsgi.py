@@ -17,22 +17,31 @@ OCCI application
 """
 __author__ = 'gpetralia'
 
+import urllib
+
 from occi import wsgi as occi_wsgi
-from api.occi_epa.epa_registry import EPARegistry
+from api.occi_epa.epa_registry import EPARegistry, FanoutPool, FANOUT_POP_ID, FANOUT_TIMEOUT, FANOUT_WORKERS
 from api.occi_epa.json_rendering import EPAJsonRendering
 from api.occi_epa.text_occi_rendering import EPATextOcciRendering
 
 
 class EPAApplication(occi_wsgi.Application):
 
-    def __init__(self, pop_url):
+    def __init__(self, pop_url, fanout_timeout=FANOUT_TIMEOUT, fanout_workers=FANOUT_WORKERS):
         """
         Initialize the WSGI OCCI application.
+        :param pop_url: Url of the PoP DB
+        :param fanout_timeout: seconds granted to each PoP
+        when all the PoPs are queried (/pops/*/...)
+        :param fanout_workers: maximum number of PoPs queried concurrently,
+        by all the requests together
         """
         super(EPAApplication, self).__init__(registry=EPARegistry())
         self.registry.set_renderer('application/occi+json', EPAJsonRendering(self.registry))
         self.registry.set_renderer('text/occi', EPATextOcciRendering(self.registry))
         self.pop_url = pop_url
+        self.fanout_timeout = fanout_timeout
+        self.fanout_pool = FanoutPool(fanout_workers)
 
     def __call__(self, environ, response):
         """
@@ -63,13 +72,22 @@ class EPAApplication(occi_wsgi.Application):
         queries = query_string.split('&')
 
         extra_query = []
+        # sparse fieldsets: properties to be retrieved
+        # and whether links should be resolved
+        fields = None
+        links = True
         for query in queries:
             if '=' in query:
                 tmp = query.split('=')
                 if len(tmp) > 1:
-                    param = tmp[0]
+                    param = urllib.unquote(tmp[0])
                     value = tmp[1]
-                    extra_query.append((param, value))
+                    if param == 'fields':
+                        fields = _parse_fields(value)
+                    elif param == 'links':
+                        links = urllib.unquote(value).lower() not in ('false', '0', 'no')
+                    else:
+                        extra_query.append((param, urllib.unquote(value)))
 
         # parsing kind from the path of the call
         kind = None
@@ -77,10 +95,56 @@ class EPAApplication(occi_wsgi.Application):
         if len(path) > 1:
             kind = environ['PATH_INFO'][1:].split('/')[0]
 
+        extras = {
+            'registry': self.registry,
+            'kind': kind,
+            'query': extra_query,
+            'pop_url': self.pop_url,
+            'fields': fields,
+            'links': links
+        }
+
         # specify pop_id
         if 'HTTP_EPA_POP_ID' in environ:
-            return self._call_occi(environ, response, registry=self.registry, pop_id=environ['HTTP_EPA_POP_ID'],
-                                   kind=kind, query=extra_query, pop_url=self.pop_url)
-        else:
-            return self._call_occi(environ, response, registry=self.registry, kind=kind,
-                                   query=extra_query, pop_url=self.pop_url)
+            extras['pop_id'] = environ['HTTP_EPA_POP_ID']
+
+            # query all the PoPs and report the ones that failed
+            if extras['pop_id'] == FANOUT_POP_ID:
+                extras['fanout_timeout'] = self.fanout_timeout
+                extras['fanout_pool'] = self.fanout_pool
+                extras['failed_pops'] = []
+                response = _failed_pops_response(response, extras['failed_pops'])
+
+        return self._call_occi(environ, response, **extras)
+
+
+def _failed_pops_response(response, failed_pops):
+    """
+    Wrap the WSGI response adding the Epa-Failed-Pops header,
+    listing the PoPs that failed during a fan-out query
+    :param response: The WSGI response
+    :param failed_pops: list filled by the registry with the failed PoP IDs
+    :return function: wrapped WSGI response
+    """
+    def fanout_response(status, headers):
+        if failed_pops:
+            headers.append(('Epa-Failed-Pops', ','.join(failed_pops)))
+        return response(status, headers)
+    return fanout_response
+
+
+def _parse_fields(value):
+    """
+    Parse the comma separated list of the fields query parameter.
+    The occi.epa. prefix of the attributes is optional.
+    :param value: value of the fields query parameter
+    :return list: names of the properties to be retrieved
+    """
+    fields = []
+    for field in urllib.unquote(value).split(','):
+        field = field.strip()
+        if field.startswith('occi.epa.'):
+            field = field[len('occi.epa.'):]
+        if field and field not in fields:
+            fields.append(field)
+    return fields
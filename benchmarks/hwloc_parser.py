@@ -0,0 +1,198 @@
+# Copyright 2015 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark of the hwloc parser.
+It parses generated hwloc XML topologies from 8 to 1024 PUs
+with the recursive parser scanning the networkx graph for each Cache
+parent and with the iterative parser of the hw_reources module,
+checking that both build the same graph.
+
+Run from the root of the repository:
+python -m benchmarks.hwloc_parser [max number of PUs]
+"""
+
+__author__ = 'gpetralia'
+
+import sys
+import time
+import xml.etree.ElementTree as Et
+
+import networkx as nx
+
+from monitoring_service.epa_database import hw_reources
+from monitoring_service.epa_database.hw_topology import HwTopology
+
+HOSTNAME = 'compute-0'
+POP_ID = 'pop-0'
+
+# PUs per core and cores per socket of the generated topologies
+THREADS_PER_CORE = 2
+CORES_PER_SOCKET = 16
+
+
+def _cpuset(first, count):
+    """
+    Return the hwloc cpuset of count PUs starting from first
+    """
+    return hex(((1 << count) - 1) << first).rstrip('L')
+
+
+def _cache(parent, first, count, depth, cache_type):
+    """
+    Add a Cache object covering count PUs starting from first
+    """
+    return Et.SubElement(parent, 'object', type='Cache', os_index='-1', cpuset=_cpuset(first, count),
+                         depth=str(depth), cache_size=str(32768 << depth), cache_linesize='64',
+                         cache_associativity='8', cache_type=str(cache_type))
+
+
+def generate_topology(pus):
+    """
+    Generate a hwloc XML topology, each core has
+    its L2 and the L1 data and instruction caches
+    :param pus: number of PUs
+    :return Element: root of the topology
+    """
+    cores = max(pus / THREADS_PER_CORE, 1)
+    sockets = max(cores / CORES_PER_SOCKET, 1)
+    cores_per_socket = cores / sockets
+
+    topology = Et.Element('topology')
+    machine = Et.SubElement(topology, 'object', type='Machine', os_index='0', cpuset=_cpuset(0, pus))
+    Et.SubElement(machine, 'info', name='Backend', value='Linux')
+
+    pu_index = 0
+    for socket_index in range(sockets):
+        socket_pus = cores_per_socket * THREADS_PER_CORE
+        numa = Et.SubElement(machine, 'object', type='NUMANode', os_index=str(socket_index),
+                             cpuset=_cpuset(pu_index, socket_pus), local_memory='34359738368')
+        socket = Et.SubElement(numa, 'object', type='Socket', os_index=str(socket_index),
+                               cpuset=_cpuset(pu_index, socket_pus))
+        Et.SubElement(socket, 'info', name='CPUModel', value='Intel(R) Xeon(R) CPU E5-2680 v3 @ 2.50GHz')
+        l3 = _cache(socket, pu_index, socket_pus, 3, 0)
+
+        for core_index in range(cores_per_socket):
+            l2 = _cache(l3, pu_index, THREADS_PER_CORE, 2, 0)
+            l1d = _cache(l2, pu_index, THREADS_PER_CORE, 1, 1)
+            l1i = _cache(l1d, pu_index, THREADS_PER_CORE, 1, 2)
+            core = Et.SubElement(l1i, 'object', type='Core', os_index=str(core_index),
+                                 cpuset=_cpuset(pu_index, THREADS_PER_CORE))
+            for _ in range(THREADS_PER_CORE):
+                Et.SubElement(core, 'object', type='PU', os_index=str(pu_index), cpuset=_cpuset(pu_index, 1))
+                pu_index += 1
+
+    return topology
+
+
+def _legacy_parse_object_hwloc(graph, obj, host_name, deleted_edges, pop_id, parent=None):
+    """
+    Recursive parser scanning the whole graph to find the parent of each Cache
+    """
+    object_children = []
+    new_node_properties = {
+        'resource_type': 'physical',
+        'category': hw_reources._get_category(obj),
+        'type': obj.attrib['type'],
+        'hostname': host_name,
+        'pop': pop_id,
+        'attributes': hw_reources._get_attributes(obj)
+    }
+
+    node_name = hw_reources._get_unique_name(obj, host_name)
+
+    attr = obj.attrib.copy()
+    del attr['type']
+
+    for child in obj:
+        if child.tag == 'object':
+            object_children.append(child)
+
+    graph.add_node(node_name, attr_dict=new_node_properties)
+
+    if parent is not None:
+        graph.add_edge(parent, node_name, label='INTERNAL')
+        if parent in deleted_edges.keys():
+            graph.add_edge(deleted_edges[parent], node_name, label='INTERNAL')
+
+    if parent is not None:
+        if new_node_properties['type'] == 'Cache':
+            parent_type = ''
+            parent_depth = ''
+            for node, node_attr in graph.nodes(data=True):
+                if node == parent:
+                    parent_type = node_attr['type']
+                    if parent_type == 'Cache':
+                        parent_depth = node_attr['attributes']['depth']
+
+            if parent_type == new_node_properties['type'] and attr['depth'] == parent_depth:
+                graph.remove_edge(parent, node_name)
+                deleted_edges[node_name] = parent
+                parent = graph.pred[parent].keys()[0]
+                graph.add_edge(parent, node_name, label='INTERNAL')
+
+    for obj in object_children:
+        _legacy_parse_object_hwloc(graph, obj, host_name, deleted_edges, pop_id, parent=node_name)
+
+
+def _legacy_parse(xml_root):
+    """
+    Parse a topology in a networkx graph with the recursive parser
+    """
+    graph = nx.DiGraph()
+    deleted_edges = {}
+    for child in xml_root:
+        _legacy_parse_object_hwloc(graph, child, HOSTNAME, deleted_edges, POP_ID)
+    return graph
+
+
+def _parse(xml_root):
+    """
+    Parse a topology as HostHwResources.store does
+    """
+    topology = HwTopology(HOSTNAME, POP_ID)
+    deleted_edges = {}
+    for child in xml_root:
+        hw_reources._parse_object_hwloc(topology, child, deleted_edges)
+    return topology
+
+
+def run(max_pus=1024):
+    """
+    Time both parsers on topologies with an increasing number of PUs
+    :param max_pus: number of PUs of the largest topology
+    """
+    pus = 8
+    while pus <= max_pus:
+        topology = generate_topology(pus)
+        timings = []
+        results = []
+        for parser in (_legacy_parse, _parse):
+            start = time.time()
+            results.append(parser(topology))
+            timings.append(time.time() - start)
+        graphs = [results[0], results[1].to_networkx()]
+
+        same = sorted(graphs[0].edges()) == sorted(graphs[1].edges()) and \
+            dict(graphs[0].nodes(data=True)) == dict(graphs[1].nodes(data=True))
+        print '{0:>5} PUs, {1:>5} objects: recursive {2:.3f}s, iterative {3:.3f}s{4}'.format(
+            pus, graphs[1].number_of_nodes(), timings[0], timings[1], '' if same else ' MISMATCH')
+        pus *= 2
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        run(int(sys.argv[1]))
+    else:
+        run()
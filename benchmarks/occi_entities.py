@@ -0,0 +1,122 @@
+# Copyright 2015 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Micro-benchmark of OCCI entities creation.
+It builds the same listing (resources, each with one link)
+with the core model entities rewritten with the PoP prefix
+and with the EPA registry entities, and reports the time
+and the resident memory held by the entities of each listing.
+
+Run from the root of the repository:
+python -m benchmarks.occi_entities [number of entities]
+"""
+
+__author__ = 'gpetralia'
+
+import gc
+import resource
+import sys
+import time
+import uuid as uuid_lib
+
+from occi import core_model
+from api.occi_epa.epa_registry import EPARegistry, KIND_TYPE_MAPPING
+
+
+def _legacy_listing(uuids, pop_id):
+    """
+    Build entities as the registry did before kind templates:
+    kind lookup per entity and a second pass adding the PoP prefix
+    """
+    results = {}
+    for uuid in uuids:
+        kind = 'vm'.lower()
+        iden = KIND_TYPE_MAPPING[kind].location + uuid
+        results[uuid] = core_model.Resource(iden, KIND_TYPE_MAPPING[kind], [])
+
+    links = {}
+    for uuid in uuids:
+        source = results[uuid]
+        target_kind = 'hypervisor'.lower()
+        target = core_model.Resource(KIND_TYPE_MAPPING[target_kind].location + uuid,
+                                     KIND_TYPE_MAPPING[target_kind], [])
+        link_uuid = uuid + '->' + uuid
+        kind = source.kind.term + '_link'
+        link = core_model.Link(KIND_TYPE_MAPPING[kind].location + link_uuid, KIND_TYPE_MAPPING[kind],
+                               [], source, target)
+        source.links.append(link)
+        links[link_uuid] = link
+
+    results.update(links)
+    for result in results:
+        results[result].identifier = '/pop/' + pop_id + results[result].identifier
+    return results.values()
+
+
+def _registry_listing(uuids, pop_id):
+    """
+    Build entities with the EPA registry
+    """
+    results = {}
+    EPARegistry.add_occi_resources('vm', uuids, pop_id, results)
+
+    links = {}
+    for uuid in uuids:
+        source = results[uuid]
+        target = EPARegistry.get_occi_resource('hypervisor', uuid, pop_id)
+        link_uuid = uuid + '->' + uuid
+        links[link_uuid] = EPARegistry.get_occi_link('vm', link_uuid, source, target, pop_id)
+
+    results.update(links)
+    return results.values()
+
+
+def _get_rss():
+    """
+    Return the resident memory of the process, read from procfs (Linux only)
+    :return int: resident memory in bytes
+    """
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize()
+
+
+def run(entities=100000):
+    """
+    Time both listings for the given number of resources
+    and measure the resident memory held by their entities
+    :param entities: number of resources of the listing
+    """
+    pop_id = str(uuid_lib.uuid4())
+    uuids = [str(uuid_lib.uuid4()) for _ in range(entities)]
+
+    for name, listing in (('core model', _legacy_listing), ('epa registry', _registry_listing)):
+        gc.collect()
+        rss = _get_rss()
+        start = time.time()
+        results = listing(uuids, pop_id)
+        elapsed = time.time() - start
+        gc.collect()
+        size = _get_rss() - rss
+        print '{0:>12}: {1} resources + links in {2:.3f}s, {3:.1f} MiB ({4} bytes per entity)'.format(
+            name, entities, elapsed, size / 1048576.0, size / len(results))
+        del results
+        gc.collect()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        run(int(sys.argv[1]))
+    else:
+        run()
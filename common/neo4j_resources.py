@@ -21,6 +21,16 @@ __author__ = 'gpetralia'
 
 from py2neo import Relationship
 import json
+import urllib
+
+# Prefix of the node properties flattened from the attributes
+ATTRIBUTE_PREFIX = 'attr_'
+
+# Default number of nodes deleted by a single query
+DELETE_BATCH_SIZE = 1000
+
+# (label, property key) of the indexes already created
+_indexes = set()
 
 
 def create_index(graph_db, index):
@@ -29,14 +39,102 @@ def create_index(graph_db, index):
     :param graph_db: Graph db instance
     :param index: tuple containing (label, property key for UUID, UUID)
     """
-    index_created = False
     if index and len(index) > 1:
-        for i in graph_db.schema.get_indexes(index[0]):
-            if i == index[1]:
-                index_created = True
+        if (index[0], index[1]) in _indexes:
+            return
 
-        if not index_created:
+        if index[1] not in graph_db.schema.get_indexes(index[0]):
             graph_db.schema.create_index(index[0], index[1])
+        _indexes.add((index[0], index[1]))
+
+
+def get_attribute_value(value):
+    """
+    Normalize an attribute value so that it can be
+    compared to the value of a query parameter
+    :param value: attribute value
+    :return string: normalized value
+    """
+    if not isinstance(value, basestring):
+        value = str(value)
+    return value.strip().lower()
+
+
+def get_attribute_property(key):
+    """
+    Return the name of the node property flattened from an attribute.
+    Characters of the key other than letters, digits and '_.-'
+    are percent-encoded, so that the name is safe within backticks
+    in queries and maps back to the key with urllib.unquote
+    :param key: attribute key
+    :return string: property name
+    """
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    return ATTRIBUTE_PREFIX + urllib.quote(str(key), safe='')
+
+
+def get_attribute_properties(attributes):
+    """
+    Flatten the scalar attributes of a node in properties
+    prefixed by ATTRIBUTE_PREFIX, so that they can be indexed
+    :param attributes: dict of attributes or its JSON encoding
+    :return dict: flattened properties
+    """
+    if isinstance(attributes, basestring):
+        try:
+            attributes = json.loads(attributes)
+        except ValueError:
+            return {}
+
+    results = {}
+    if not isinstance(attributes, dict):
+        return results
+
+    for key in attributes:
+        value = attributes[key]
+        if value is None or isinstance(value, (dict, list)):
+            continue
+        results[get_attribute_property(key)] = get_attribute_value(value)
+    return results
+
+
+def _get_neo_properties(graph_db, label, properties):
+    """
+    Convert node's properties to neo4j properties.
+    Scalar attributes are flattened and indexed.
+    :param graph_db: Graph db instance
+    :param label: label of the node
+    :param properties: dict containing node's properties
+    :return dict: neo4j properties
+    """
+    neo_properties = dict()
+    for key in properties:
+        if isinstance(properties[key], dict):
+            neo_properties[key] = json.dumps(properties[key])
+        else:
+            neo_properties[key] = str(properties[key])
+
+    if 'attributes' in properties:
+        attribute_properties = get_attribute_properties(properties['attributes'])
+        for key in attribute_properties:
+            create_index(graph_db, (label, key))
+        neo_properties.update(attribute_properties)
+    return neo_properties
+
+
+def _update_node_properties(node, neo_properties):
+    """
+    Update the properties of a node removing
+    the flattened attributes no longer present
+    :param node: node reference
+    :param neo_properties: new neo4j properties of the node
+    """
+    if 'attributes' in neo_properties:
+        for key in node.properties.keys():
+            if key.startswith(ATTRIBUTE_PREFIX) and key not in neo_properties:
+                node.properties[key] = None
+    node.properties.update(neo_properties)
 
 
 def add_node(graph_db, index, timestamp, properties=None):
@@ -55,20 +153,136 @@ def add_node(graph_db, index, timestamp, properties=None):
     neo_properties['index_type'] = index[0]
     neo_properties[index[1]] = index[2]
     if properties is not None:
-        for key in properties:
-            if isinstance(properties[key], dict):
-                neo_properties[key] = json.dumps(properties[key])
-            else:
-                neo_properties[key] = str(properties[key])
+        neo_properties.update(_get_neo_properties(graph_db, index[0], properties))
 
     neo_properties['timestamp'] = timestamp
 
     node = graph_db.merge_one(index[0], index[1], index[2])
-    node.properties.update(neo_properties)
+    _update_node_properties(node, neo_properties)
     graph_db.push(node)
     return node
 
 
+def add_nodes(graph_db, label, property_key, nodes, timestamp):
+    """
+    Add a batch of nodes with a single query.
+    Properties of existing nodes are updated,
+    removing the flattened attributes no longer present.
+
+    :param graph_db: Graph db instance
+    :param label: label of the nodes
+    :param property_key: property key for UUID
+    :param nodes: list of tuples (UUID, dict containing node's properties)
+    :param timestamp: timestamp in epoch
+    """
+    if not nodes:
+        return
+
+    create_index(graph_db, (label, property_key))
+    rows = []
+    for uuid, properties in nodes:
+        neo_properties = dict()
+        neo_properties['index_type'] = label
+        neo_properties[property_key] = uuid
+        if properties is not None:
+            neo_properties.update(_get_neo_properties(graph_db, label, properties))
+        neo_properties['timestamp'] = timestamp
+        rows.append({'key': uuid, 'properties': neo_properties})
+
+    # Stale flattened attributes are removed setting them to null
+    stored_keys = _get_property_keys(graph_db, label, property_key,
+                                     [row['key'] for row in rows if 'attributes' in row['properties']])
+    for row in rows:
+        for key in stored_keys.get(row['key'], []):
+            if key.startswith(ATTRIBUTE_PREFIX) and key not in row['properties']:
+                row['properties'][key] = None
+
+    query = 'unwind {rows} as row ' \
+            'merge (n:`' + label + '` {`' + property_key + '`: row.key}) ' \
+            'set n += row.properties'
+    graph_db.cypher.execute(query, rows=rows)
+
+
+def _get_property_keys(graph_db, label, property_key, uuids):
+    """
+    Return the property keys of the stored nodes among the given ones
+    :param graph_db: Graph db instance
+    :param label: label of the nodes
+    :param property_key: property key for UUID
+    :param uuids: list of UUIDs of the nodes
+    :return dict: UUID -> list of property keys
+    """
+    if not uuids:
+        return {}
+    query = 'unwind {uuids} as uuid ' \
+            'match (n:`' + label + '` {`' + property_key + '`: uuid}) ' \
+            'return uuid, keys(n) as property_keys'
+    results = graph_db.cypher.execute(query, uuids=uuids)
+    return dict((res.uuid, res.property_keys) for res in results.records)
+
+
+def add_edges(graph_db, label, property_key, edges, timestamp):
+    """
+    Add a batch of relations with one query per relation label.
+    Missing endpoints are created and completed when their
+    properties are written.
+
+    :param graph_db: Graph db instance
+    :param label: label of the nodes
+    :param property_key: property key for UUID
+    :param edges: list of tuples (source UUID, target UUID, relation label)
+    :param timestamp: timestamp in epoch
+    """
+    rows_by_label = {}
+    for source, target, edge_label in edges:
+        rows_by_label.setdefault(edge_label, []).append({'source': source, 'target': target})
+
+    for edge_label in rows_by_label:
+        query = 'unwind {rows} as row ' \
+                'merge (s:`' + label + '` {`' + property_key + '`: row.source}) ' \
+                'merge (t:`' + label + '` {`' + property_key + '`: row.target}) ' \
+                'merge (s)-[r:`' + edge_label + '`]->(t) ' \
+                'set r.timestamp = {timestamp}'
+        graph_db.cypher.execute(query, rows=rows_by_label[edge_label], timestamp=timestamp)
+
+
+def add_neighbour_edges(graph_db, index, edges, timestamp):
+    """
+    Add the relations between a node and its neighbours,
+    with one query per relation label, direction and kind of neighbour.
+    Neighbours share the label and the property key of the node.
+    Mandatory neighbours are created if missing, relations
+    to missing optional neighbours are skipped.
+
+    :param graph_db: Graph db instance
+    :param index: tuple containing (label, property key for UUID, UUID) of the node
+    :param edges: list of tuples (neighbour UUID, relation label, outgoing, mandatory)
+    :param timestamp: timestamp in epoch
+    """
+    neighbours_by_group = {}
+    for neighbour, edge_label, outgoing, mandatory in edges:
+        neighbours_by_group.setdefault((edge_label, outgoing, mandatory), []).append(neighbour)
+
+    if neighbours_by_group:
+        create_index(graph_db, index)
+
+    node = '(n:`' + index[0] + '` {`' + index[1] + '`: {uuid}}) '
+    neighbour = '(m:`' + index[0] + '` {`' + index[1] + '`: neighbour}) '
+    for edge_label, outgoing, mandatory in neighbours_by_group:
+        query = 'match ' + node + 'unwind {neighbours} as neighbour '
+        if mandatory:
+            query += 'merge ' + neighbour + 'set m.index_type = {label}, m.timestamp = {timestamp} '
+        else:
+            query += 'match ' + neighbour
+        if outgoing:
+            query += 'merge (n)-[r:`' + edge_label + '`]->(m) '
+        else:
+            query += 'merge (m)-[r:`' + edge_label + '`]->(n) '
+        query += 'set r.timestamp = {timestamp}'
+        graph_db.cypher.execute(query, uuid=index[2], label=index[0], timestamp=timestamp,
+                                neighbours=neighbours_by_group[(edge_label, outgoing, mandatory)])
+
+
 def update_node(graph_db, index, timestamp, properties=None):
     """
     Update an existing node
@@ -83,36 +297,74 @@ def update_node(graph_db, index, timestamp, properties=None):
     neo_properties = dict()
     neo_properties[index[1]] = index[2]
     if properties is not None:
-        for key in properties:
-            if isinstance(properties[key], dict):
-                neo_properties[key] = json.dumps(properties[key])
-            else:
-                neo_properties[key] = str(properties[key])
+        neo_properties.update(_get_neo_properties(graph_db, index[0], properties))
 
         neo_properties['timestamp'] = timestamp
 
         node = graph_db.find_one(index[0], property_key=index[1], property_value=index[2])
         if node:
-            node.properties.update(neo_properties)
+            _update_node_properties(node, neo_properties)
             graph_db.push(node)
     return node
 
 
+def _match_node(index=None, node=None):
+    """
+    Return the Cypher clause matching as n a node
+    specified by index or reference, and its parameters
+    :param index: optional node index
+    :param node: optional node reference
+    :return tuple: (match clause, dict of Cypher parameters)
+    """
+    if node is not None:
+        return 'match (n) where id(n) = {node_id} ', {'node_id': node._id}
+    return 'match (n:`' + index[0] + '` {`' + index[1] + '`: {uuid}}) ', {'uuid': index[2]}
+
+
+def update_node_attributes(graph_db, index, attributes, keys, timestamp):
+    """
+    Rewrite the given attributes of an existing node with a single query,
+    leaving its other properties untouched
+
+    :param graph_db: Graph db instance
+    :param index: tuple containing (label, property key for UUID, UUID)
+    :param attributes: dict containing all the attributes of the node
+    :param keys: keys of the attributes to rewrite
+    :param timestamp: timestamp in epoch
+    :return boolean: true if the node exists
+    """
+    params = {
+        'uuid': index[2],
+        'attributes': json.dumps(attributes),
+        'timestamp': timestamp
+    }
+    attribute_properties = get_attribute_properties(dict((key, attributes.get(key)) for key in keys))
+
+    query = 'match (n:`' + index[0] + '` {`' + index[1] + '`: {uuid}}) ' \
+            'set n.attributes = {attributes}, n.timestamp = {timestamp}'
+    for position, key in enumerate(keys):
+        # Properties of null or non-scalar attributes are removed setting them to null
+        attribute_property = get_attribute_property(key)
+        params['value' + str(position)] = attribute_properties.get(attribute_property)
+        query += ', n.`' + attribute_property + '` = {value' + str(position) + '}'
+    query += ' return count(n)'
+    return graph_db.cypher.execute_one(query, **params) > 0
+
+
 def delete_node(graph_db, index=None, node=None):
     """
     Delete a given node specified by index or reference
+    together with its relations, with a single query
     :param graph_db: Graph db instance
     :param index: optional node index
     :param node:  optional node reference
-    :return Node: deleted node
+    :return boolean: true if the node existed and was deleted
     """
-    if not node:
-        node = get_node(graph_db, index)
-    if node:
-        edges = get_edges_by_node(graph_db, node=node)
-        edges.append(node)
-        graph_db.delete(*edges)
-    return node
+    if node is None and not index:
+        return False
+    match, params = _match_node(index, node)
+    query = match + 'optional match (n)-[r]-() delete r, n return count(distinct n)'
+    return graph_db.cypher.execute_one(query, **params) > 0
 
 
 def add_edge(graph_db, db_src, db_target, timestamp, label, properties=None):
@@ -218,20 +470,24 @@ def get_neighbours(graph_db, node=None, index=None):
 
 def remove_neighbours(graph_db, node=None, index=None, neighbour_type=None):
     """
-    Delete nodes connected to the given one
+    Delete nodes connected to the given one, together with
+    their relations, with a single query
     :param graph_db: Graph DB reference
     :param node: optional node reference
     :param index: optional index
     :param neighbour_type: optional neighbours type used as filter
     """
-    neighbours = get_neighbours(graph_db, node=node, index=index)
-
-    for n in neighbours:
-        if neighbour_type:
-            if n.properties['type'] == neighbour_type:
-                delete_node(graph_db, node=n)
-        else:
-            delete_node(graph_db, node=n)
+    if node is None and not index:
+        return
+    match, params = _match_node(index, node)
+    query = match + 'match (n)--(m) '
+    if neighbour_type:
+        query += 'where m.type = {neighbour_type} '
+        params['neighbour_type'] = neighbour_type
+    query += 'with distinct m ' \
+             'optional match (m)-[r]-() ' \
+             'delete r, m'
+    graph_db.cypher.execute(query, **params)
 
 
 def get_node(graph_db, index):
@@ -270,18 +526,50 @@ def get_edge(graph_db, db_src, db_trg):
     return edge
 
 
-def remove_nodes_by_property(graph_db, label, property_key, property_value):
+def edge_exists(graph_db, src_index, target_index, label):
+    """
+    Check with a single query that both nodes
+    and the relation between them exist
+
+    :param graph_db: Graph DB reference
+    :param src_index: index of the source node
+    :param target_index: index of the target node
+    :param label: label of the relation
+    :return boolean: true if the relation exists
+    """
+    query = 'match (s:`' + src_index[0] + '` {`' + src_index[1] + '`: {src}})' \
+            '-[:`' + label + '`]->' \
+            '(t:`' + target_index[0] + '` {`' + target_index[1] + '`: {target}}) ' \
+            'return count(*)'
+    return graph_db.cypher.execute_one(query, src=src_index[2], target=target_index[2]) > 0
+
+
+def remove_nodes_by_property(graph_db, label, property_key, property_value, batch_size=DELETE_BATCH_SIZE):
     """
-    Delete nodes with the given property
+    Delete nodes with the given property together with their relations.
+    Nodes are deleted server-side, batch_size nodes per query,
+    so that each transaction stays bounded.
 
     :param graph_db: Graph DB reference
     :param label: label of the nodes
     :param property_key: property key of the nodes
     :param property_value: property value of the nodes
-    """
-    nodes = graph_db.find(label, property_key=property_key, property_value=property_value)
-    for node in nodes:
-        delete_node(graph_db, node=node)
+    :param batch_size: number of nodes deleted by a single query
+    :return int: number of nodes deleted
+    """
+    query = 'match (n:`' + label + '` {`' + property_key + '`: {value}}) ' \
+            'with n limit {batch_size} ' \
+            'optional match (n)-[r]-() ' \
+            'delete r, n ' \
+            'return count(distinct n)'
+    total = 0
+    while True:
+        deleted = graph_db.cypher.execute_one(query, value=property_value, batch_size=batch_size)
+        if not deleted:
+            break
+        total += deleted
+        print 'Deleted {0} {1} nodes with {2}={3}'.format(total, label, property_key, property_value)
+    return total
 
 
 def has_edge(graph_db, edge_type, dest_label, dest_property, dest_value, incoming=False, node=None, index=None):
@@ -344,3 +632,21 @@ def get_nodes_by_attribute(graph_db, hostname, resource_type, attribute):
         nodes.append(res.n)
 
     return nodes
+
+
+def get_nodes_by_pci_busid(graph_db, label, hostname, pci_busid):
+    """
+    Get the nodes of a host with the given PCI bus ID,
+    looked up through the pci_busid index
+
+    :param graph_db: Graph DB instance
+    :param label: label of the nodes
+    :param hostname: hostname of the nodes
+    :param pci_busid: PCI bus ID
+    :return list: List of nodes
+    """
+    query = 'match (n:`' + label + '` {pci_busid: {pci_busid}}) ' \
+            'where n.hostname = {hostname} ' \
+            'return n'
+    results = graph_db.cypher.execute(query, pci_busid=pci_busid, hostname=hostname)
+    return [res.n for res in results.records]
@@ -36,4 +36,20 @@ def config_section_map(section, config_file):
         except:
             print("exception on %s!" % option)
             dict1[option] = None
-    return dict1
\ No newline at end of file
+    return dict1
+
+
+def config_option(section, option, config_file, default=None):
+    """
+    Return the value of an optional parameter
+    of the given section of the config file.
+
+    :param section: Section name
+    :param option: Parameter name
+    :param config_file: Config file
+    :param default: value returned if the parameter is not set
+    :return string: parameter value
+    """
+    if config_file.has_section(section) and config_file.has_option(section, option):
+        return config_file.get(section, option)
+    return default
@@ -20,12 +20,18 @@ EPA agent
 __author__ = 'gpetralia'
 
 import os
+import socket
 import subprocess
 import getopt
 import sys
 import ConfigParser
 import pika
 import json
+import zlib
+import base64
+import uuid
+import hashlib
+import time
 
 
 # Name of files created by the agent
@@ -36,102 +42,150 @@ DATA_FILES = {
     'sriov': '_sriov.txt'
 }
 
+# Default size in bytes of the chunks of inline payloads
+CHUNK_SIZE = 1048576
 
-def create_dpdk_file(path, hostname):
+SYSFS_ROOT = '/sys'
+PROCFS_ROOT = '/proc'
+
+# PCI class prefix of network controllers
+NETWORK_CLASS = '0x02'
+
+# Drivers binding devices to DPDK
+DPDK_DRIVERS = ('igb_uio', 'vfio-pci', 'uio_pci_generic')
+
+# cpuinfo fields ignored when checking for changes
+VOLATILE_CPUINFO = ('cpu mhz',)
+
+
+def get_pci_devices(sysfs_root=SYSFS_ROOT):
     """
-    Create file containing dpdk info
+    Return the PCI devices of the machine
+    with their class and the driver in use
 
-    :param path: Path where stores the file
-    :param hostname: hostname of the machine where the agent is running
+    :param sysfs_root: root of the sysfs tree
+    :return dict: PCI bus ID -> {'class': PCI class, 'driver': driver name or None}
+    """
+    devices_path = os.path.join(sysfs_root, 'bus', 'pci', 'devices')
+    devices = {}
+    if not os.path.isdir(devices_path):
+        return devices
+
+    for pci_busid in os.listdir(devices_path):
+        device_path = os.path.join(devices_path, pci_busid)
+        driver = None
+        driver_path = os.path.join(device_path, 'driver')
+        if os.path.islink(driver_path):
+            driver = os.path.basename(os.readlink(driver_path))
+        devices[pci_busid] = {'class': _read_sysfs_value(os.path.join(device_path, 'class')),
+                              'driver': driver}
+    return devices
+
+
+def get_sriov_devices(sysfs_root=SYSFS_ROOT):
     """
-    dpdk_file_input = '/root/programs/Pktgen-DPDK/dpdk/tools/dpdk_nic_bind.py'
-    dpdk_file_output = path + '/' + hostname + DATA_FILES['dpdk']
-    regex_1 = "'Network devices using DPDK-compatible driver\\n=*\\n([0-9]{4}:[0-9]{2}:[0-9]{2}.[0-9]{1}.*\\n)*'"
-    regex_2 = "'^[0-9]{4}:[0-9]{2}:[0-9]{2}.[0-9]{1}'"
-    if os.path.isfile(dpdk_file_input):
-        command = dpdk_file_input + " --status | grep -Pzo " + regex_1 + " | " \
-            "grep -Pzo " + regex_2 + " > " + dpdk_file_output
+    Return the SR-IOV capable network devices
+    with their number of virtual functions
 
-        os.system(command)
+    :param sysfs_root: root of the sysfs tree
+    :return dict: PCI bus ID -> (configured VFs, total VFs)
+    """
+    devices_path = os.path.join(sysfs_root, 'bus', 'pci', 'devices')
+    sriov_devices = {}
+    for pci_busid, device in get_pci_devices(sysfs_root).items():
+        if not (device['class'] or '').startswith(NETWORK_CLASS):
+            continue
+        totalvfs = _read_sysfs_value(os.path.join(devices_path, pci_busid, 'sriov_totalvfs'))
+        if totalvfs is None:
+            continue
+        numvfs = _read_sysfs_value(os.path.join(devices_path, pci_busid, 'sriov_numvfs'))
+        sriov_devices[pci_busid] = (numvfs or '0', totalvfs)
+    return sriov_devices
+
+
+def get_dpdk_devices(sysfs_root=SYSFS_ROOT):
+    """
+    Return the network devices bound to a DPDK-compatible driver
 
+    :param sysfs_root: root of the sysfs tree
+    :return list: PCI bus IDs
+    """
+    dpdk_devices = []
+    for pci_busid, device in get_pci_devices(sysfs_root).items():
+        if (device['class'] or '').startswith(NETWORK_CLASS) and device['driver'] in DPDK_DRIVERS:
+            dpdk_devices.append(pci_busid)
+    return sorted(dpdk_devices)
 
-def create_hwloc_file(path, hostname):
+
+def _read_sysfs_value(file_path):
     """
-    Create file containing Hardware locality info
+    Return the stripped content of a sysfs attribute
 
-    :param path: Path where stores the file
-    :param hostname: hostname of the machine where the agent is running
+    :param file_path: path of the attribute
+    :return string: value, None if the attribute cannot be read
     """
-    hwloc_file = path + '/' + hostname + DATA_FILES['hwloc']
-    command = "hwloc-ls --of xml > " + hwloc_file
-    os.system(command)
+    try:
+        with open(file_path) as f:
+            return f.read().strip()
+    except IOError:
+        return None
 
 
-def create_cpu_file(path, hostname):
+def create_dpdk_file(path, hostname, sysfs_root=SYSFS_ROOT):
     """
-    Create file containing CPUs info
+    Create file containing dpdk info
 
     :param path: Path where stores the file
     :param hostname: hostname of the machine where the agent is running
+    :param sysfs_root: root of the sysfs tree
     """
-    cpuinfo_file = path + '/' + hostname + DATA_FILES['cpu']
-    command = "cat /proc/cpuinfo > " + cpuinfo_file
-    os.system(command)
+    dpdk_file_output = os.path.join(path, hostname + DATA_FILES['dpdk'])
+    with open(dpdk_file_output, 'w') as f:
+        for pci_busid in get_dpdk_devices(sysfs_root):
+            f.write(pci_busid + '\n')
 
 
-def parse_sriov(sriov_file):
+def create_hwloc_file(path, hostname):
     """
-    Reformat file adding for each line
-    number of virtual functions for each sriov nic
+    Create file containing Hardware locality info
 
-    :param sriov_file: file path of the sriov file
+    :param path: Path where stores the file
+    :param hostname: hostname of the machine where the agent is running
     """
-    file_sriov = open(sriov_file, 'r')
-    line = file_sriov.readline()
-    values = {}
-    while line:
-        numvfs = ''
-        totalvfs = ''
-        line = line.strip()
-        numvfs_cmd = "cat /sys/bus/pci/devices/0000\:" + line + "/sriov_numvfs"
-        proc = subprocess.Popen(numvfs_cmd, shell=True, stdout=subprocess.PIPE, )
-        numvfs = str(proc.communicate()[0])[:-1]
-        totalvfs_cmd = "cat /sys/bus/pci/devices/0000\:" + line + "/sriov_totalvfs"
-        proc = subprocess.Popen(totalvfs_cmd, shell=True, stdout=subprocess.PIPE, )
-        totalvfs = str(proc.communicate()[0])[:-1]
-        values['0000:' + line] = numvfs + ' ' + totalvfs
-        line = file_sriov.readline()
-    file_sriov.close()
-
-    file_sriov = open(sriov_file, 'w')
-    for key in values.keys():
-        file_sriov.write( key + ' ' + values[key] + '\n')
-
-    file_sriov.close()
+    hwloc_file = os.path.join(path, hostname + DATA_FILES['hwloc'])
+    with open(hwloc_file, 'w') as f:
+        subprocess.call(['hwloc-ls', '--of', 'xml'], stdout=f)
 
 
-def create_sriov_file(path, hostname, operating_system):
+def create_cpu_file(path, hostname, procfs_root=PROCFS_ROOT):
     """
-    Create a file containg SR-IOV info
+    Create file containing CPUs info
 
     :param path: Path where stores the file
     :param hostname: hostname of the machine where the agent is running
-    :param operating_system: operating system of the machine where the agent is running
+    :param procfs_root: root of the procfs tree
     """
-    regex_1 = "'.*Ethernet controller.*\\n.*\\n.*\\n\\tKernel modules: ixgbe'"
-    regex_2 = "'^[0-9]{2}:[0-9]{2}.[0-9]{1}'"
-    regex_3 = "'.*Ethernet controller.*\\n.*\\n.Kernel driver in use: ixgbe"
-    sriov_file = path + '/' + hostname + DATA_FILES['sriov']
-    command_deb = "lspci -knn | grep -Pzo " + regex_1 + " | grep -Pzo " + regex_2 + " > " + sriov_file
-    command_redhat = "lspci -knn | grep -Pzo " + regex_3 + " | grep -Pzo " + regex_2 + " > " + sriov_file
-    if 'debian' in operating_system.lower() or 'ubuntu' in operating_system.lower():
-        os.system(command_deb)
+    cpuinfo_file = os.path.join(path, hostname + DATA_FILES['cpu'])
+    with open(os.path.join(procfs_root, 'cpuinfo')) as cpuinfo:
+        with open(cpuinfo_file, 'w') as f:
+            f.write(cpuinfo.read())
 
-    if 'redhat' in operating_system.lower() or 'fedora' in operating_system.lower():
-        os.system(command_redhat)
 
-    if os.path.isfile(sriov_file):
-        parse_sriov(sriov_file)
+def create_sriov_file(path, hostname, sysfs_root=SYSFS_ROOT):
+    """
+    Create a file containg SR-IOV info,
+    a line with the number of virtual functions for each SR-IOV nic
+
+    :param path: Path where stores the file
+    :param hostname: hostname of the machine where the agent is running
+    :param sysfs_root: root of the sysfs tree
+    """
+    sriov_file = os.path.join(path, hostname + DATA_FILES['sriov'])
+    sriov_devices = get_sriov_devices(sysfs_root)
+    with open(sriov_file, 'w') as f:
+        for pci_busid in sorted(sriov_devices):
+            numvfs, totalvfs = sriov_devices[pci_busid]
+            f.write(pci_busid + ' ' + numvfs + ' ' + totalvfs + '\n')
 
 
 def get_hostname():
@@ -140,10 +194,12 @@ def get_hostname():
 
     :return string: hostname
     """
-    cmd = 'cat /etc/hostname'
-    proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, )
-    hostname = str(proc.communicate()[0])[:-1]
-    return hostname
+    try:
+        with open('/etc/hostname') as f:
+            hostname = f.read().strip()
+    except IOError:
+        hostname = ''
+    return hostname or socket.gethostname()
 
 
 def main(argv):
@@ -183,13 +239,172 @@ def send_files_to_controller(data_path, config):
     priv_key = config_section_map('EpaController', config)['epa_controller_priv_key']
     controller_path = config_section_map('EpaController', config)['epa_controller_path']
 
+    files = []
     for my_file in os.listdir(data_path):
         my_file_extension = my_file.split('_')[-1]
         my_file_extension = '_' + my_file_extension
         if my_file_extension in DATA_FILES.values():
-            command = 'scp -i ' + priv_key + ' ' + data_path + my_file + ' ' \
-                '' + username + '@' + controller + ':' + controller_path + my_file
-            os.system(command)
+            files.append(os.path.join(data_path, my_file))
+
+    # A single scp for all the files
+    if files:
+        subprocess.call(['scp', '-i', priv_key] + files + [username + '@' + controller + ':' + controller_path])
+
+
+def get_payload(data_path, hostname):
+    """
+    Return the content of the files created by the agent
+    as a zlib compressed and base64 encoded JSON, keyed as DATA_FILES
+
+    :param data_path: where files to send are stored
+    :param hostname: hostname of the machine where the agent is running
+    :return string: payload
+    """
+    data = {}
+    for data_type in DATA_FILES:
+        data_file = os.path.join(data_path, hostname + DATA_FILES[data_type])
+        if os.path.isfile(data_file):
+            with open(data_file) as f:
+                data[data_type] = f.read()
+    return base64.b64encode(zlib.compress(json.dumps(data), 9))
+
+
+def get_inline_messages(hostname, payload, chunk_size=CHUNK_SIZE):
+    """
+    Return the messages carrying the payload to the controller.
+    Payloads bigger than chunk_size are split over multiple messages.
+
+    :param hostname: hostname of the machine where the agent is running
+    :param payload: payload returned by get_payload
+    :param chunk_size: maximum size of the payload of a message, 0 to never split it
+    :return list: messages bodies
+    """
+    if chunk_size <= 0 or len(payload) <= chunk_size:
+        return [{'event_type': 'agents.new',
+                 'hostname': hostname,
+                 'payload': payload}]
+
+    payload_id = str(uuid.uuid4())
+    chunks = [payload[i:i + chunk_size] for i in range(0, len(payload), chunk_size)]
+    messages = []
+    for index, chunk in enumerate(chunks):
+        messages.append({'event_type': 'agents.new',
+                         'hostname': hostname,
+                         'payload': chunk,
+                         'payload_id': payload_id,
+                         'chunk_index': index,
+                         'chunk_count': len(chunks)})
+    return messages
+
+
+def collect(data_path, hostname):
+    """
+    Create the files describing the machine
+
+    :param data_path: where to store the files
+    :param hostname: hostname of the machine where the agent is running
+    """
+    create_hwloc_file(data_path, hostname)
+    create_cpu_file(data_path, hostname)
+    create_sriov_file(data_path, hostname)
+    create_dpdk_file(data_path, hostname)
+
+
+def publish(data_path, hostname, config):
+    """
+    Send the files describing the machine to the controller
+    and notify it with the agents messages
+
+    :param data_path: where files to send are stored
+    :param hostname: hostname of the machine where the agent is running
+    :param config: config file instance
+    """
+    # scp copies the files to the controller,
+    # inline sends them within the agents messages
+    transport = config_section_map('EpaAgent', config).get('transport', 'scp')
+    if transport != 'inline':
+        send_files_to_controller(data_path, config)
+    rb_usr = config_section_map('RabbitMQ', config)['rb_name']
+    rb_pwd = config_section_map('RabbitMQ', config)['rb_password']
+    rb_host = config_section_map('RabbitMQ', config)['rb_host']
+    rb_port = config_section_map('RabbitMQ', config)['rb_port']
+    agents_queue = config_section_map('RabbitMQ', config)['agents_queue']
+    conn_string = 'amqp://' + \
+                  rb_usr + ':' \
+                  + rb_pwd + '@' \
+                  + rb_host + ':' \
+                  + rb_port + '/%2F'
+    if transport == 'inline':
+        chunk_size = int(config_section_map('EpaAgent', config).get('chunk_size', CHUNK_SIZE))
+        messages = get_inline_messages(hostname, get_payload(data_path, hostname), chunk_size)
+    else:
+        messages = [{'event_type': 'agents.new',
+                     'hostname': hostname,
+                     'data_path': config_section_map('EpaController', config)['epa_controller_path']}]
+    parameters = pika.URLParameters(conn_string)
+    connection = pika.BlockingConnection(parameters)
+    channel = connection.channel()
+    for body in messages:
+        channel.basic_publish(exchange='',
+                              routing_key=agents_queue,
+                              body=json.dumps(body))
+    connection.close()
+
+
+def get_fingerprint(sysfs_root=SYSFS_ROOT, procfs_root=PROCFS_ROOT):
+    """
+    Return a hash of the hardware state that is cheap to read:
+    PCI devices with their drivers, SR-IOV virtual functions,
+    online CPUs, processors and total memory.
+    Values changing continuously, like the CPU frequency, are ignored.
+
+    :param sysfs_root: root of the sysfs tree
+    :param procfs_root: root of the procfs tree
+    :return string: fingerprint
+    """
+    cpuinfo = []
+    with open(os.path.join(procfs_root, 'cpuinfo')) as f:
+        for line in f:
+            if line.split(':')[0].strip().lower() not in VOLATILE_CPUINFO:
+                cpuinfo.append(line)
+
+    memory = None
+    with open(os.path.join(procfs_root, 'meminfo')) as f:
+        for line in f:
+            if line.startswith('MemTotal:'):
+                memory = line
+                break
+
+    state = [sorted(get_pci_devices(sysfs_root).items()),
+             sorted(get_sriov_devices(sysfs_root).items()),
+             _read_sysfs_value(os.path.join(sysfs_root, 'devices', 'system', 'cpu', 'online')),
+             cpuinfo,
+             memory]
+    return hashlib.sha1(json.dumps(state)).hexdigest()
+
+
+def run_daemon(data_path, hostname, config, interval):
+    """
+    Check the hardware state every interval seconds,
+    collecting and publishing it only when it changed
+    since the last successful publication.
+
+    :param data_path: where to store the files
+    :param hostname: hostname of the machine where the agent is running
+    :param config: config file instance
+    :param interval: seconds between two checks
+    """
+    published = None
+    while True:
+        try:
+            fingerprint = get_fingerprint()
+            if fingerprint != published:
+                collect(data_path, hostname)
+                publish(data_path, hostname, config)
+                published = fingerprint
+        except Exception as exc:
+            print 'Error publishing hardware information: {0}'.format(exc)
+        time.sleep(interval)
 
 
 def config_section_map(section, config_file):
@@ -219,28 +434,9 @@ if __name__ == "__main__":
     config.read(config_file)
     hostname = get_hostname()
     data_path = config_section_map('EpaAgent', config)['data_path']
-    operating_system = config_section_map('EpaAgent', config)['operating_system']
-    create_hwloc_file(data_path, hostname)
-    create_cpu_file(data_path, hostname)
-    create_sriov_file(data_path, hostname, operating_system)
-    create_dpdk_file(data_path, hostname)
-    send_files_to_controller(data_path, config)
-    rb_usr = config_section_map('RabbitMQ', config)['rb_name']
-    rb_pwd = config_section_map('RabbitMQ', config)['rb_password']
-    rb_host = config_section_map('RabbitMQ', config)['rb_host']
-    rb_port = config_section_map('RabbitMQ', config)['rb_port']
-    agents_queue = config_section_map('RabbitMQ', config)['agents_queue']
-    conn_string = 'amqp://' + \
-                  rb_usr + ':' \
-                  + rb_pwd + '@' \
-                  + rb_host + ':' \
-                  + rb_port + '/%2F'
-    body = {'event_type': 'agents.new',
-            'hostname': hostname,
-            'data_path': config_section_map('EpaController', config)['epa_controller_path']}
-    parameters = pika.URLParameters(conn_string)
-    connection = pika.BlockingConnection(parameters)
-    channel = connection.channel()
-    channel.basic_publish(exchange='',
-                          routing_key=agents_queue,
-                          body=json.dumps(body))
\ No newline at end of file
+    interval = int(config_section_map('EpaAgent', config).get('interval', 0))
+    if interval > 0:
+        run_daemon(data_path, hostname, config, interval)
+    else:
+        collect(data_path, hostname)
+        publish(data_path, hostname, config)
@@ -18,6 +18,7 @@ import ConfigParser
 import pika
 from monitoring_service.agents_consumer import AgentsConsumer
 from monitoring_service.notifications_consumer import NotificationsConsumer
+from monitoring_service.openstack_poller import OpenstackPoller
 from common.utils import config_section_map
 from py2neo import neo4j
 from monitoring_service.epa_database.virtual_resources import VirtualResources
@@ -63,10 +64,17 @@ class EpaController(object):
         agents_consumer = AgentsConsumer(config, self.graph_db)
         agents_consumer.start()
 
+        # The poller reads its starting point before the dump,
+        # so that the changes made during the dump are not lost
+        openstack_poller = OpenstackPoller(config, self.graph_db)
+
         # DumpOpenStackDB
 
         VirtualResources(self.graph_db, config)
 
         # Starting NotificationsConsumer
         notifications_consumer = NotificationsConsumer(rb_usr, rb_pwd, rb_host, rb_port, config, self.graph_db)
-        notifications_consumer.start()
\ No newline at end of file
+        notifications_consumer.start()
+
+        # Starting OpenstackPoller, fallback for missed notifications
+        openstack_poller.start()
@@ -19,10 +19,15 @@ Thread Listener of the Agent notifications
 __author__ = 'gpetralia'
 
 from threading import Thread
+from collections import OrderedDict
+import Queue
 import pika
 import json
-from common.utils import config_section_map
-from epa_database.hw_reources import HostHwResources
+import zlib
+import base64
+from StringIO import StringIO
+from common.utils import config_section_map, config_option
+from epa_database.hw_reources import HostHwResources, BATCH_SIZE
 import os
 import logging
 
@@ -34,6 +39,13 @@ DATA_FILES = {
     'sriov': '_sriov.txt'
 }
 
+# Default number of hosts ingested concurrently
+AGENTS_WORKERS = 4
+
+# Seconds spent waiting for messages before sending
+# the acknowledgements of the processed ones
+ACK_INTERVAL = 0.5
+
 
 class AgentsConsumer(Thread):
 
@@ -62,6 +74,33 @@ class AgentsConsumer(Thread):
         self.queue = agents_queue
         self.graph_db = graph_db
 
+        # Parse the hwloc files incrementally, writing in batches
+        self.hwloc_streaming = config_option('EpaDB', 'hwloc_streaming', config, 'false').lower() == 'true'
+        self.hwloc_batch_size = int(config_option('EpaDB', 'hwloc_batch_size', config, BATCH_SIZE))
+
+        # Content hashes of the objects stored for each host,
+        # so that repeated reports only write what changed
+        self.stored_hashes = {}
+
+        # Messages of different hosts are ingested concurrently,
+        # each host is always assigned to the same worker
+        # so that its reports are stored in order
+        self.workers = int(config_option('EpaDB', 'agents_workers', config, AGENTS_WORKERS))
+        if self.workers < 1:
+            print 'Invalid agents_workers {0}, using 1 worker'.format(self.workers)
+            self.workers = 1
+        self.prefetch = int(config_option('RabbitMQ', 'agents_prefetch', config, 2 * self.workers))
+        self.worker_queues = [Queue.Queue() for _ in range(self.workers)]
+
+        # Delivery tags of the processed messages,
+        # acknowledged by the consumer thread
+        self.processed = Queue.Queue()
+
+        # Chunks received of the inline payloads not yet complete,
+        # oldest first, only the last payload of each host is kept.
+        # Chunks are acknowledged once their whole payload is stored
+        self.pending_payloads = OrderedDict()
+
     def consume_agents(self):
         """
         Start the listener of the agents queue
@@ -73,12 +112,58 @@ class AgentsConsumer(Thread):
 
         channel = connection.channel()
         channel.queue_declare(queue=queue_name)
+        channel.basic_qos(prefetch_count=self.prefetch)
+
+        for worker_queue in self.worker_queues:
+            worker = Thread(target=self.ingest_messages, args=(worker_queue,))
+            worker.daemon = True
+            worker.start()
+
         print ' [*] Waiting for agents messages.'
         channel.basic_consume(self.callback,
                               queue=queue_name,
-                              no_ack=True)
+                              no_ack=False)
+
+        # Channels are not thread safe: messages are acknowledged
+        # by this thread once the workers have processed them
+        while True:
+            connection.process_data_events(time_limit=ACK_INTERVAL)
+            self.acknowledge_processed(channel)
+
+    def acknowledge_processed(self, channel):
+        """
+        Acknowledge the messages processed by the workers,
+        together with all the chunks of their payloads.
+        Messages whose ingestion failed are requeued once.
+
+        :param channel: AMQP channel
+        """
+        while True:
+            try:
+                delivery_tags, success, requeue = self.processed.get_nowait()
+            except Queue.Empty:
+                return
+            for delivery_tag in delivery_tags:
+                if success:
+                    channel.basic_ack(delivery_tag=delivery_tag)
+                else:
+                    channel.basic_nack(delivery_tag=delivery_tag, requeue=requeue)
 
-        channel.start_consuming()
+    def ingest_messages(self, worker_queue):
+        """
+        Worker loop storing the machines of the messages
+        assigned to the worker
+
+        :param worker_queue: queue of messages of the worker
+        """
+        while True:
+            delivery_tags, redelivered, hostname, data_path, payload = worker_queue.get()
+            try:
+                self.add_new_machine(hostname, data_path, payload)
+                self.processed.put((delivery_tags, True, False))
+            except Exception as exc:
+                print 'Error storing machine {0}: {1}'.format(hostname, exc)
+                self.processed.put((delivery_tags, False, not redelivered))
 
     def callback(self, ch, method, properties, body):
         """
@@ -90,10 +175,97 @@ class AgentsConsumer(Thread):
         :param properties: properties of the message received (Get)
         :param body: body of the message received
         """
+        try:
+            body_json = json.loads(body)
+        except ValueError:
+            print 'Discarding malformed agent message'
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            return
 
-        body_json = json.loads(body)
-        if body_json['event_type'] == 'agents.new':
-            self.add_new_machine(body_json['hostname'], body_json['data_path'])
+        if body_json.get('event_type') == 'agents.new':
+            hostname = body_json['hostname']
+            data_path = body_json.get('data_path')
+            payload = None
+            delivery_tags = [method.delivery_tag]
+            redelivered = method.redelivered
+            if 'payload' in body_json:
+                complete_payload = self.get_complete_payload(ch, method, hostname, body_json)
+                if complete_payload is None:
+                    return
+                payload, delivery_tags, redelivered = complete_payload
+            worker_queue = self.worker_queues[hash(hostname) % self.workers]
+            worker_queue.put((delivery_tags, redelivered, hostname, data_path, payload))
+        else:
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    def get_complete_payload(self, channel, method, hostname, body_json):
+        """
+        Return the inline payload of a message, joining the chunks
+        of payloads sent over multiple messages.
+        Chunks are kept, not acknowledged, until the last one is received.
+
+        :param channel: AMQP channel
+        :param method: method of the message received (Get)
+        :param hostname: hostname of the agent
+        :param body_json: body of the message received
+        :return tuple: (payload, delivery tags of its chunks, true if any chunk was redelivered),
+                       None if chunks are still missing
+        """
+        chunk_count = body_json.get('chunk_count', 1)
+        if chunk_count == 1:
+            return body_json['payload'], [method.delivery_tag], method.redelivered
+
+        payload_id = body_json['payload_id']
+        pending = self.pending_payloads.get(hostname)
+        if pending is None or pending['payload_id'] != payload_id:
+            if pending is not None:
+                # Chunks of older payloads will not be completed
+                self.discard_pending_payload(channel, hostname, True)
+            pending = {'payload_id': payload_id, 'chunks': {}, 'delivery_tags': [], 'redelivered': False}
+            self.pending_payloads[hostname] = pending
+
+        pending['chunks'][body_json['chunk_index']] = body_json['payload']
+        pending['delivery_tags'].append(method.delivery_tag)
+        pending['redelivered'] = pending['redelivered'] or method.redelivered
+        if len(pending['chunks']) < chunk_count:
+            self.release_prefetch(channel)
+            return None
+
+        del self.pending_payloads[hostname]
+        payload = ''.join(pending['chunks'][index] for index in range(chunk_count))
+        return payload, pending['delivery_tags'], pending['redelivered']
+
+    def release_prefetch(self, channel):
+        """
+        Discard the oldest incomplete payloads while their unacknowledged
+        chunks fill the prefetch window, since no further message,
+        and so no missing chunk, would be delivered
+
+        :param channel: AMQP channel
+        """
+        if self.prefetch <= 0:
+            return
+        while sum(len(pending['delivery_tags']) for pending in self.pending_payloads.itervalues()) \
+                >= self.prefetch:
+            hostname = next(iter(self.pending_payloads))
+            print 'Discarding incomplete payload of {0}: ' \
+                  'its chunks exceed agents_prefetch'.format(hostname)
+            self.discard_pending_payload(channel, hostname, False)
+
+    def discard_pending_payload(self, channel, hostname, superseded):
+        """
+        Drop the chunks received of the incomplete payload of a host
+
+        :param channel: AMQP channel
+        :param hostname: hostname of the agent
+        :param superseded: true if a newer payload of the host replaces it
+        """
+        pending = self.pending_payloads.pop(hostname)
+        for delivery_tag in pending['delivery_tags']:
+            if superseded:
+                channel.basic_ack(delivery_tag=delivery_tag)
+            else:
+                channel.basic_nack(delivery_tag=delivery_tag, requeue=False)
 
     def run(self):
         """
@@ -102,30 +274,75 @@ class AgentsConsumer(Thread):
         """
         self.consume_agents()
 
-    def add_new_machine(self, hostname, data_path):
+    def add_new_machine(self, hostname, data_path=None, payload=None):
         """
         Handle the notification received
         starting the adding process of the new machine
 
         :param hostname: hostname of the machine tobe added
         :param data_path: path where files describing the machine are stored
+        :param payload: inline payload describing the machine, used instead of data_path
 
         """
         pop_name = config_section_map('PoP', self.config)['name']
         hw_resources = HostHwResources(hostname, pop_name, self.graph_db)
-        hwloc_file = dpdk_file = sriov_file = cpu_file = None
-
-        for my_file in os.listdir(data_path):
-            hostname_file = my_file.split('_')[0]
-            file_type = my_file.split('_')[1]
-            if hostname_file == hostname:
-                if 'hwloc' in file_type:
-                    hwloc_file = my_file
-                if 'dpdk' in file_type:
-                    dpdk_file = my_file
-                if 'sriov' in file_type:
-                    sriov_file = my_file
-                if 'cpuinfo' in file_type:
-                    cpu_file = my_file
-
-        hw_resources.store(data_path, hwloc_file, cpu_file, sriov_file, dpdk_file)
+
+        if payload is not None:
+            hwloc_file, cpu_file, sriov_file, dpdk_file = get_payload_files(payload)
+        else:
+            hwloc_file, cpu_file, sriov_file, dpdk_file = get_data_path_files(hostname, data_path)
+
+        stored_hashes = self.stored_hashes.get(hostname)
+        if self.hwloc_streaming:
+            hashes = hw_resources.store_stream(data_path, hwloc_file, cpu_file, sriov_file, dpdk_file,
+                                               batch_size=self.hwloc_batch_size, stored_hashes=stored_hashes)
+        else:
+            hashes = hw_resources.store(data_path, hwloc_file, cpu_file, sriov_file, dpdk_file,
+                                        stored_hashes=stored_hashes)
+        self.stored_hashes[hostname] = hashes
+
+
+def get_data_path_files(hostname, data_path):
+    """
+    Return the names of the files of a host
+    copied by the agent in the data path
+
+    :param hostname: hostname of the machine
+    :param data_path: path where files describing the machine are stored
+    :return tuple: hwloc, cpuinfo, SR-IOV and DPDK file names, None if missing
+    """
+    hwloc_file = dpdk_file = sriov_file = cpu_file = None
+
+    for my_file in os.listdir(data_path):
+        hostname_file = my_file.split('_')[0]
+        file_type = my_file.split('_')[1]
+        if hostname_file == hostname:
+            if 'hwloc' in file_type:
+                hwloc_file = my_file
+            if 'dpdk' in file_type:
+                dpdk_file = my_file
+            if 'sriov' in file_type:
+                sriov_file = my_file
+            if 'cpuinfo' in file_type:
+                cpu_file = my_file
+
+    return hwloc_file, cpu_file, sriov_file, dpdk_file
+
+
+def get_payload_files(payload):
+    """
+    Decode an inline payload sent by the agent:
+    a zlib compressed and base64 encoded JSON
+    with the content of each file, keyed as DATA_FILES
+
+    :param payload: inline payload
+    :return tuple: hwloc, cpuinfo, SR-IOV and DPDK file objects, None if missing
+    """
+    data = json.loads(zlib.decompress(base64.b64decode(payload)))
+    files = []
+    for data_type in ('hwloc', 'cpu', 'sriov', 'dpdk'):
+        if data.get(data_type) is not None:
+            files.append(StringIO(data[data_type].encode('utf-8')))
+        else:
+            files.append(None)
+    return tuple(files)
@@ -23,11 +23,11 @@ __author__ = 'gpetralia'
 
 import xml.etree.ElementTree as Et
 import time
+import hashlib
 import json
 
-import networkx as nx
-
 import common.neo4j_resources as neo_resource
+from hw_topology import HwTopology, get_object_hash, VOLATILE_PROPERTIES
 
 
 # Map numerical types used by hardware locality to string categories
@@ -40,6 +40,21 @@ OSDEVTYPE_CATEGORY_MAP = {
     '5': 'compute',  # HWLOC_OBJ_OSDEV_COPROC
 }
 
+# cpuinfo fields differing between the processors of the same model,
+# stored on the PU nodes. The other fields are stored once
+# in a CPUModel node linked from the PUs, except the volatile ones
+# changing on every report (VOLATILE_PROPERTIES), which are not stored
+PU_CPUINFO_FIELDS = ('id', 'physical id', 'core id', 'apicid', 'initial apicid')
+
+CPU_MODEL_TYPE = 'CPUModel'
+
+# Indexed node property holding the PCI bus ID of PCI devices
+PCI_BUSID = 'pci_busid'
+
+# Default number of nodes or edges written with a single query
+# when storing a topology incrementally
+BATCH_SIZE = 500
+
 
 class HostHwResources(object):
     """
@@ -52,34 +67,39 @@ class HostHwResources(object):
         self.label = 'physical_resource'
         self.index = 'physical_name'
 
-    def store(self, path, hwloc_file, cpu_file=None, sriov_file=None, dpdk_file=None, timestamp=None):
+    def store(self, path, hwloc_file, cpu_file=None, sriov_file=None, dpdk_file=None, timestamp=None,
+              stored_hashes=None):
         """
         Store information contained in files created by the EPA agents into Neo4j.
-        using a networkx graph
-        :param path: Path of the files
+        using a HwTopology
+        :param path: Path of the files, None if the files are given as file objects
         :param hwloc_file: Hardware locality file
         :param cpu_file: Optional cpu information file
         :param sriov_file: Optional SR-IOV information file
         :param dpdk_file: Optional DPDK information file
         :param timestamp: Optional timestamp in epoch
+        :param stored_hashes: Optional content hashes returned by the previous store of the host.
+        If given, only the objects added, changed or removed since then are written.
+        :return dict: content hashes of the stored objects
         """
-        graph = nx.DiGraph()
-        xml_root = Et.parse(path + hwloc_file).getroot()
+        neo_resource.create_index(self.graph_db, (self.label, PCI_BUSID))
+        topology = HwTopology(self.hostname, self.pop_id)
+        xml_root = Et.parse(_get_data_file(path, hwloc_file)).getroot()
         deleted_edges = {}
         for child in xml_root:
-            _parse_object_hwloc(graph, child, self.hostname, deleted_edges, self.pop_id)
+            _parse_object_hwloc(topology, child, deleted_edges)
 
         if cpu_file is not None:
-            processors_dict = _parse_cpu_info(path + cpu_file)
-            _enrich_graph_cpuinfo(graph, processors_dict)
+            processors_dict = _parse_cpu_info(_get_data_file(path, cpu_file))
+            _enrich_topology_cpuinfo(topology, _get_cpu_models(processors_dict, self.hostname))
 
         if dpdk_file is not None:
-            dpdk_dict = _parse_dpdk_info(path + dpdk_file)
-            _enrich_graph_dpdkinfo(graph, dpdk_dict)
+            dpdk_dict = _parse_dpdk_info(_get_data_file(path, dpdk_file))
+            _enrich_topology_dpdkinfo(topology, dpdk_dict)
 
         if sriov_file is not None:
-            sriov_dict = _parse_sriov_info(path + sriov_file)
-            _enrich_graph_sriovinfo(graph, sriov_dict)
+            sriov_dict = _parse_sriov_info(_get_data_file(path, sriov_file))
+            _enrich_topology_sriovinfo(topology, sriov_dict)
 
         if timestamp is not None:
             now = timestamp
@@ -88,7 +108,117 @@ class HostHwResources(object):
 
         neo_id_nodes = {}
 
-        nodes_to_add = []
+        hashes = topology.get_hashes()
+        if stored_hashes is None:
+            nodes_stored = self.get_stored_nodes()
+        else:
+            nodes_stored = stored_hashes.keys()
+
+        for name in topology.objects:
+            if stored_hashes is None or stored_hashes.get(name) != hashes[name]:
+                neo_id_nodes[name] = neo_resource.add_node(self.graph_db, (self.label, self.index, name), now,
+                                                           _get_neo_node(name, topology.get_properties(name)))
+
+        for node in nodes_stored:
+            if node not in topology.objects:
+                neo_resource.delete_node(self.graph_db, (self.label, self.index, node))
+
+        for source, target in topology.edges:
+            # Incoming edges are part of the hash of the target
+            if target not in neo_id_nodes:
+                continue
+            edge_label = topology.edges[(source, target)]
+            db_src = neo_id_nodes.get(source)
+            if db_src is None:
+                db_src = neo_resource.get_node(self.graph_db, (self.label, self.index, source))
+            db_target = neo_id_nodes[target]
+            rel_stored = neo_resource.get_edge(self.graph_db, db_src, db_target)
+            if rel_stored is None:
+                neo_resource.add_edge(self.graph_db, db_src, db_target, now, edge_label)
+            else:
+                neo_resource.update_edge(self.graph_db, now, edge_label, db_src=db_src, db_target=db_target)
+
+        return hashes
+
+    def store_stream(self, path, hwloc_file, cpu_file=None, sriov_file=None, dpdk_file=None, timestamp=None,
+                     batch_size=BATCH_SIZE, stored_hashes=None):
+        """
+        Store information contained in files created by the EPA agents into Neo4j,
+        parsing the hwloc file incrementally and writing nodes and edges in batches,
+        without building the whole topology in memory.
+        :param path: Path of the files, None if the files are given as file objects
+        :param hwloc_file: Hardware locality file
+        :param cpu_file: Optional cpu information file
+        :param sriov_file: Optional SR-IOV information file
+        :param dpdk_file: Optional DPDK information file
+        :param timestamp: Optional timestamp in epoch
+        :param batch_size: number of nodes or edges written with a single query
+        :param stored_hashes: Optional content hashes returned by the previous store of the host.
+        If given, only the objects added, changed or removed since then are written.
+        :return dict: content hashes of the stored objects
+        """
+        neo_resource.create_index(self.graph_db, (self.label, PCI_BUSID))
+        processors_dict = sriov_dict = dpdk_dict = None
+        if cpu_file is not None:
+            processors_dict = _parse_cpu_info(_get_data_file(path, cpu_file))
+
+        if dpdk_file is not None:
+            dpdk_dict = _parse_dpdk_info(_get_data_file(path, dpdk_file))
+
+        if sriov_file is not None:
+            sriov_dict = _parse_sriov_info(_get_data_file(path, sriov_file))
+
+        if timestamp is not None:
+            now = timestamp
+        else:
+            now = time.time()
+
+        if stored_hashes is None:
+            nodes_stored = self.get_stored_nodes()
+        else:
+            nodes_stored = stored_hashes.keys()
+        hashes = {}
+
+        # Edges are yielded before the node record of their target,
+        # they are kept until the target is known to be changed
+        in_edges = {}
+        nodes = []
+        edges = []
+        for record in iter_hwloc_records(_get_data_file(path, hwloc_file), self.hostname, self.pop_id,
+                                         processors_dict, sriov_dict, dpdk_dict):
+            if record[0] == 'edge':
+                in_edges.setdefault(record[2], []).append(record[1:])
+                continue
+
+            node_name = record[1]
+            node_edges = in_edges.pop(node_name, [])
+            hashes[node_name] = get_object_hash(record[2], [(edge[0], edge[2]) for edge in node_edges])
+            if stored_hashes is not None and stored_hashes.get(node_name) == hashes[node_name]:
+                continue
+
+            nodes.append((node_name, _get_neo_node(node_name, record[2])))
+            edges.extend(node_edges)
+            if len(nodes) >= batch_size:
+                neo_resource.add_nodes(self.graph_db, self.label, self.index, nodes, now)
+                nodes = []
+            if len(edges) >= batch_size:
+                neo_resource.add_edges(self.graph_db, self.label, self.index, edges, now)
+                edges = []
+
+        neo_resource.add_nodes(self.graph_db, self.label, self.index, nodes, now)
+        neo_resource.add_edges(self.graph_db, self.label, self.index, edges, now)
+
+        for node in nodes_stored:
+            if node not in hashes:
+                neo_resource.delete_node(self.graph_db, (self.label, self.index, node))
+
+        return hashes
+
+    def get_stored_nodes(self):
+        """
+        Return the names of the physical nodes of the host stored in Neo4j
+        :return list: names of the nodes
+        """
         nodes_stored = []
 
         query_string = 'Match n Where n.hostname = {hostname} ' \
@@ -97,107 +227,189 @@ class HostHwResources(object):
         res = self.graph_db.cypher.execute(query_string, hostname=self.hostname, resource_type='physical')
 
         for item in res:
-            print str(item)
             nodes_stored.append(item['n.physical_name'])
+        return nodes_stored
 
-        for nx_node in graph.nodes():
-            nodes_to_add.append(str(nx_node))
-            neo_id_nodes[nx_node] = neo_resource.add_node(self.graph_db, (self.label, self.index, nx_node), now,
-                                                          get_node_properties(graph, nx_node))
 
-        nodes_to_remove = [item for item in nodes_stored if item not in nodes_to_add]
+def _get_data_file(path, data_file):
+    """
+    Return the path of a file created by the agents
+    or the file itself, if given as a file object
+    :param path: Path of the file, None for file objects
+    :param data_file: file name or file object
+    :return: file path or file object
+    """
+    if path is None:
+        return data_file
+    return path + data_file
 
-        for node in nodes_to_remove:
-            neo_resource.delete_node(self.graph_db, (self.label, self.index, node))
 
-        for edge in graph.edges():
-            source = edge[0]
-            target = edge[1]
-            edge_label = ''
-            if 'label' in graph.edge[source][target]:
-                edge_label = graph.edge[source][target]['label']
-            db_src = neo_id_nodes[source]
-            db_target = neo_id_nodes[target]
-            rel_stored = neo_resource.get_edge(self.graph_db, db_src, db_target)
-            if rel_stored is None:
-                neo_resource.add_edge(self.graph_db, db_src, db_target, timestamp, edge_label)
-            else:
-                neo_resource.update_edge(self.graph_db, timestamp, edge_label, db_src=db_src, db_target=db_target)
+def _iter_lines(data_file):
+    """
+    Iterate over the lines of a file
+    :param data_file: file path or file object
+    """
+    if hasattr(data_file, 'read'):
+        for line in data_file:
+            yield line
+    else:
+        with open(data_file) as f:
+            for line in f:
+                yield line
 
 
-def get_node_properties(graph, node_name):
+def _get_neo_node(node_name, properties):
     """
-    Return a dict containing nodes properties
-    :param graph: Networkx graph
+    Return a dict containing the properties of a node
+    ready to be stored
     :param node_name: name of the node
+    :param properties: properties of the parsed node
     :return dict: Node properties
     """
     neo_node = {}
 
-    for item in graph.node[str(node_name)]:
+    for item in properties:
 
-        if isinstance((graph.node[str(node_name)][item]), dict):
-            neo_node[item] = json.dumps(graph.node[str(node_name)][item])
+        # dicts are encoded by neo4j_resources,
+        # which also indexes the scalar attributes
+        if isinstance(properties[item], dict):
+            neo_node[item] = properties[item]
         else:
-            neo_node[item] = str(graph.node[str(node_name)][item])
+            neo_node[item] = str(properties[item])
 
     neo_node['physical_name'] = node_name
+
+    # PCI devices are looked up by bus ID when wiring SR-IOV ports
+    if 'pci_busid' in properties.get('attributes', {}):
+        neo_node[PCI_BUSID] = str(properties['attributes']['pci_busid'])
     return neo_node
 
 
-def _enrich_graph_sriovinfo(graph, sriov_dict):
+def _enrich_topology_sriovinfo(topology, sriov_dict):
+    """
+    Enrich the topology with SR-IOV information
+    :param topology: HwTopology
+    :param sriov_dict: SR-IOV information
+    """
+    for pci_busid in sriov_dict:
+        for hw_object in topology.get_by_pci_busid(pci_busid):
+            hw_object.attributes['sriov'] = sriov_dict[pci_busid]
+
+
+def _enrich_node_sriovinfo(attr, sriov_dict):
     """
-    Enrich the graph with SR-IOV information
-    :param graph: networkx graph
+    Enrich a node with SR-IOV information
+    :param attr: node properties
     :param sriov_dict: SR-IOV information
     """
-    for node, attr in graph.nodes(data=True):
-        if 'pci_busid' in attr['attributes'].keys() and attr['attributes']['pci_busid'] in sriov_dict.keys():
-            attr['attributes']['sriov'] = sriov_dict[attr['attributes']['pci_busid']]
+    if 'pci_busid' in attr['attributes'] and attr['attributes']['pci_busid'] in sriov_dict:
+        attr['attributes']['sriov'] = sriov_dict[attr['attributes']['pci_busid']]
 
 
-def _enrich_graph_dpdkinfo(graph, dpdk_dict):
+def _enrich_topology_dpdkinfo(topology, dpdk_dict):
     """
-    Enrich the graph with DPDK information
-    :param graph: networkx graph
+    Enrich the topology with DPDK information
+    :param topology: HwTopology
     :param dpdk_dict: DPDK information
     """
-    for node, attr in graph.nodes(data=True):
-        if 'pci_busid' in attr['attributes'].keys() and attr['attributes']['pci_busid'] in dpdk_dict.keys():
-            attr['attributes']['dpdk'] = True
+    for pci_busid in dpdk_dict:
+        for hw_object in topology.get_by_pci_busid(pci_busid):
+            hw_object.attributes['dpdk'] = True
 
 
-def _enrich_graph_cpuinfo(graph, processors_dict):
+def _enrich_node_dpdkinfo(attr, dpdk_dict):
     """
-    Navigate the graph and
-    add attributes from processor_list
-    to the PU nodes.
+    Enrich a node with DPDK information
+    :param attr: node properties
+    :param dpdk_dict: DPDK information
+    """
+    if 'pci_busid' in attr['attributes'] and attr['attributes']['pci_busid'] in dpdk_dict:
+        attr['attributes']['dpdk'] = True
 
-    The key between processor_list and hwlock_graph
-    is the os_index attribute.
 
-    :param graph: the graph that should be enriched
+def _get_cpu_models(processors_dict, hostname):
+    """
+    Split the attributes of each processor between the ones
+    of its CPU model, shared by identical processors,
+    and the ones of the processor itself
+
     :param processors_dict: a dict of cpu attributes
+    :param hostname: hostname of the host
+    :return tuple: (dict CPU model name -> CPU model attributes,
+    dict processor index -> (CPU model name, processor attributes))
+    """
+    models = {}
+    processors = {}
+    for index in processors_dict:
+        model_attributes = {}
+        pu_attributes = {}
+        for key, value in processors_dict[index].items():
+            if key in VOLATILE_PROPERTIES:
+                continue
+            if key in PU_CPUINFO_FIELDS:
+                pu_attributes[key] = value
+            else:
+                model_attributes[key] = value
+
+        model_hash = hashlib.sha1(json.dumps(model_attributes, sort_keys=True)).hexdigest()
+        model_name = hostname + '_' + CPU_MODEL_TYPE + '_' + model_hash[:12]
+        models[model_name] = model_attributes
+        processors[index] = (model_name, pu_attributes)
+    return models, processors
+
+
+def _enrich_topology_cpuinfo(topology, cpu_models):
+    """
+    Add attributes from processor_list
+    to the PU objects of the topology,
+    linking each PU to its CPU model.
+
+    The key between processor_list and hwloc
+    is the os_index attribute.
+
+    :param topology: the HwTopology that should be enriched
+    :param cpu_models: CPU models and processors returned by _get_cpu_models
+    """
+    models, processors = cpu_models
+    for index in processors:
+        hw_object = topology.get_by_os_index('PU', index)
+        if hw_object is not None:
+            model_name, pu_attributes = processors[index]
+            hw_object.attributes.update(pu_attributes)
+            if model_name not in topology.objects:
+                topology.add_object(model_name, CPU_MODEL_TYPE, 'compute', models[model_name])
+            topology.add_edge(hw_object.name, model_name)
+
+
+def _enrich_node_cpuinfo(node, attr, processors):
     """
-    for node, attr in graph.nodes(data=True):
-        if '_PU_' in node:
-            index = int(attr['attributes']['os_index'])
-            attr['attributes'].update(processors_dict[index])
+    Add attributes from processor_list to a PU node
+    :param node: name of the node
+    :param attr: node properties
+    :param processors: processors returned by _get_cpu_models
+    :return string: name of the CPU model of the PU, None if unknown
+    """
+    if '_PU_' in node:
+        index = int(attr['attributes']['os_index'])
+        if index in processors:
+            model_name, pu_attributes = processors[index]
+            attr['attributes'].update(pu_attributes)
+            return model_name
+    return None
 
 
 def _parse_sriov_info(sriov_info_file):
     """
     Create a dict containing information extracted from the SR-IOV file
-    :param sriov_info_file: SR-IOV file
+    :param sriov_info_file: SR-IOV file path or file object
     :return dict: SR-IOV information
     """
     sriov_dict = {}
-    with open(sriov_info_file) as f:
-        for line in f:
-            line = sanitize_string(line)
-            attr = line.split(' ')
-            if len(attr) == 3:
-                sriov_dict[attr[0]] = {"numvfs": attr[1], "totalvfs": attr[2]}
+    for line in _iter_lines(sriov_info_file):
+        line = sanitize_string(line)
+        attr = line.split(' ')
+        if len(attr) == 3:
+            sriov_dict[attr[0]] = {"numvfs": attr[1], "totalvfs": attr[2]}
 
     return sriov_dict
 
@@ -205,14 +417,13 @@ def _parse_sriov_info(sriov_info_file):
 def _parse_dpdk_info(dpdk_info_file):
     """
     Create a dict containing information extracted from the DPDK file
-    :param dpdk_info_file: DPDK file
+    :param dpdk_info_file: DPDK file path or file object
     :return dict: DPDK information
     """
     dpdk_dict = {}
-    with open(dpdk_info_file) as f:
-        for line in f:
-            line = sanitize_string(line)
-            dpdk_dict[line] = {"dpdk": True}
+    for line in _iter_lines(dpdk_info_file):
+        line = sanitize_string(line)
+        dpdk_dict[line] = {"dpdk": True}
 
     return dpdk_dict
 
@@ -223,92 +434,176 @@ def _parse_cpu_info(cpu_info_file):
     and create a dict of processors.
     Each processor is a dict with all the attributes given by cpuinfo.
 
-    :param cpu_info_file: Text file with the output of cat /proc/cpuinfo
+    :param cpu_info_file: Text file with the output of cat /proc/cpuinfo, path or file object
     :return processors_dict: Dictionary containing attributes of each proc
     """
     processors_dict = {}
 
-    with open(cpu_info_file) as f:
-        current_id = None
-        for line in f:
-            attr = line.split(':')
+    current_id = None
+    for line in _iter_lines(cpu_info_file):
+        attr = line.split(':')
 
-            if len(attr) > 1:
-                attr[0] = sanitize_string(attr[0])
-                attr[1] = sanitize_string(attr[1])
+        if len(attr) > 1:
+            attr[0] = sanitize_string(attr[0])
+            attr[1] = sanitize_string(attr[1])
 
-                if 'processor' in attr[0]:
-                    current_id = int(attr[1])
-                    processors_dict[current_id] = {}
-                    processors_dict[current_id]['id'] = attr[1]
-                elif current_id is not None and attr[1] is not None and attr[1] is not '':
-                    processors_dict[current_id][attr[0]] = attr[1]
+            if 'processor' in attr[0]:
+                current_id = int(attr[1])
+                processors_dict[current_id] = {}
+                processors_dict[current_id]['id'] = attr[1]
+            elif current_id is not None and attr[1] is not None and attr[1] is not '':
+                processors_dict[current_id][attr[0]] = attr[1]
 
     return processors_dict
 
 
-def _parse_object_hwloc(graph, obj, host_name, deleted_edges, pop_id, parent=None):
+def _parse_object_hwloc(topology, obj, deleted_edges):
     """
     Given an xml object extracted from Hardware locality file, create the
-    corresponding node in the Networkx graph
+    corresponding objects in the topology for it and all its descendants.
+
+    The tree is walked iteratively: every pending object carries the name,
+    type and cache depth of its parent and the node its parent is attached to,
+    so the parsing is linear in the number of objects.
 
-    :param graph: netowrkx graph
-    :param obj: xml object
-    :param host_name: hostname of the host who the hwloc obj belongs to
+    :param topology: HwTopology
+    :param obj: root xml object
     :param deleted_edges: list of edges to delete
-    :param pop_id: PoP ID
-    :param parent: Optional reference to the parent of the current object
-    """
-    object_children = []
-    new_node_properties = {
-        'resource_type': 'physical',
-        'category': _get_category(obj),
-        'type': obj.attrib['type'],
-        'hostname': host_name,
-        'pop': pop_id,
-        'attributes': _get_attributes(obj)
-    }
-
-    node_name = _get_unique_name(obj, host_name)
-
-    attr = obj.attrib.copy()
-    del attr['type']
-
-    # Saving the children to be parsed
-    for child in obj:
-        if child.tag == 'object':
-            object_children.append(child)
-
-    graph.add_node(node_name, attr_dict=new_node_properties)
-
-    # Adding the edge between current node and the parent
-    if parent is not None:
-        graph.add_edge(parent, node_name, label='INTERNAL')
-        if parent in deleted_edges.keys():
-            graph.add_edge(deleted_edges[parent], node_name, label='INTERNAL')
-
-    # Resolving the bug of hwloc that shows
-    # the 2 caches L1 (data and instruction)
-    # as they are one under the other
-    if parent is not None:
-        if new_node_properties['type'] == 'Cache':
-            parent_type = ''
-            parent_depth = ''
-            for node, node_attr in graph.nodes(data=True):
-                if node == parent:
-                    parent_type = node_attr['type']
-                    if parent_type == 'Cache':
-                        parent_depth = node_attr['attributes']['depth']
-
-            if parent_type == new_node_properties['type'] and attr['depth'] == parent_depth:
-                graph.remove_edge(parent, node_name)
+    """
+    # Objects to be parsed, with the context of their parent
+    stack = [(obj, None, None, None, None)]
+
+    while stack:
+        obj, parent, parent_type, parent_depth, parent_attached_to = stack.pop()
+
+        obj_type = obj.attrib['type']
+        attributes = _get_attributes(obj)
+        node_name = _get_unique_name(obj, topology.hostname)
+
+        topology.add_object(node_name, obj_type, _get_category(obj), attributes)
+
+        # Adding the edge between current node and the parent
+        attached_to = parent
+        if parent is not None:
+            if parent in deleted_edges:
+                topology.add_edge(deleted_edges[parent], node_name)
+
+            # Resolving the bug of hwloc that shows
+            # the 2 caches L1 (data and instruction)
+            # as they are one under the other
+            if obj_type == 'Cache' and parent_type == 'Cache' and obj.attrib['depth'] == parent_depth:
                 deleted_edges[node_name] = parent
-                parent = graph.pred[parent].keys()[0]
-                graph.add_edge(parent, node_name, label='INTERNAL')
+                attached_to = parent_attached_to
+
+            if attached_to is not None:
+                topology.add_edge(attached_to, node_name)
+
+        # Children are pushed in reverse order,
+        # so that they are parsed in document order
+        depth = attributes.get('depth')
+        for child in reversed([child for child in obj if child.tag == 'object']):
+            stack.append((child, node_name, obj_type, depth, attached_to))
+
+
+def iter_hwloc_records(hwloc_file, host_name, pop_id, processors_dict=None, sriov_dict=None, dpdk_dict=None):
+    """
+    Parse incrementally a Hardware locality file, yielding the records of
+    the nodes and of the edges of its topology as soon as they are parsed.
+    Parsed objects are cleared, so memory does not grow with the file size.
+
+    Records are tuples ('node', node name, node properties)
+    and ('edge', source name, target name, edge label).
+    An edge can be yielded before the node record of its source.
+    CPU models are yielded last, after the edges from their PUs.
+
+    :param hwloc_file: Hardware locality file path or file object
+    :param host_name: hostname of the host who the hwloc file belongs to
+    :param pop_id: PoP ID
+    :param processors_dict: optional cpu information
+    :param sriov_dict: optional SR-IOV information
+    :param dpdk_dict: optional DPDK information
+    """
+    models = processors = None
+    if processors_dict is not None:
+        models, processors = _get_cpu_models(processors_dict, host_name)
+    models_used = set()
+
+    root = None
+    # Open objects:
+    # (element, name, type, depth, name of the node it is attached to,
+    # name of the cache it was moved from by the L1 caches fix)
+    stack = []
+
+    for event, elem in Et.iterparse(hwloc_file, events=('start', 'end')):
+        if root is None:
+            root = elem
+
+        if elem.tag != 'object':
+            continue
+
+        if event == 'start':
+            node_name = _get_unique_name(elem, host_name)
+            node_type = elem.attrib['type']
+            depth = elem.attrib.get('depth')
+            attached_to = None
+            moved_from = None
+
+            if stack:
+                parent = stack[-1]
+                attached_to = parent[1]
+                if parent[5] is not None:
+                    yield ('edge', parent[5], node_name, 'INTERNAL')
+
+                # Resolving the bug of hwloc that shows
+                # the 2 caches L1 (data and instruction)
+                # as they are one under the other
+                if node_type == 'Cache' and parent[2] == 'Cache' and depth == parent[3]:
+                    moved_from = parent[1]
+                    attached_to = parent[4]
+
+                if attached_to is not None:
+                    yield ('edge', attached_to, node_name, 'INTERNAL')
+
+            stack.append((elem, node_name, node_type, depth, attached_to, moved_from))
+
+        else:
+            node_name = stack.pop()[1]
+            properties = {
+                'resource_type': 'physical',
+                'category': _get_category(elem),
+                'type': elem.attrib['type'],
+                'hostname': host_name,
+                'pop': pop_id,
+                'attributes': _get_attributes(elem)
+            }
+            model_name = None
+            if processors is not None:
+                model_name = _enrich_node_cpuinfo(node_name, properties, processors)
+            if dpdk_dict is not None:
+                _enrich_node_dpdkinfo(properties, dpdk_dict)
+            if sriov_dict is not None:
+                _enrich_node_sriovinfo(properties, sriov_dict)
+
+            yield ('node', node_name, properties)
+            if model_name is not None:
+                models_used.add(model_name)
+                yield ('edge', node_name, model_name, 'INTERNAL')
+
+            elem.clear()
+            if stack:
+                stack[-1][0].remove(elem)
+            else:
+                root.remove(elem)
 
-    # Recursively calls the function to parse the child of current node
-    for obj in object_children:
-        _parse_object_hwloc(graph, obj, host_name, deleted_edges, pop_id, parent=node_name)
+    for model_name in models_used:
+        yield ('node', model_name, {
+            'resource_type': 'physical',
+            'category': 'compute',
+            'type': CPU_MODEL_TYPE,
+            'hostname': host_name,
+            'pop': pop_id,
+            'attributes': models[model_name]
+        })
 
 
 def _get_category(hw_obj):
@@ -367,7 +662,6 @@ def _get_unique_name(hw_obj, hostname):
         return hostname + '_' + 'OSDev' + '_' + hw_obj.attrib['name']
 
     if obj_type == 'Core':
-        print "Core"
         return hostname + '_' + 'Core' + '_' + hw_obj.attrib['cpuset']
 
     return hostname + '_' + hw_obj.attrib['type'] + '_' + hw_obj.attrib['os_index']
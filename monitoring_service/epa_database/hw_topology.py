@@ -0,0 +1,174 @@
+# Copyright 2015 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+In-memory model of the hardware topology of a host
+"""
+
+__author__ = 'gpetralia'
+
+import hashlib
+import json
+
+
+# Attributes changing on every report, such as the current
+# CPU frequency, left out of the content hashes
+VOLATILE_PROPERTIES = frozenset(['cpu mhz'])
+
+
+def get_object_hash(properties, in_edges):
+    """
+    Return the content hash of a hardware object,
+    covering its properties and its incoming edges.
+    Volatile attributes are not covered, they are written
+    only when something else of the object changes.
+    :param properties: node properties of the object
+    :param in_edges: list of (source name, label) of the incoming edges
+    :return string: content hash
+    """
+    attributes = properties.get('attributes')
+    if isinstance(attributes, dict) and VOLATILE_PROPERTIES.intersection(attributes):
+        properties = dict(properties)
+        properties['attributes'] = dict((key, value) for key, value in attributes.items()
+                                        if key not in VOLATILE_PROPERTIES)
+    content = json.dumps([properties, sorted(in_edges)], sort_keys=True)
+    return hashlib.sha1(content).hexdigest()
+
+
+class HwObject(object):
+    """
+    Hardware object of the topology.
+    Properties shared by all the objects of a host
+    are kept by the topology.
+    """
+    __slots__ = ('name', 'type', 'category', 'attributes')
+
+    def __init__(self, name, obj_type, category, attributes):
+        self.name = name
+        self.type = obj_type
+        self.category = category
+        self.attributes = attributes
+
+
+class HwTopology(object):
+    """
+    Hardware objects of a host and the edges between them,
+    indexed by type, PCI bus ID and OS index
+    """
+    def __init__(self, hostname, pop_id):
+        self.hostname = hostname
+        self.pop_id = pop_id
+        self.objects = {}
+        # (source name, target name) -> label
+        self.edges = {}
+        self._by_type = {}
+        self._by_pci_busid = {}
+        self._by_os_index = {}
+
+    def add_object(self, name, obj_type, category, attributes):
+        """
+        Add a hardware object to the topology
+        :param name: unique name of the object
+        :param obj_type: hwloc type of the object
+        :param category: category of the object
+        :param attributes: dict of attributes of the object
+        :return HwObject: the object added
+        """
+        hw_object = HwObject(name, obj_type, category, attributes)
+        self.objects[name] = hw_object
+        self._by_type.setdefault(obj_type, []).append(hw_object)
+        if 'pci_busid' in attributes:
+            self._by_pci_busid.setdefault(attributes['pci_busid'], []).append(hw_object)
+        if 'os_index' in attributes:
+            self._by_os_index[(obj_type, attributes['os_index'])] = hw_object
+        return hw_object
+
+    def add_edge(self, source, target, label='INTERNAL'):
+        """
+        Add an edge between two objects
+        :param source: name of the source object
+        :param target: name of the target object
+        :param label: label of the edge
+        """
+        self.edges[(source, target)] = label
+
+    def get_by_type(self, obj_type):
+        """
+        Return the objects of the given type
+        :param obj_type: hwloc type
+        :return list: objects
+        """
+        return self._by_type.get(obj_type, [])
+
+    def get_by_pci_busid(self, pci_busid):
+        """
+        Return the objects with the given PCI bus ID
+        :param pci_busid: PCI bus ID
+        :return list: objects
+        """
+        return self._by_pci_busid.get(pci_busid, [])
+
+    def get_by_os_index(self, obj_type, os_index):
+        """
+        Return the object of the given type with the given OS index
+        :param obj_type: hwloc type
+        :param os_index: OS index
+        :return HwObject: object, None if not found
+        """
+        return self._by_os_index.get((obj_type, str(os_index)))
+
+    def get_properties(self, name):
+        """
+        Return the properties of a node as built by the hwloc parser
+        :param name: name of the object
+        :return dict: node properties
+        """
+        hw_object = self.objects[name]
+        return {
+            'resource_type': 'physical',
+            'category': hw_object.category,
+            'type': hw_object.type,
+            'hostname': self.hostname,
+            'pop': self.pop_id,
+            'attributes': hw_object.attributes
+        }
+
+    def get_hashes(self):
+        """
+        Return the content hashes of the objects of the topology
+        :return dict: object name -> content hash
+        """
+        in_edges = {}
+        for source, target in self.edges:
+            in_edges.setdefault(target, []).append((source, self.edges[(source, target)]))
+
+        hashes = {}
+        for name in self.objects:
+            hashes[name] = get_object_hash(self.get_properties(name), in_edges.get(name, []))
+        return hashes
+
+    def to_networkx(self):
+        """
+        Export the topology as a networkx DiGraph.
+        It requires networkx.
+        :return DiGraph: graph of the topology
+        """
+        import networkx as nx
+
+        graph = nx.DiGraph()
+        for name in self.objects:
+            graph.add_node(name, attr_dict=self.get_properties(name))
+        for source, target in self.edges:
+            graph.add_edge(source, target, label=self.edges[(source, target)])
+        return graph
@@ -20,6 +20,29 @@ __author__ = 'gpetralia'
 
 from contextlib import closing
 import mysql.connector as MySQLdb
+from db_utils import iter_rows, RowMapper, FETCH_SIZE
+
+# Columns of the Cinder tables, compiled once in row mappers
+VOLUMES = RowMapper(
+    'v.id', 'volumes v',
+    [('v.display_name', 'name'), ('v.host', 'host')],
+    ['v.ec2_id', 'v.user_id', 'v.project_id', 'v.size', 'v.availability_zone', 'v.instance_uuid',
+     'v.mountpoint', 'v.attach_time', 'v.status', 'v.attach_status', 'v.display_description',
+     'v.provider_location', 'v.provider_auth', 'v.snapshot_id', 'v.volume_type_id', 'v.source_volid',
+     'v.bootable', 'v.attached_host', 'v.provider_geometry', 'v._name_id', 'v.encryption_key_id',
+     'v.migration_status', 'v.replication_status', 'v.replication_extended_status',
+     'v.replication_driver_data', 'v.consistencygroup_id'],
+    {'resource_type': 'virtual', 'type': 'volume', 'category': 'storage'})
+
+VOLUMES_QUERY = VOLUMES.query + ' where v.deleted = 0'
+
+SNAPSHOTS = RowMapper(
+    's.id', 'snapshots s',
+    [('s.display_name', 'name')],
+    ['s.volume_id', 's.user_id', 's.project_id', 's.status', 's.progress', 's.volume_size',
+     's.display_description', 's.provider_location', 's.encryption_key_id', 's.volume_type_id',
+     's.cgsnapshot_id'],
+    {'resource_type': 'virtual', 'category': 'storage', 'type': 'snapshot'})
 
 
 class CinderDb():
@@ -80,31 +103,15 @@ class CinderDb():
         res = {}
         with closing(self.conn.cursor()) as cur:
 
-            query = 'select * from snapshots where deleted != 1'
+            query = SNAPSHOTS.query + ' where s.deleted != 1'
 
             if uuid:
-                query += ' and id = "' + uuid + '"'
+                query += ' and s.id = "' + uuid + '"'
 
             cur.execute(query)
 
             for row in cur.fetchall():
-                res[row[4]] = {}
-                res[row[4]]['resource_type'] = 'virtual'
-                res[row[4]]['name'] = row[12]
-                res[row[4]]['category'] = 'storage'
-                res[row[4]]['type'] = 'snapshot'
-                res[row[4]]['attributes'] = {}
-                res[row[4]]['attributes']['volume_id'] = row[5]
-                res[row[4]]['attributes']['user_id'] = row[6]
-                res[row[4]]['attributes']['project_id'] = row[7]
-                res[row[4]]['attributes']['status'] = row[8]
-                res[row[4]]['attributes']['progress'] = row[9]
-                res[row[4]]['attributes']['volume_size'] = row[10]
-                res[row[4]]['attributes']['display_description'] = row[13]
-                res[row[4]]['attributes']['provider_location'] = row[14]
-                res[row[4]]['attributes']['encryption_key_id'] = row[15]
-                res[row[4]]['attributes']['volume_type_id'] = row[16]
-                res[row[4]]['attributes']['cgsnapshot_id'] = row[17]
+                res[row[0]] = SNAPSHOTS(row)
         return res
 
     def get_cinder_volumes(self, uuid=None):
@@ -113,14 +120,10 @@ class CinderDb():
         :param uuid: UUid of Cinder Volume
         """
         res = {}
+        services = self.get_cinder_volume_service_hosts()
         with closing(self.conn.cursor()) as cur:
 
-            query = 'select v.id, v.ec2_id, v.user_id, v.project_id, v.host, v.size, v.availability_zone, ' \
-                    'v.instance_uuid, v.mountpoint, v.attach_time, v.status, v.attach_status, v.display_name, ' \
-                    'v.display_description, v.provider_location, v.provider_auth, v.snapshot_id, v.volume_type_id, ' \
-                    'v.source_volid, v.bootable, v.attached_host, v.provider_geometry, v._name_id, v.encryption_key_id, ' \
-                    'v.migration_status, v.replication_status, v.replication_extended_status, v.replication_driver_data, ' \
-                    'v.consistencygroup_id from volumes v where v.deleted = 0'
+            query = VOLUMES_QUERY
 
             if uuid:
                 query += ' and v.id = "' + uuid + '"'
@@ -128,58 +131,75 @@ class CinderDb():
             cur.execute(query)
 
             for row in cur.fetchall():
-                res[row[0]] = {}
-                res[row[0]]['resource_type'] = 'virtual'
-                res[row[0]]['name'] = row[12]
-                res[row[0]]['type'] = 'volume'
-                res[row[0]]['category'] = 'storage'
-                res[row[0]]['attributes'] = {}
-                res[row[0]]['attributes']['ec2_id'] = row[1]
-                res[row[0]]['attributes']['user_id'] = row[2]
-                res[row[0]]['attributes']['project_id'] = row[3]
-
-                if '#' in row[4]:
-                    cinder_vol = row[4].split('#')[0]
-                else:
-                    cinder_vol = row[4]
+                res[row[0]] = _get_volume(row, services)
 
-                if '@' in cinder_vol:
-                    host = cinder_vol.split('@')[0]
-                else:
-                    host = cinder_vol
-
-                res[row[0]]['attributes']['cinder_volume'] = cinder_vol
-                res[row[0]]['hostname'] = host
-                res[row[0]]['attributes']['size'] = row[5]
-                res[row[0]]['attributes']['availability_zone'] = row[6]
-                res[row[0]]['attributes']['instance_uuid'] = row[7]
-                res[row[0]]['attributes']['mountpoint'] = row[8]
-                res[row[0]]['attributes']['attach_time'] = row[9]
-                res[row[0]]['attributes']['status'] = row[10]
-                res[row[0]]['attributes']['attach_status'] = row[11]
-                res[row[0]]['attributes']['display_description'] = row[13]
-                res[row[0]]['attributes']['provider_location'] = row[14]
-                res[row[0]]['attributes']['provider_auth'] = row[15]
-                res[row[0]]['attributes']['snapshot_id'] = row[16]
-                res[row[0]]['attributes']['volume_type_id'] = row[17]
-                res[row[0]]['attributes']['source_volid'] = row[18]
-                res[row[0]]['attributes']['bootable'] = row[19]
-                res[row[0]]['attributes']['attached_host'] = row[20]
-                res[row[0]]['attributes']['provider_geometry'] = row[21]
-                res[row[0]]['attributes']['_name_id'] = row[22]
-                res[row[0]]['attributes']['encryption_key_id'] = row[23]
-                res[row[0]]['attributes']['migration_status'] = row[24]
-                res[row[0]]['attributes']['replication_status'] = row[25]
-                res[row[0]]['attributes']['replication_extended_status'] = row[26]
-                res[row[0]]['attributes']['replication_driver_data'] = row[27]
-                res[row[0]]['attributes']['consistencygroup_id'] = row[28]
-
-                sub_query = 'select id from services as s where s.binary = ' \
-                    '"cinder-volume" and s.host LIKE "' + cinder_vol + '%"'
-
-                cur.execute(sub_query)
-                for sub_row in cur.fetchall():
-                    res[row[0]]['attributes']['cinder_volume'] = 'cinder-service-' + str(sub_row[0])
-                    break
+        return res
+
+    def iter_volumes(self, fetch_size=FETCH_SIZE):
+        """
+        Yield the Cinder volumes one at a time,
+        streaming them from the DB in chunks.
+        :param fetch_size: number of rows fetched at once
+        :return generator: (volume UUID, volume information) tuples
+        """
+        services = self.get_cinder_volume_service_hosts()
+        for row in iter_rows(self.conn, VOLUMES_QUERY, fetch_size):
+            yield row[0], _get_volume(row, services)
 
+    def get_changed_volumes(self, since):
+        """
+        Return the volumes created, updated or deleted since the given time
+        :param since: UTC time formatted as a MySQL datetime
+        :return dict: volume UUID -> True if the volume is deleted
+        """
+        res = {}
+        with closing(self.conn.cursor()) as cur:
+            query = 'select id, deleted from volumes where created_at >= "' + since + \
+                    '" or updated_at >= "' + since + '" or deleted_at >= "' + since + '"'
+            cur.execute(query)
+            for row in cur.fetchall():
+                res[row[0]] = bool(row[1])
         return res
+
+    def get_cinder_volume_service_hosts(self):
+        """
+        Return the hosts of the Cinder volume services
+        :return list: (service ID, lowercase host) tuples ordered by ID
+        """
+        with closing(self.conn.cursor()) as cur:
+            query = 'select s.id, s.host from services as s where s.binary = "cinder-volume" order by s.id'
+            cur.execute(query)
+            return [(str(row[0]), row[1].lower()) for row in cur.fetchall()]
+
+
+def _get_volume(row, services):
+    """
+    Return the information of a Cinder volume given its row of VOLUMES_QUERY
+    :param row: row of the volume
+    :param services: services returned by get_cinder_volume_service_hosts
+    :return dict: volume information
+    """
+    volume = VOLUMES(row)
+    host = volume.pop('host')
+
+    if '#' in host:
+        cinder_vol = host.split('#')[0]
+    else:
+        cinder_vol = host
+
+    if '@' in cinder_vol:
+        host = cinder_vol.split('@')[0]
+    else:
+        host = cinder_vol
+
+    volume['attributes']['cinder_volume'] = cinder_vol
+    volume['hostname'] = host
+
+    # The Cinder volume service of the volume is the first
+    # one whose host starts with the volume host
+    for service_id, service_host in services:
+        if service_host.startswith(cinder_vol.lower()):
+            volume['attributes']['cinder_volume'] = 'cinder-service-' + service_id
+            break
+
+    return volume
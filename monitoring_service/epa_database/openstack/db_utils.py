@@ -0,0 +1,147 @@
+# Copyright 2015 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Helpers shared by the OpenStack DBs wrappers
+"""
+__author__ = 'gpetralia'
+
+import json
+from contextlib import closing
+from operator import itemgetter
+
+# Default number of rows fetched at once when streaming a query
+FETCH_SIZE = 1000
+
+
+def iter_rows(conn, query, fetch_size=FETCH_SIZE):
+    """
+    Execute a query on an unbuffered cursor and yield its rows,
+    fetching them from the server in chunks.
+    The connection cannot run other queries until all the rows are read.
+
+    :param conn: MySQL connection
+    :param query: query to execute
+    :param fetch_size: number of rows fetched at once
+    """
+    with closing(conn.cursor(buffered=False)) as cur:
+        cur.execute(query)
+        while True:
+            rows = cur.fetchmany(fetch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+
+
+def get_db_time(conn):
+    """
+    Return the current UTC time of the DB server,
+    the OpenStack services store their timestamps in UTC
+    :param conn: MySQL connection
+    :return string: time formatted as a MySQL datetime
+    """
+    with closing(conn.cursor()) as cur:
+        cur.execute('select utc_timestamp()')
+        return str(cur.fetchall()[0][0])
+
+
+def json_value(value):
+    """
+    Decode a JSON column, None if NULL
+    :param value: column value
+    :return: decoded value
+    """
+    if value is None:
+        return None
+    return json.loads(value)
+
+
+class RowMapper(object):
+    """
+    Map the rows of a query with an explicit list of columns
+    to resource records. Column positions are computed once,
+    when the mapper is created.
+    """
+    def __init__(self, key, table, fields, attributes, fixed=None):
+        """
+        :param key: column of the resource UUID, always the first column of the query
+        :param table: table of the query, with its alias
+        :param fields: list of (column, key) mapped to the record
+        :param attributes: list of columns mapped to the record attributes.
+        A column can be given as (column, key) or (column, key, converter),
+        otherwise it is mapped to the column name without the table alias
+        :param fixed: dict of fields with the same value in all the records
+        """
+        self.columns = [key]
+        self.fixed = fixed or {}
+        self.fields = [(self.get_index(column), field_key) for column, field_key in fields]
+
+        attribute_keys = []
+        attribute_indexes = []
+        self.converters = []
+        for attribute in attributes:
+            if isinstance(attribute, basestring):
+                attribute = (attribute, attribute.split('.')[-1])
+            index = self.get_index(attribute[0])
+            if len(attribute) > 2:
+                self.converters.append((index, attribute[1], attribute[2]))
+            else:
+                attribute_keys.append(attribute[1])
+                attribute_indexes.append(index)
+
+        self.attribute_keys = tuple(attribute_keys)
+        self.attribute_getter = _tuple_getter(attribute_indexes)
+        self.query = 'select ' + ', '.join(self.columns) + ' from ' + table
+
+    def get_index(self, column):
+        """
+        Return the position of a column in the query,
+        adding the column if it is not selected yet
+        :param column: column
+        :return int: position of the column
+        """
+        if column not in self.columns:
+            self.columns.append(column)
+        return self.columns.index(column)
+
+    def __call__(self, row):
+        """
+        Return the record of a row
+        :param row: row of the query
+        :return dict: record
+        """
+        record = dict(self.fixed)
+        for index, field_key in self.fields:
+            record[field_key] = row[index]
+
+        attributes = dict(zip(self.attribute_keys, self.attribute_getter(row)))
+        for index, attribute_key, converter in self.converters:
+            attributes[attribute_key] = converter(row[index])
+        record['attributes'] = attributes
+        return record
+
+
+def _tuple_getter(indexes):
+    """
+    Return a function getting the given items of a row as a tuple
+    :param indexes: list of indexes
+    :return function: getter
+    """
+    if len(indexes) == 1:
+        index = indexes[0]
+        return lambda row: (row[index],)
+    if not indexes:
+        return lambda row: ()
+    return itemgetter(*indexes)
@@ -73,10 +73,14 @@ class GlanceDb():
                 res[row[0]]['attributes']['image_location'] = row[19]
                 res[row[0]]['attributes']['meta_data'] = json.loads(row[24])
 
-                sub_query = 'select * from image_properties where image_id="' + row[0] + '"'
-                cur.execute(sub_query)
+            # Properties of all the images are fetched at once
+            query = 'select * from image_properties'
+            if uuid:
+                query += ' where image_id = "' + uuid + '"'
+            cur.execute(query)
 
-                for sub_row in cur.fetchall():
-                    res[row[0]]['attributes'][sub_row[2]] = sub_row[3]
+            for row in cur.fetchall():
+                if row[1] in res:
+                    res[row[1]]['attributes'][row[2]] = row[3]
 
         return res
@@ -43,6 +43,7 @@ class HeatDb():
         :return dict: contains stacks information
         """
         res = {}
+        heat_controller_id = keystone_db.get_heat_controller_uuid()
         query = 'select * from stack s join raw_template r on s.raw_template_id = r.id where s.action != "DELETE"'
         with closing(self.conn.cursor()) as cur:
             if uuid:
@@ -62,18 +63,38 @@ class HeatDb():
                 res[row[0]]['attributes']['timeout'] = row[11]
                 res[row[0]]['attributes']['action'] = row[14]
                 res[row[0]]['attributes']['raw_template'] = json.loads(row[21])
-                res[row[0]]['attributes']['heat_controller_id'] = keystone_db.get_heat_controller_uuid()
+                res[row[0]]['attributes']['heat_controller_id'] = heat_controller_id
 
-                sub_query = 'select nova_instance from resource where stack_id = "' + row[0] + '"'
-                cur.execute(sub_query)
-                for sub_row in cur.fetchall():
-                    if 'resources' not in res[row[0]]['attributes'].keys():
-                        res[row[0]]['attributes']['resources'] = []
-                    if sub_row[0]:
-                        if ':' in sub_row[0]:
-                            resource_id = sub_row[0].split(':')[0]
-                        else:
-                            resource_id = sub_row[0]
-                        res[row[0]]['attributes']['resources'].append(resource_id)
+            # Resources of all the stacks are fetched at once
+            query = 'select stack_id, nova_instance from resource'
+            if uuid:
+                query += ' where stack_id = "' + uuid + '"'
+            cur.execute(query)
+            for row in cur.fetchall():
+                if row[0] not in res:
+                    continue
+                if 'resources' not in res[row[0]]['attributes'].keys():
+                    res[row[0]]['attributes']['resources'] = []
+                if row[1]:
+                    if ':' in row[1]:
+                        resource_id = row[1].split(':')[0]
+                    else:
+                        resource_id = row[1]
+                    res[row[0]]['attributes']['resources'].append(resource_id)
 
         return res
+
+    def get_changed_stacks(self, since):
+        """
+        Return the stacks created, updated or deleted since the given time
+        :param since: UTC time formatted as a MySQL datetime
+        :return dict: stack UUID -> True if the stack is deleted
+        """
+        res = {}
+        with closing(self.conn.cursor()) as cur:
+            query = 'select id, action, deleted_at from stack where created_at >= "' + since + \
+                    '" or updated_at >= "' + since + '" or deleted_at >= "' + since + '"'
+            cur.execute(query)
+            for row in cur.fetchall():
+                res[row[0]] = row[1] == 'DELETE' or row[2] is not None
+        return res
@@ -17,15 +17,26 @@ Module to get information from Neutron DB
 """
 __author__ = 'gpetralia'
 
+import hashlib
 import json
 from contextlib import closing
 import mysql.connector as MySQLdb
+from db_utils import iter_rows, FETCH_SIZE
 
 # MAP driver name to Neutron agent name
 MAP_DRIVER_BINARY = {
     'openvswitch': 'neutron-openvswitch-agent'
 }
 
+# Ports joined with their binding and their IP allocations,
+# a port has a row for each of its IP allocations
+PORTS_QUERY = 'select p.id, p.name, p.network_id, p.mac_address, p.admin_state_up, p.status, ' \
+    'p.device_id, p.device_owner, b.port_id, b.host, b.vif_type, b.driver, b.segment, b.vnic_type, ' \
+    'b.vif_details, b.profile, ip.ip_address, ip.subnet_id from ports p ' \
+    'left join ml2_port_bindings b on b.port_id = p.id ' \
+    'left join ipallocations ip on ip.port_id = p.id ' \
+    'where p.device_owner != "network:floatingip"'
+
 
 class NeutronDb():
     """
@@ -128,6 +139,19 @@ class NeutronDb():
             res.append(row[0])
         return res
 
+    def get_ports_by_instance(self):
+        """
+        Return the Neutron ports of all the devices with a single query.
+        :return dict: device UUID -> list of ports UUID
+        """
+        res = {}
+        with closing(self.conn.cursor()) as cur:
+            query = 'SELECT device_id, id FROM ports WHERE device_id != ""'
+            cur.execute(query)
+            for row in cur.fetchall():
+                res.setdefault(row[0], []).append(row[1])
+        return res
+
     def get_ports(self, uuid=None):
         """
         Return a dict containing the ports stored in Neutron.
@@ -136,80 +160,78 @@ class NeutronDb():
         :return dict: contains ports information
         """
         res = {}
+        agents = self.get_agent_ids()
+        floatingips = self.get_floating_ips_by_port(uuid)
 
         with closing(self.conn.cursor()) as cur:
-            query = 'select * from ports where device_owner != "network:floatingip"'
+            query = PORTS_QUERY
             if uuid:
-                query += ' and id = "' + uuid + '"'
+                query += ' and p.id = "' + uuid + '"'
+            query += ' order by p.id'
 
             cur.execute(query)
+            for rows in _group_port_rows(cur.fetchall()):
+                res[rows[0][0]] = _get_port(rows, agents, floatingips)
 
-            for row in cur.fetchall():
-                res[row[1]] = {}
-                res[row[1]]['attributes'] = {}
-
-                if row[2] != '':
-                    res[row[1]]['name'] = row[2]
-
-                res[row[1]]['type'] = 'port'
-                res[row[1]]['resource_type'] = 'virtual'
-                res[row[1]]['category'] = 'network'
-                res[row[1]]['attributes']['network_id'] = row[3]
-                res[row[1]]['attributes']['mac_address'] = row[4]
-                res[row[1]]['attributes']['admin_state_up'] = row[5]
-                res[row[1]]['attributes']['status'] = row[6]
-                res[row[1]]['attributes']['device_id'] = row[7]
-
-                if row[8] != '':
-                    res[row[1]]['attributes']['device_owner'] = row[8]
+        return res
 
-            query = 'select * from  ml2_port_bindings'
+    def iter_ports(self, fetch_size=FETCH_SIZE):
+        """
+        Yield the ports stored in Neutron one at a time,
+        streaming them from the DB in chunks.
+        :param fetch_size: number of rows fetched at once
+        :return generator: (port UUID, port information) tuples
+        """
+        agents = self.get_agent_ids()
+        floatingips = self.get_floating_ips_by_port()
 
-            cur.execute(query)
+        rows = iter_rows(self.conn, PORTS_QUERY + ' order by p.id', fetch_size)
+        for port_rows in _group_port_rows(rows):
+            yield port_rows[0][0], _get_port(port_rows, agents, floatingips)
 
-            for row in cur.fetchall():
-                if row[0] in res.keys():
-                    if row[1] != '':
-                        res[row[0]]['hostname'] = row[1]
-                    res[row[0]]['attributes']['vif_type'] = row[2]
-                    res[row[0]]['attributes']['driver'] = row[3]
-                    res[row[0]]['attributes']['segment'] = row[4]
-                    res[row[0]]['attributes']['vnic_type'] = row[5]
-
-                    if row[6] != '':
-                        res[row[0]]['attributes']['vif_details'] = json.loads(row[6])
-                    if row[7] != '':
-                        res[row[0]]['attributes']['profile'] = row[7]
-
-            query = 'select * from ipallocations'
-            cur.execute(query)
+    def get_port_hashes(self, fetch_size=FETCH_SIZE):
+        """
+        Return the content hashes of the ports, covering their bindings,
+        IP allocations and FloatingIPs. The Neutron ports table has no
+        timestamps, changed ports are found comparing their hashes.
+        :param fetch_size: number of rows fetched at once
+        :return dict: port UUID -> content hash
+        """
+        res = {}
+        floatingips = self.get_floating_ips_by_port()
+        rows = iter_rows(self.conn, PORTS_QUERY + ' order by p.id', fetch_size)
+        for port_rows in _group_port_rows(rows):
+            port_id = port_rows[0][0]
+            content = repr((sorted(port_rows), sorted(floatingips.get(port_id, []))))
+            res[port_id] = hashlib.sha1(content).hexdigest()
+        return res
 
+    def get_agent_ids(self):
+        """
+        Return the IDs of the Neutron agents
+        :return dict: (host, binary) -> agent ID
+        """
+        res = {}
+        with closing(self.conn.cursor()) as cur:
+            cur.execute('select a.host, a.binary, a.id from agents a')
             for row in cur.fetchall():
-                if row[0] in res.keys():
-                    res[row[0]]['attributes']['ip_address'] = row[1]
-                    res[row[0]]['attributes']['subnet_id'] = row[2]
-
-            for port in res.keys():
-                if res[port]['attributes']['vif_type'] != 'unbound':
-                    host = res[port]['hostname']
-                    if res[port]['attributes']['driver'] in MAP_DRIVER_BINARY.keys():
-                        driver = res[port]['attributes']['driver']
-                        query = 'select id from agents where agents.host="' + host + \
-                                '" and agents.binary="' + MAP_DRIVER_BINARY[driver] + '" LIMIT 1;'
-                        cur.execute(query)
-                        for row in cur.fetchall():
-                            res[port]['attributes']['agent_id'] = row[0]
-
-            query = 'select * from floatingips'
+                res.setdefault((row[0], row[1]), row[2])
+        return res
 
+    def get_floating_ips_by_port(self, port_uuid=None):
+        """
+        Return the FloatingIPs associated to each port
+        :param port_uuid: Optional UUID of the desired port
+        :return dict: port UUID -> list of FloatingIPs UUID
+        """
+        res = {}
+        with closing(self.conn.cursor()) as cur:
+            query = 'select id, fixed_port_id from floatingips'
+            if port_uuid:
+                query += ' where fixed_port_id = "' + port_uuid + '"'
             cur.execute(query)
-
             for row in cur.fetchall():
-                if row[5] in res.keys():
-                    if 'floatingips' not in res[row[5]]['attributes'].keys():
-                        res[row[5]]['attributes']['floatingips'] = []
-                    res[row[5]]['attributes']['floatingips'].append(row[1])
-
+                res.setdefault(row[1], []).append(row[0])
         return res
 
     def get_agents(self, uuid=None):
@@ -388,3 +410,77 @@ class NeutronDb():
                     )
 
         return res
+
+
+def _group_port_rows(rows):
+    """
+    Group the consecutive rows of PORTS_QUERY of the same port
+    :param rows: rows ordered by port UUID
+    :return generator: lists of rows of a port
+    """
+    port_rows = []
+    for row in rows:
+        if port_rows and port_rows[0][0] != row[0]:
+            yield port_rows
+            port_rows = []
+        port_rows.append(row)
+    if port_rows:
+        yield port_rows
+
+
+def _get_port(rows, agents, floatingips):
+    """
+    Return the information of a port given its rows of PORTS_QUERY
+    :param rows: rows of the port
+    :param agents: agent IDs returned by get_agent_ids
+    :param floatingips: FloatingIPs returned by get_floating_ips_by_port
+    :return dict: port information
+    """
+    row = rows[0]
+    port = {}
+    port['attributes'] = {}
+
+    if row[1] != '':
+        port['name'] = row[1]
+
+    port['type'] = 'port'
+    port['resource_type'] = 'virtual'
+    port['category'] = 'network'
+    port['attributes']['network_id'] = row[2]
+    port['attributes']['mac_address'] = row[3]
+    port['attributes']['admin_state_up'] = row[4]
+    port['attributes']['status'] = row[5]
+    port['attributes']['device_id'] = row[6]
+
+    if row[7] != '':
+        port['attributes']['device_owner'] = row[7]
+
+    for row in rows:
+        if row[8] is not None:
+            if row[9] != '':
+                port['hostname'] = row[9]
+            port['attributes']['vif_type'] = row[10]
+            port['attributes']['driver'] = row[11]
+            port['attributes']['segment'] = row[12]
+            port['attributes']['vnic_type'] = row[13]
+
+            if row[14]:
+                port['attributes']['vif_details'] = json.loads(row[14])
+            if row[15]:
+                port['attributes']['profile'] = row[15]
+
+        if row[16] is not None:
+            port['attributes']['ip_address'] = row[16]
+            port['attributes']['subnet_id'] = row[17]
+
+    if port['attributes'].get('vif_type', 'unbound') != 'unbound':
+        driver = port['attributes']['driver']
+        if driver in MAP_DRIVER_BINARY.keys():
+            agent_id = agents.get((port.get('hostname'), MAP_DRIVER_BINARY[driver]))
+            if agent_id is not None:
+                port['attributes']['agent_id'] = agent_id
+
+    if row[0] in floatingips:
+        port['attributes']['floatingips'] = list(floatingips[row[0]])
+
+    return port
@@ -20,6 +20,34 @@ __author__ = 'gpetralia'
 import json
 from contextlib import closing
 import mysql.connector as MySQLdb
+from db_utils import iter_rows, json_value, RowMapper, FETCH_SIZE
+
+# Columns of the Nova tables, compiled once in row mappers
+INSTANCES = RowMapper(
+    'i.uuid', 'instances i',
+    [('i.display_name', 'name'), ('i.host', 'hostname')],
+    ['i.internal_id', 'i.user_id', 'i.project_id', ('i.image_ref', 'image_id'), 'i.kernel_id', 'i.ramdisk_id',
+     'i.launch_index', 'i.key_name', 'i.key_data', 'i.power_state', 'i.vm_state', 'i.memory_mb', 'i.vcpus',
+     'i.hostname', 'i.host', 'i.reservation_id', 'i.display_description', 'i.availability_zone', 'i.locked',
+     'i.os_type', 'i.launched_on', 'i.instance_type_id', 'i.vm_mode', 'i.architecture', 'i.root_device_name',
+     'i.access_ip_v4', 'i.access_ip_v6', 'i.config_drive', 'i.task_state', 'i.default_ephemeral_device',
+     'i.default_swap_device', 'i.progress', 'i.auto_disk_config', 'i.shutdown_terminate', 'i.disable_terminate',
+     'i.root_gb', 'i.ephemeral_gb', 'i.cell_name', 'i.node', 'i.locked_by', 'i.cleaned', 'i.ephemeral_key_uuid'],
+    {'type': 'vm', 'category': 'compute', 'resource_type': 'virtual'})
+
+INSTANCES_QUERY = INSTANCES.query + ' where i.deleted = 0'
+
+HYPERVISORS = RowMapper(
+    'c.id', 'compute_nodes c',
+    [('c.hypervisor_hostname', 'hypervisor_hostname')],
+    ['c.service_id', 'c.vcpus', 'c.memory_mb', 'c.local_gb', 'c.vcpus_used', 'c.memory_mb_used',
+     'c.local_gb_used', 'c.hypervisor_type', 'c.hypervisor_version', ('c.cpu_info', 'cpu_info', json_value),
+     'c.disk_available_least', 'c.free_ram_mb', 'c.free_disk_gb', 'c.current_workload', 'c.running_vms',
+     'c.host_ip', ('c.supported_instances', 'supported_instances', json_value),
+     ('c.pci_stats', 'pci_stats', json_value), ('c.stats', 'stats', json_value),
+     ('c.numa_topology', 'numa_topology', json_value)],
+    {'type': 'hypervisor', 'category': 'compute', 'resource_type': 'service'})
+
 
 class NovaDb():
     """
@@ -89,69 +117,15 @@ class NovaDb():
         res = {}
         with closing(self.conn.cursor()) as cur:
 
-            query = "select i.uuid, i.internal_id, i.user_id, i.project_id, i.image_ref, i.kernel_id, i.ramdisk_id, " \
-                    "i.launch_index, i.key_name, i.key_data, i.power_state, i.vm_state, i.memory_mb," \
-                    "i.vcpus, i.hostname, i.host, i.user_data, i.reservation_id, i.display_name, i.display_description, " \
-                    "i.availability_zone, i.locked, i.os_type, i.launched_on, i.instance_type_id, i.vm_mode," \
-                    "i.architecture, i.root_device_name, i.access_ip_v4, i.access_ip_v6, i.config_drive," \
-                    "i.task_state, i.default_ephemeral_device, i.default_swap_device, i.progress, i.auto_disk_config," \
-                    "i.shutdown_terminate, i.disable_terminate, i.root_gb, i.ephemeral_gb, i.cell_name, i.node, i.locked_by," \
-                    "i.cleaned, i.ephemeral_key_uuid from instances i where i.deleted = 0"
+            query = INSTANCES_QUERY
 
             if uuid:
                 query += ' and i.uuid = "' + uuid + '"'
 
+            flavors = self.get_flavor_uuids()
             cur.execute(query)
             for row in cur.fetchall():
-                res[row[0]] = {}
-                res[row[0]]['attributes'] = {}
-                res[row[0]]['type'] = 'vm'
-                res[row[0]]['category'] = 'compute'
-                res[row[0]]['resource_type'] = 'virtual'
-                res[row[0]]['name'] = row[18]  #
-                res[row[0]]['hostname'] = row[15]
-                res[row[0]]['attributes']['internal_id'] = row[1]
-                res[row[0]]['attributes']['user_id'] = row[2]
-                res[row[0]]['attributes']['project_id'] = row[3]
-                res[row[0]]['attributes']['image_id'] = row[4]  # edge image_id
-                res[row[0]]['attributes']['kernel_id'] = row[5]
-                res[row[0]]['attributes']['ramdisk_id'] = row[6]
-                res[row[0]]['attributes']['launch_index'] = row[7]
-                res[row[0]]['attributes']['key_name'] = row[8]
-                res[row[0]]['attributes']['key_data'] = row[9]
-                res[row[0]]['attributes']['power_state'] = row[10]
-                res[row[0]]['attributes']['vm_state'] = row[11]
-                res[row[0]]['attributes']['memory_mb'] = row[12]
-                res[row[0]]['attributes']['vcpus'] = row[13]
-                res[row[0]]['attributes']['hostname'] = row[14]
-                res[row[0]]['attributes']['host'] = row[15]
-                res[row[0]]['attributes']['reservation_id'] = row[17]
-                res[row[0]]['attributes']['display_description'] = row[19]
-                res[row[0]]['attributes']['availability_zone'] = row[20]
-                res[row[0]]['attributes']['locked'] = row[21]
-                res[row[0]]['attributes']['os_type'] = row[22]
-                res[row[0]]['attributes']['launched_on'] = row[23]
-                res[row[0]]['attributes']['instance_type_id'] = self.get_flavor_uuid(str(row[24]))  # edge instance type
-                res[row[0]]['attributes']['vm_mode'] = row[25]
-                res[row[0]]['attributes']['architecture'] = row[26]
-                res[row[0]]['attributes']['root_device_name'] = row[27]
-                res[row[0]]['attributes']['access_ip_v4'] = row[28]
-                res[row[0]]['attributes']['access_ip_v6'] = row[29]
-                res[row[0]]['attributes']['config_drive'] = row[30]
-                res[row[0]]['attributes']['task_state'] = row[31]
-                res[row[0]]['attributes']['default_ephemeral_device'] = row[32]
-                res[row[0]]['attributes']['default_swap_device'] = row[33]
-                res[row[0]]['attributes']['progress'] = row[34]
-                res[row[0]]['attributes']['auto_disk_config'] = row[35]
-                res[row[0]]['attributes']['shutdown_terminate'] = row[36]
-                res[row[0]]['attributes']['disable_terminate'] = row[37]
-                res[row[0]]['attributes']['root_gb'] = row[38]
-                res[row[0]]['attributes']['ephemeral_gb'] = row[39]
-                res[row[0]]['attributes']['cell_name'] = row[40]
-                res[row[0]]['attributes']['node'] = row[41]
-                res[row[0]]['attributes']['locked_by'] = row[42]
-                res[row[0]]['attributes']['cleaned'] = row[43]
-                res[row[0]]['attributes']['ephemeral_key_uuid'] = row[44]
+                res[row[0]] = _get_instance(row, flavors)
 
             query = 'select * from instance_info_caches'
 
@@ -170,6 +144,45 @@ class NovaDb():
 
         return res
 
+    def iter_instances(self, fetch_size=FETCH_SIZE):
+        """
+        Yield the Instances stored in Nova one at a time,
+        streaming them from the DB in chunks.
+        Ports are not included, they are read from Neutron.
+        :param fetch_size: number of rows fetched at once
+        :return generator: (Instance UUID, Instance information) tuples
+        """
+        flavors = self.get_flavor_uuids()
+        for row in iter_rows(self.conn, INSTANCES_QUERY, fetch_size):
+            yield row[0], _get_instance(row, flavors)
+
+    def get_changed_instances(self, since):
+        """
+        Return the Instances created, updated or deleted since the given time
+        :param since: UTC time formatted as a MySQL datetime
+        :return dict: Instance UUID -> True if the Instance is deleted
+        """
+        res = {}
+        with closing(self.conn.cursor()) as cur:
+            query = 'select uuid, deleted from instances where created_at >= "' + since + \
+                    '" or updated_at >= "' + since + '" or deleted_at >= "' + since + '"'
+            cur.execute(query)
+            for row in cur.fetchall():
+                res[row[0]] = row[1] != 0
+        return res
+
+    def get_flavor_uuids(self):
+        """
+        Return the flavor UUIDs of all the flavor IDs
+        :return dict: flavor ID -> flavor UUID
+        """
+        res = {}
+        with closing(self.conn.cursor()) as cur:
+            cur.execute('select id, flavorid from instance_types')
+            for row in cur.fetchall():
+                res[row[0]] = row[1]
+        return res
+
     def get_flavor_uuid(self, flavor_id):
         """
         Return the flavour UUID for a given flavor ID.
@@ -192,41 +205,18 @@ class NovaDb():
         """
         res = {}
         with closing(self.conn.cursor()) as cur:
-            query = 'select * from compute_nodes where deleted = 0'
+            query = HYPERVISORS.query + ' where c.deleted = 0'
+
             if hostname:
-                query += ' and hypervisor_hostname = "' + hostname + '"'
+                query += ' and c.hypervisor_hostname = "' + hostname + '"'
             cur.execute(query)
+
             for row in cur.fetchall():
-                res[row[3]] = {}
-                res[row[3]]['attributes'] = {}
-                res[row[3]]['type'] = 'hypervisor'
-                res[row[3]]['category'] = 'compute'
-                res[row[3]]['resource_type'] = 'service'
-                res[row[3]]['name'] = row[11] + '_' + row[19]
-                hostname = row[19]
-                if '.' in row[19]:
-                    hostname = row[19].split('.')[0]
-                res[row[3]]['hostname'] = hostname
-                res[row[3]]['attributes']['service_id'] = row[4]
-                res[row[3]]['attributes']['vcpus'] = row[5]
-                res[row[3]]['attributes']['memory_mb'] = row[6]
-                res[row[3]]['attributes']['local_gb'] = row[7]
-                res[row[3]]['attributes']['vcpus_used'] = row[8]
-                res[row[3]]['attributes']['memory_mb_used'] = row[9]
-                res[row[3]]['attributes']['local_gb_used'] = row[10]
-                res[row[3]]['attributes']['hypervisor_type'] = row[11]
-                res[row[3]]['attributes']['hypervisor_version'] = row[12]
-                res[row[3]]['attributes']['cpu_info'] = json.loads(row[13])
-                res[row[3]]['attributes']['disk_available_least'] = row[14]
-                res[row[3]]['attributes']['free_ram_mb'] = row[15]
-                res[row[3]]['attributes']['free_disk_gb'] = row[16]
-                res[row[3]]['attributes']['current_workload'] = row[17]
-                res[row[3]]['attributes']['running_vms'] = row[18]
-                res[row[3]]['attributes']['host_ip'] = row[21]
-                res[row[3]]['attributes']['supported_instances'] = json.loads(row[22])
-                res[row[3]]['attributes']['pci_stats'] = json.loads(row[23])
-                res[row[3]]['attributes']['stats'] = json.loads(row[26])
-                res[row[3]]['attributes']['numa_topology'] = json.loads(row[27])
+                record = HYPERVISORS(row)
+                hypervisor_hostname = record.pop('hypervisor_hostname')
+                record['name'] = record['attributes']['hypervisor_type'] + '_' + hypervisor_hostname
+                record['hostname'] = hypervisor_hostname.split('.')[0]
+                res[row[0]] = record
         return res
 
     def get_instance_type(self, controller_hostname, uuid=None):
@@ -301,3 +291,17 @@ class NovaDb():
             for row in cur.fetchall():
                 res.append(row)
         return res
+
+
+def _get_instance(row, flavors):
+    """
+    Return the information of a Nova Instance
+    given its row of INSTANCES_QUERY
+    :param row: row of the instance
+    :param flavors: flavor UUIDs returned by get_flavor_uuids
+    :return dict: Instance information
+    """
+    record = INSTANCES(row)
+    attributes = record['attributes']
+    attributes['instance_type_id'] = flavors.get(attributes['instance_type_id'])  # edge instance type
+    return record
@@ -25,6 +25,16 @@ import common.neo4j_resources as neo_resource
 
 mutex = Lock()
 
+# Hypervisor attributes changing with the instances running on it,
+# rewritten alone when nothing else of the hypervisor changed
+HYPERVISOR_STATS_FIELDS = ('vcpus_used', 'memory_mb_used', 'local_gb_used', 'free_ram_mb', 'free_disk_gb',
+                           'disk_available_least', 'current_workload', 'running_vms', 'stats', 'numa_topology',
+                           'pci_stats')
+
+# Hypervisors stored by Hypervisor.store and linked to their host node:
+# hypervisor ID -> (hostname, fingerprint of the other properties, stats attributes)
+_stored_hypervisors = {}
+
 
 class Hypervisor(object):
     """
@@ -46,6 +56,27 @@ class Hypervisor(object):
                                                  property_value=self.hostname)
         return node
 
+    def get_index(self, resource_id):
+        """
+        Return a tuple that represents the index of the Hypervisor node
+        :param resource_id: ID of the Hypervisor
+        :return tuple: index of the node
+        """
+        return self.label, 'openstack_uuid', 'hypervisor-' + str(resource_id)
+
+    def is_linked(self, graph_db, resource_id):
+        """
+        Check that the Hypervisor node and its relation
+        to the Machine node are still in the DB
+        :param graph_db: Graph DB instance
+        :param resource_id: ID of the Hypervisor
+        :return boolean: true if the node and its relation exist
+        """
+        index = self.get_index(resource_id)
+        if self.hostname:
+            return neo_resource.edge_exists(graph_db, index, HostNode(self.hostname).index, 'runs_on')
+        return neo_resource.get_node(graph_db, index) is not None
+
     def get_or_add_hypervisor(self, graph_db, resource_id, pop, timestamp, properties=None):
         """
         Retrieve or add the Hypervisor node from the DB
@@ -61,7 +92,7 @@ class Hypervisor(object):
 
         with mutex:
             properties['pop'] = pop
-            index = (self.label, 'openstack_uuid', 'hypervisor-' + str(resource_id))
+            index = self.get_index(resource_id)
             hyperv_node = neo_resource.add_node(graph_db,
                                                 index,
                                                 timestamp,
@@ -74,6 +105,40 @@ class Hypervisor(object):
             return hyperv_node
 
 
+    def store(self, graph_db, resource_id, pop, timestamp, properties):
+        """
+        Add or update the Hypervisor node.
+        If only its stats attributes changed since the last store,
+        they are rewritten without re-adding the node and its host node.
+        The node is added again if it or its host relation has been removed.
+        :param graph_db: Graph DB instance
+        :param resource_id: ID of the Hypervisor
+        :param pop: PoP ID
+        :param timestamp: timestamp in epoch
+        :param properties: properties of the node
+        """
+        properties['pop'] = pop
+        attributes = properties.get('attributes', {})
+        stats = dict((field, attributes.get(field)) for field in HYPERVISOR_STATS_FIELDS)
+        fingerprint = _get_hypervisor_fingerprint(properties)
+
+        stored = _stored_hypervisors.get(resource_id)
+        if stored is not None and stored[0] == self.hostname and stored[1] == fingerprint and \
+                self.is_linked(graph_db, resource_id):
+            changed = [field for field in HYPERVISOR_STATS_FIELDS if stats[field] != stored[2][field]]
+            if not changed:
+                return
+            index = self.get_index(resource_id)
+            with mutex:
+                updated = neo_resource.update_node_attributes(graph_db, index, attributes, changed, timestamp)
+            if updated:
+                _stored_hypervisors[resource_id] = (self.hostname, fingerprint, stats)
+                return
+
+        self.get_or_add_hypervisor(graph_db, resource_id, pop, timestamp, properties)
+        _stored_hypervisors[resource_id] = (self.hostname, fingerprint, stats)
+
+
 class HostNode(object):
     """
     Class to manage Machine nodes
@@ -81,6 +146,14 @@ class HostNode(object):
     def __init__(self, hostname):
         self.hostname = hostname
 
+    @property
+    def index(self):
+        """
+        Return a tuple that represents the index of the Machine node
+        """
+        node_name = self.hostname + '_' + 'Machine' + '_0'
+        return 'physical_resource', 'physical_name', node_name
+
     def get_resource(self, graph_db, timestamp):
         """
         Retrieve or add machine node
@@ -88,9 +161,7 @@ class HostNode(object):
         :param timestamp: timestamp in epoch
         :return Node: Machine node
         """
-        node_name = self.hostname + '_' + 'Machine' + '_0'
-        index = ('physical_resource', 'physical_name', node_name)
-        node = neo_resource.add_node(graph_db, index, timestamp)
+        node = neo_resource.add_node(graph_db, self.index, timestamp)
         return node
 
 
@@ -199,25 +270,16 @@ class OpenstackResource(object):
                 openstack_node = neo_resource.add_node(graph_db, self.index, timestamp, properties=properties)
 
             if openstack_node:
+                # Neighbours are resolved and linked in bulk
+                edges = []
                 if in_edges:
                     for in_edge in in_edges:
-                        if in_edges[in_edge]['mandatory']:
-                            in_node = OpenstackResource(in_edge).get_or_add_resource(graph_db, timestamp)
-                        else:
-                            in_node = OpenstackResource(in_edge).get_resource(graph_db)
-                        if in_node:
-                            neo_resource.add_edge(graph_db, in_node, openstack_node, timestamp,
-                                                  in_edges[in_edge]['label'])
-
+                        edges.append((in_edge, in_edges[in_edge]['label'], False, in_edges[in_edge]['mandatory']))
                 if out_edges:
                     for out_edge in out_edges:
-                        if out_edges[out_edge]['mandatory']:
-                            out_node = OpenstackResource(out_edge).get_or_add_resource(graph_db, timestamp)
-                        else:
-                            out_node = OpenstackResource(out_edge).get_resource(graph_db)
-                        if out_node:
-                            neo_resource.add_edge(graph_db, openstack_node, out_node, timestamp,
-                                                  out_edges[out_edge]['label'])
+                        edges.append((out_edge, out_edges[out_edge]['label'], True,
+                                      out_edges[out_edge]['mandatory']))
+                neo_resource.add_neighbour_edges(graph_db, self.index, edges, timestamp)
 
                 if host_nodes:
                     for host in host_nodes:
@@ -238,15 +300,13 @@ class OpenstackResource(object):
                             neo_resource.add_edge(graph_db, service_node, openstack_node,
                                                   timestamp, 'manages')
 
-                if openstack_node.properties['type'] == 'port':
-                    if 'profile' in openstack_node.properties['attributes']:
-                        port_attributes = json.loads(openstack_node.properties['attributes'])
-                        if 'profile' in port_attributes and 'pci_slot' in port_attributes['profile']:
-                            pci_dev = neo_resource.get_nodes_by_attribute(graph_db,
-                                                                          openstack_node.properties['hostname'],
-                                                                          port_attributes['profile']['pci_slot'])
-
-                        if pci_dev and len(pci_dev) == 1:
+                # SR-IOV ports run on the PCI device of their host
+                if properties.get('type') == 'port' and properties.get('hostname'):
+                    pci_slot = _get_pci_slot(properties['attributes'])
+                    if pci_slot:
+                        pci_dev = neo_resource.get_nodes_by_pci_busid(graph_db, 'physical_resource',
+                                                                      properties['hostname'], pci_slot)
+                        if len(pci_dev) == 1:
                             neo_resource.add_edge(graph_db, openstack_node, pci_dev[0],
                                                   timestamp, 'runs_on')
                 return openstack_node
@@ -292,4 +352,34 @@ class ControllerService(OpenstackResource):
                 properties['pop'] = pop
                 controller_service_node = self.get_or_add_resource(graph_db, timestamp, properties)
                 host_node = HostNode(properties['hostname']).get_resource(graph_db, timestamp)
-                neo_resource.add_edge(graph_db, controller_service_node, host_node,  timestamp, 'runs_on')
\ No newline at end of file
+                neo_resource.add_edge(graph_db, controller_service_node, host_node,  timestamp, 'runs_on')
+
+
+def _get_pci_slot(attributes):
+    """
+    Return the PCI slot in the binding profile of a port, if any
+    :param attributes: attributes of the port
+    :return string: PCI slot
+    """
+    profile = attributes.get('profile')
+    if isinstance(profile, basestring):
+        try:
+            profile = json.loads(profile)
+        except ValueError:
+            return None
+    if isinstance(profile, dict):
+        return profile.get('pci_slot')
+    return None
+
+
+def _get_hypervisor_fingerprint(properties):
+    """
+    Return the fingerprint of the properties of an Hypervisor
+    except its stats attributes
+    :param properties: properties of the Hypervisor
+    :return string: fingerprint
+    """
+    static_properties = dict(properties)
+    static_properties['attributes'] = dict((key, value) for key, value in properties.get('attributes', {}).items()
+                                           if key not in HYPERVISOR_STATS_FIELDS)
+    return json.dumps(static_properties, sort_keys=True, default=str)
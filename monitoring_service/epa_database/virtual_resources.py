@@ -20,8 +20,9 @@ Module to manage Virtual resources in the infrastructure
 __author__ = 'gpetralia'
 
 from common import neo4j_resources as neo_resource
-from common.utils import config_section_map
+from common.utils import config_section_map, config_option
 import time
+from openstack.db_utils import FETCH_SIZE
 from openstack.nova_db import NovaDb
 from openstack.cinder_db import CinderDb
 from openstack.glance_db import GlanceDb
@@ -30,6 +31,16 @@ from openstack.keystone_db import KeystoneDb
 from openstack.neutron_db import NeutronDb
 from openstack_resource import Hypervisor, HostNode, ControllerService, OpenstackResource
 
+# (label, property key, property value) of the nodes removed before the OpenStack DBs dump
+STALE_RESOURCES = [
+    ('virtual_resource', 'index_type', 'virtual_resource'),
+    ('virtual_resource', 'resource_type', 'virtual'),
+    ('virtual_resource', 'resource_type', 'vnf'),
+    ('virtual_resource', 'resource_type', 'service'),
+    ('controller_service', 'resource_type', 'service'),
+    ('hypervisor', 'resource_type', 'service')
+]
+
 
 class VirtualResources(object):
     def __init__(self, graph_db, config, timestamp=None):
@@ -43,13 +54,11 @@ class VirtualResources(object):
 
         self.graph_db = graph_db
 
-        # Remove all virtual resources
-        neo_resource.remove_nodes_by_property(graph_db, 'virtual_resource', property_key='index_type', property_value='virtual_resource')
-        neo_resource.remove_nodes_by_property(graph_db, 'virtual_resource', property_key='resource_type', property_value='virtual')
-        neo_resource.remove_nodes_by_property(graph_db, 'virtual_resource', property_key='resource_type', property_value='vnf')
-        neo_resource.remove_nodes_by_property(graph_db, 'virtual_resource', property_key='resource_type', property_value='service')
-        neo_resource.remove_nodes_by_property(graph_db, 'controller_service', property_key='resource_type', property_value='service')
-        neo_resource.remove_nodes_by_property(graph_db, 'hypervisor', property_key='resource_type', property_value='service')
+        # Remove all virtual resources, in batches of delete_batch_size nodes
+        batch_size = int(config_option('EpaDB', 'delete_batch_size', config, neo_resource.DELETE_BATCH_SIZE))
+        for label, property_key, property_value in STALE_RESOURCES:
+            neo_resource.remove_nodes_by_property(graph_db, label, property_key=property_key,
+                                                  property_value=property_value, batch_size=batch_size)
 
         # Collect PoP information from config file
         self.pop = config_section_map('PoP', config)['name']
@@ -86,6 +95,11 @@ class VirtualResources(object):
         keystone_enabled = config_section_map('Openstack', config)['keystone_enabled']
         neutron_enabled = config_section_map('Openstack', config)['neutron_enabled']
 
+        # Stream the biggest tables instead of loading them at once
+        fetch_size = None
+        if config_option('OpenstackDB', 'streaming', config, 'false').lower() == 'true':
+            fetch_size = int(config_option('OpenstackDB', 'fetch_size', config, FETCH_SIZE))
+
         # Openstack DB wrappers
 
         if keystone_enabled.lower() == 'true':
@@ -105,7 +119,7 @@ class VirtualResources(object):
             add_cinder_snapshots(self.cinder_db, self.graph_db, self.pop, now)
 
             # Cinder Volumes
-            add_cinder_volumes(self.cinder_db, self.graph_db, self.pop, now)
+            add_cinder_volumes(self.cinder_db, self.graph_db, self.pop, now, fetch_size=fetch_size)
 
         if glance_enabled.lower() == 'true':
             self.glance_db = GlanceDb(os_db_host, os_db_glance_usr, os_db_glance_pwd, os_glance_db)
@@ -128,7 +142,7 @@ class VirtualResources(object):
             add_neutron_routers(self.neutron_db, self.graph_db, self.pop, now)
 
             # Neutron Ports
-            add_ports(self.neutron_db, self.graph_db, self.pop, now)
+            add_ports(self.neutron_db, self.graph_db, self.pop, now, fetch_size=fetch_size)
 
         if nova_enabled.lower() == 'true':
             self.nova_db = NovaDb(os_db_host, os_db_nova_usr, os_db_nova_pwd, os_nova_db)
@@ -138,7 +152,8 @@ class VirtualResources(object):
 
             if neutron_enabled.lower() == 'true':
                 # Nova Virtual Machines
-                add_nova_instances(self.nova_db, self.neutron_db, self.graph_db, self.pop, now)
+                add_nova_instances(self.nova_db, self.neutron_db, self.graph_db, self.pop, now,
+                                   fetch_size=fetch_size)
 
 
 def get_host_node(graph_db, hostname, timestamp):
@@ -246,7 +261,7 @@ def add_neutron_routers(neutron_db, graph_db, pop, timestamp, uuid=None, update=
                                         in_edges=in_nodes, out_edges=out_nodes, update=update)
 
 
-def add_ports(neutron_db, graph_db, pop, timestamp, uuid=None, update=False):
+def add_ports(neutron_db, graph_db, pop, timestamp, uuid=None, update=False, fetch_size=None):
     """
     Add Neutron Ports
     :param neutron_db: Connection to Neutron DB
@@ -255,24 +270,28 @@ def add_ports(neutron_db, graph_db, pop, timestamp, uuid=None, update=False):
     :param timestamp: timestamp in epoch
     :param uuid: optional UUID of the Port to be added
     :param update: if it true, it update the existing node
+    :param fetch_size: if given, all the ports are streamed from Neutron DB in chunks of fetch_size rows
     """
     ports_node = []
-    ports = neutron_db.get_ports(uuid)
-    for port in ports.keys():
+    if fetch_size and not uuid:
+        ports = neutron_db.iter_ports(fetch_size)
+    else:
+        ports = neutron_db.get_ports(uuid).iteritems()
+    for port, port_info in ports:
         in_nodes = {}
         out_nodes = {}
 
-        if 'network_id' in ports[port]['attributes'].keys():
-            if ports[port]['attributes']['network_id'] is not None:
-                net_id = ports[port]['attributes']['network_id']
+        if 'network_id' in port_info['attributes'].keys():
+            if port_info['attributes']['network_id'] is not None:
+                net_id = port_info['attributes']['network_id']
                 net_node = {
                     'mandatory': True,
                     'label': 'on_network'
                 }
                 out_nodes[net_id] = net_node
 
-        if 'device_id' in ports[port]['attributes'] and ports[port]['attributes']['device_id'] is not None:
-            vm_id = ports[port]['attributes']['device_id']
+        if 'device_id' in port_info['attributes'] and port_info['attributes']['device_id'] is not None:
+            vm_id = port_info['attributes']['device_id']
             if len(vm_id) > 0:
                 vm_node = {
                     'mandatory': False,
@@ -280,15 +299,15 @@ def add_ports(neutron_db, graph_db, pop, timestamp, uuid=None, update=False):
                 }
                 in_nodes[vm_id] = vm_node
 
-        if 'floatingips' in ports[port]['attributes'].keys():
-            for floatingip in ports[port]['attributes']['floatingips']:
+        if 'floatingips' in port_info['attributes'].keys():
+            for floatingip in port_info['attributes']['floatingips']:
                 floatingip_node = {
                     'mandatory': True,
                     'label': 'has_floatingip'
                 }
                 out_nodes[floatingip] = floatingip_node
 
-        port_node = OpenstackResource(port).store(graph_db, ports[port], pop, timestamp,
+        port_node = OpenstackResource(port).store(graph_db, port_info, pop, timestamp,
                                                   in_edges=in_nodes, out_edges=out_nodes, update=update)
         ports_node.append(port_node)
 
@@ -335,7 +354,7 @@ def add_cinder_snapshots(cinder_db, graph_db, pop, timestamp, uuid=None):
         OpenstackResource(snap).store(graph_db, snapshots[snap], pop, timestamp, in_edges=in_nodes)
 
 
-def add_cinder_volumes(cinder_db, graph_db, pop, timestamp, uuid=None, update=False):
+def add_cinder_volumes(cinder_db, graph_db, pop, timestamp, uuid=None, update=False, fetch_size=None):
     """
     Add Cinder Volumes
     :param cinder_db: Connection to Cinder DB
@@ -344,33 +363,37 @@ def add_cinder_volumes(cinder_db, graph_db, pop, timestamp, uuid=None, update=Fa
     :param timestamp: timestamp in epoch
     :param uuid: optional UUID of the Cinder Volums to be added
     :param update: if it is true, it updates the existing node
+    :param fetch_size: if given, all the volumes are streamed from Cinder DB in chunks of fetch_size rows
     """
-    volumes = cinder_db.get_cinder_volumes(uuid)
-    for vol in volumes:
+    if fetch_size and not uuid:
+        volumes = cinder_db.iter_volumes(fetch_size)
+    else:
+        volumes = cinder_db.get_cinder_volumes(uuid).iteritems()
+    for vol, volume in volumes:
         out_nodes = {}
         in_nodes = {}
-        if volumes[vol]['attributes']['snapshot_id'] is not None:
-            snap_id = volumes[vol]['attributes']['snapshot_id']
+        if volume['attributes']['snapshot_id'] is not None:
+            snap_id = volume['attributes']['snapshot_id']
             snap_node = {
                 'mandatory': True,
                 'label': 'has_snapshot'
             }
             out_nodes[snap_id] = snap_node
-        if volumes[vol]['attributes']['cinder_volume'] is not None:
-            cinder_vol_id = volumes[vol]['attributes']['cinder_volume']
+        if volume['attributes']['cinder_volume'] is not None:
+            cinder_vol_id = volume['attributes']['cinder_volume']
             cinder_node = {
                 'mandatory': True,
                 'label': 'deployed_on'
             }
             out_nodes[cinder_vol_id] = cinder_node
-        if volumes[vol]['attributes']['instance_uuid'] is not None:
-            instance_id = volumes[vol]['attributes']['instance_uuid']
+        if volume['attributes']['instance_uuid'] is not None:
+            instance_id = volume['attributes']['instance_uuid']
             instance_node = {
                 'mandatory': True, #False,
                 'label': 'has_volume'
             }
             in_nodes[instance_id] = instance_node
-        OpenstackResource(vol).store(graph_db, volumes[vol], pop, timestamp,
+        OpenstackResource(vol).store(graph_db, volume, pop, timestamp,
                                      out_edges=out_nodes, in_edges= in_nodes, update=update)
 
 
@@ -385,13 +408,12 @@ def add_nova_hypervisors(nova_db, graph_db, pop, timestamp, hostname=None):
     """
     hypervisors = nova_db.get_hypervisors(hostname)
     for hyperv in hypervisors:
-        Hypervisor(hypervisors[hyperv]['hostname']).get_or_add_hypervisor(graph_db, hyperv,
-                                                                          pop, timestamp,
-                                                                          properties=hypervisors[hyperv])
+        Hypervisor(hypervisors[hyperv]['hostname']).store(graph_db, hyperv, pop, timestamp,
+                                                          properties=hypervisors[hyperv])
 
 
 def add_nova_instances(nova_db, neutron_db, graph_db, pop, timestamp,
-                       uuid=None, update=False):
+                       uuid=None, update=False, fetch_size=None):
     """
     Add Nova Instances
     :param nova_db: Connection to Nova DB
@@ -401,10 +423,21 @@ def add_nova_instances(nova_db, neutron_db, graph_db, pop, timestamp,
     :param timestamp: timestamp in epoch
     :param uuid: optional UUID of the Nova Instance to be added
     :param update: if it is true, it updates the existing node
+    :param fetch_size: if given, all the instances are streamed from Nova DB in chunks of fetch_size rows
     """
-    instances = nova_db.get_instances(uuid=uuid)
-    for instance in instances:
-        host = instances[instance]['hostname']
+    if fetch_size and not uuid:
+        instances = nova_db.iter_instances(fetch_size)
+    else:
+        instances = nova_db.get_instances(uuid=uuid).iteritems()
+
+    # Adding all the instances, the ports
+    # of all of them are fetched at once
+    ports_by_instance = None
+    if not uuid:
+        ports_by_instance = neutron_db.get_ports_by_instance()
+
+    for instance, instance_info in instances:
+        host = instance_info['hostname']
 
         if host:
             hypervisors = [host]
@@ -413,9 +446,12 @@ def add_nova_instances(nova_db, neutron_db, graph_db, pop, timestamp,
 
         out_nodes = {}
 
-        instances[instance]['attributes']['ports'] = neutron_db.get_ports_by_instance_uuid(instance)
+        if ports_by_instance is not None:
+            instance_info['attributes']['ports'] = ports_by_instance.get(instance, [])
+        else:
+            instance_info['attributes']['ports'] = neutron_db.get_ports_by_instance_uuid(instance)
 
-        for port in instances[instance]['attributes']['ports']:
+        for port in instance_info['attributes']['ports']:
             port_id = port
             port_node = {
                 'mandatory': False,
@@ -423,7 +459,7 @@ def add_nova_instances(nova_db, neutron_db, graph_db, pop, timestamp,
             }
             out_nodes[port_id] = port_node
 
-        OpenstackResource(instance).store(graph_db, instances[instance],
+        OpenstackResource(instance).store(graph_db, instance_info,
                                           pop, timestamp, out_edges=out_nodes, hypervisors=hypervisors,
                                           update=update)
 
@@ -21,6 +21,7 @@ __author__ = 'gpetralia'
 from threading import Thread
 import pika
 import json
+from common.utils import config_option
 from monitoring_service.epa_database.openstack.nova_handler import NovaHandler
 from monitoring_service.epa_database.openstack.neutron_handler import FloatingIpHandler
 from monitoring_service.epa_database.openstack.neutron_handler import PortHandler
@@ -41,6 +42,9 @@ handlers_mapping = {
     'orchestration': OrchestrationHandler
 }
 
+# Default number of notifications delivered and not yet acknowledged
+NOTIFICATIONS_PREFETCH = 32
+
 
 class NotificationsConsumer(Thread):
     """
@@ -73,6 +77,7 @@ class NotificationsConsumer(Thread):
                            + rb_port + '/%2F'
 
         self.queue = notification_queue
+        self.prefetch = int(config_option('RabbitMQ', 'notifications_prefetch', config, NOTIFICATIONS_PREFETCH))
         self.handlers = dict()
         self.before = 0
         self.after = 0
@@ -96,9 +101,10 @@ class NotificationsConsumer(Thread):
         routing_key='notifications.info'
         exchanges = ['ceilometer', 'cinder', 'glance', 'heat', 'nova', 'neutron']
         self.bind_queue(channel, queue_name, exchanges, routing_key)
+        channel.basic_qos(prefetch_count=self.prefetch)
         channel.basic_consume(self.callback,
                               queue=queue_name,
-                              no_ack=True)
+                              no_ack=False)
 
         channel.start_consuming()
         print ' [*] Waiting for OpenStack messages.'
@@ -120,19 +126,33 @@ class NotificationsConsumer(Thread):
     def callback(self, ch, method, properties, body):
         """
         Callback called every time a message is received
-        and dispatch it to the registered handler
+        and dispatch it to the registered handler.
+        The message is acknowledged once handled,
+        if the handler fails it is requeued once.
 
         :param ch: channel
         :param method: method of the message received (Get)
         :param properties: properties of the message received (Get)
         :param body: body of the message received
         """
-        body_json = json.loads(body)
-        event = body_json['event_type']
-        handler = event.split('.')[0]
+        try:
+            body_json = json.loads(body)
+            event = body_json['event_type']
+        except (ValueError, KeyError, TypeError):
+            print 'Discarding malformed notification'
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            return
 
-        if handler in self.handlers:
-            self.handlers[handler].handle_events(event, body_json)
+        handler = event.split('.')[0]
+        try:
+            if handler in self.handlers:
+                self.handlers[handler].handle_events(event, body_json)
+        except Exception as exc:
+            print 'Error handling notification {0}: {1}'.format(event, exc)
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=not method.redelivered)
+            return
+
+        ch.basic_ack(delivery_tag=method.delivery_tag)
 
     def run(self):
         """
@@ -0,0 +1,244 @@
+# Copyright 2015 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Thread polling the changes of the Openstack DBs,
+fallback for the notifications missed by the notifications consumer
+"""
+
+__author__ = 'gpetralia'
+
+from threading import Thread
+from contextlib import closing
+import time
+from common.utils import config_section_map, config_option
+import monitoring_service.epa_database.virtual_resources as virtual_resources
+from monitoring_service.epa_database.openstack.db_utils import get_db_time, FETCH_SIZE
+from monitoring_service.epa_database.openstack.nova_db import NovaDb
+from monitoring_service.epa_database.openstack.neutron_db import NeutronDb
+from monitoring_service.epa_database.openstack.cinder_db import CinderDb
+from monitoring_service.epa_database.openstack.heat_db import HeatDb
+from monitoring_service.epa_database.openstack.keystone_db import KeystoneDb
+from monitoring_service.epa_database.openstack_resource import OpenstackResource
+
+# Default seconds between two polls, 0 disables the polling
+POLLING_INTERVAL = 60
+
+# Default seconds between two polls of the ports, 0 disables them.
+# Each poll reads and hashes all the ports, whatever changed
+PORTS_POLLING_INTERVAL = 600
+
+# Resources polled by timestamp: (resource type, services required, DB wrapper, DB name)
+WATERMARKED_RESOURCES = [
+    ('instances', ('nova', 'neutron'), NovaDb, 'nova_db'),
+    ('volumes', ('cinder',), CinderDb, 'cinder_db'),
+    ('stacks', ('heat', 'keystone'), HeatDb, 'heat_db')
+]
+
+
+class OpenstackPoller(Thread):
+    """
+    Class that periodically polls the Openstack DBs
+    and stores in the graph only the resources changed since the last poll.
+    Instances, volumes and stacks are selected by their timestamps,
+    ports by their content hashes since Neutron does not store timestamps:
+    polling the ports costs as much as reading all of them,
+    so they are polled at their own, longer, interval.
+    """
+    def __init__(self, config, graph_db):
+        """
+        OpenstackPoller constructor.
+        It reads the starting point of the polling from the Openstack DBs,
+        it has to be created before the Openstack DBs are dumped.
+        :param config: config file instance
+        :param graph_db: Graph db instance
+        """
+        super(OpenstackPoller, self).__init__()
+        self.config = config
+        self.graph_db = graph_db
+        self.pop = config_section_map('PoP', config)['name']
+        self.controller_hostname = config_section_map('Openstack', config)['controller_hostname']
+        self.os_db_host = config_section_map('OpenstackDB', config)['host']
+        self.interval = float(config_option('OpenstackDB', 'polling_interval', config, POLLING_INTERVAL))
+        self.ports_interval = float(config_option('OpenstackDB', 'ports_polling_interval', config,
+                                                  PORTS_POLLING_INTERVAL))
+        self.fetch_size = int(config_option('OpenstackDB', 'fetch_size', config, FETCH_SIZE))
+
+        self.enabled = set()
+        for service in ['nova', 'cinder', 'neutron', 'heat', 'keystone']:
+            if config_section_map('Openstack', config)[service + '_enabled'].lower() == 'true':
+                self.enabled.add(service)
+
+        # Time of the last poll of each resource type, as DB server UTC time
+        self.watermarks = {}
+        # Content hashes of the ports at the last poll
+        self.port_hashes = {}
+        # Time of the last poll of the ports
+        self.ports_polled = time.time()
+
+        if self.interval > 0:
+            self.init_watermarks()
+
+    def is_enabled(self, *services):
+        """
+        Return true if all the given services are enabled
+        """
+        return self.enabled.issuperset(services)
+
+    def is_polling_ports(self):
+        """
+        Return true if the ports are polled
+        """
+        return self.ports_interval > 0 and self.is_enabled('neutron')
+
+    def get_db(self, db_class, db_label):
+        """
+        Create and return the connection to an Openstack DB
+        :param db_class: DB wrapper class
+        :param db_label: name of the DB in the config file
+        :return: DB wrapper
+        """
+        usr = config_section_map('OpenstackDB', self.config)[db_label + '_username']
+        pwd = config_section_map('OpenstackDB', self.config)[db_label + '_password']
+        db = config_section_map('OpenstackDB', self.config)[db_label]
+        return db_class(self.os_db_host, usr, pwd, db)
+
+    def init_watermarks(self):
+        """
+        Read the current time of the DBs and the current ports hashes
+        """
+        for resource_type, services, db_class, db_label in WATERMARKED_RESOURCES:
+            if self.is_enabled(*services):
+                os_db = self.get_db(db_class, db_label)
+                with closing(os_db.conn):
+                    self.watermarks[resource_type] = get_db_time(os_db.conn)
+        if self.is_polling_ports():
+            neutron_db = self.get_db(NeutronDb, 'neutron_db')
+            with closing(neutron_db.conn):
+                self.port_hashes = neutron_db.get_port_hashes(self.fetch_size)
+
+    def poll(self):
+        """
+        Store the resources changed since the last poll.
+        Each resource type is polled on its own, so that
+        a failing DB does not stop the polling of the others.
+        """
+        timestamp = time.time()
+        pollers = []
+        if 'instances' in self.watermarks:
+            pollers.append(('instances', self.poll_instances))
+        if 'volumes' in self.watermarks:
+            pollers.append(('volumes', self.poll_volumes))
+        if 'stacks' in self.watermarks:
+            pollers.append(('stacks', self.poll_stacks))
+        if self.is_polling_ports() and timestamp - self.ports_polled >= self.ports_interval:
+            self.ports_polled = timestamp
+            pollers.append(('ports', self.poll_ports))
+
+        for resource_type, poll_resources in pollers:
+            try:
+                poll_resources(timestamp)
+            except Exception as exc:
+                print 'Error polling OpenStack {0}: {1}'.format(resource_type, exc)
+
+    def poll_instances(self, timestamp):
+        """
+        Store the Nova instances changed since the last poll
+        and the hypervisors they run on
+        :param timestamp: timestamp in epoch
+        """
+        nova_db = self.get_db(NovaDb, 'nova_db')
+        with closing(nova_db.conn):
+            neutron_db = self.get_db(NeutronDb, 'neutron_db')
+            with closing(neutron_db.conn):
+                now = get_db_time(nova_db.conn)
+
+                instances = nova_db.get_changed_instances(self.watermarks['instances'])
+                for uuid, deleted in instances.iteritems():
+                    if deleted:
+                        OpenstackResource(uuid).remove_resource(self.graph_db)
+                    else:
+                        virtual_resources.add_nova_instances(nova_db, neutron_db, self.graph_db, self.pop,
+                                                             timestamp, uuid=uuid)
+                if instances:
+                    virtual_resources.add_nova_hypervisors(nova_db, self.graph_db, self.pop, timestamp)
+
+                self.watermarks['instances'] = now
+
+    def poll_volumes(self, timestamp):
+        """
+        Store the Cinder volumes changed since the last poll
+        :param timestamp: timestamp in epoch
+        """
+        cinder_db = self.get_db(CinderDb, 'cinder_db')
+        with closing(cinder_db.conn):
+            now = get_db_time(cinder_db.conn)
+
+            volumes = cinder_db.get_changed_volumes(self.watermarks['volumes'])
+            for uuid, deleted in volumes.iteritems():
+                OpenstackResource(uuid).remove_resource(self.graph_db)
+                if not deleted:
+                    virtual_resources.add_cinder_volumes(cinder_db, self.graph_db, self.pop, timestamp, uuid=uuid)
+
+            self.watermarks['volumes'] = now
+
+    def poll_stacks(self, timestamp):
+        """
+        Store the Heat stacks changed since the last poll
+        :param timestamp: timestamp in epoch
+        """
+        heat_db = self.get_db(HeatDb, 'heat_db')
+        with closing(heat_db.conn):
+            keystone_db = self.get_db(KeystoneDb, 'keystone_db')
+            with closing(keystone_db.conn):
+                now = get_db_time(heat_db.conn)
+
+                stacks = heat_db.get_changed_stacks(self.watermarks['stacks'])
+                for uuid, deleted in stacks.iteritems():
+                    OpenstackResource(uuid).remove_resource(self.graph_db)
+                    if not deleted:
+                        virtual_resources.add_heat_stacks(heat_db, keystone_db, self.graph_db, self.pop,
+                                                          timestamp, self.controller_hostname, uuid=uuid)
+
+                self.watermarks['stacks'] = now
+
+    def poll_ports(self, timestamp):
+        """
+        Store the Neutron ports whose content changed since the last poll
+        :param timestamp: timestamp in epoch
+        """
+        neutron_db = self.get_db(NeutronDb, 'neutron_db')
+        with closing(neutron_db.conn):
+            port_hashes = neutron_db.get_port_hashes(self.fetch_size)
+
+            for uuid in self.port_hashes:
+                if uuid not in port_hashes:
+                    OpenstackResource(uuid).remove_resource(self.graph_db)
+            for uuid in port_hashes:
+                if self.port_hashes.get(uuid) != port_hashes[uuid]:
+                    virtual_resources.add_ports(neutron_db, self.graph_db, self.pop, timestamp, uuid=uuid)
+
+            self.port_hashes = port_hashes
+
+    def run(self):
+        """
+        Start the thread polling the Openstack DBs every interval seconds
+
+        """
+        if self.interval <= 0:
+            return
+        print ' [*] Polling OpenStack DBs every {0} seconds.'.format(self.interval)
+        while True:
+            time.sleep(self.interval)
+            self.poll()
@@ -0,0 +1,103 @@
+# Copyright 2015 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests of the EPA agent sysfs readers against a fake sysfs tree.
+
+Run from the root of the repository:
+python -m unittest discover tests
+"""
+
+__author__ = 'gpetralia'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from epa_agent import agent
+
+
+class AgentSysfsTest(unittest.TestCase):
+    """
+    Build a fake sysfs tree with:
+    - an SR-IOV NIC with 4 of 63 virtual functions configured
+    - a NIC bound to vfio-pci
+    - a NIC bound to its kernel driver
+    - a non-network device bound to vfio-pci and exposing sriov_totalvfs
+    """
+
+    def setUp(self):
+        self.sysfs_root = tempfile.mkdtemp()
+        self.add_device('0000:01:00.0', '0x020000', 'ixgbe', numvfs='4', totalvfs='63')
+        self.add_device('0000:02:00.0', '0x020000', 'vfio-pci')
+        self.add_device('0000:03:00.0', '0x020000', 'e1000e')
+        self.add_device('0000:04:00.0', '0x030000', 'vfio-pci', totalvfs='7')
+        self.add_device('0000:05:00.0', '0x020000', None)
+
+    def tearDown(self):
+        shutil.rmtree(self.sysfs_root)
+
+    def add_device(self, pci_busid, pci_class, driver, numvfs=None, totalvfs=None):
+        """
+        Add a PCI device to the fake sysfs tree, linking it to its driver
+        """
+        device_path = os.path.join(self.sysfs_root, 'bus', 'pci', 'devices', pci_busid)
+        os.makedirs(device_path)
+        self.write(os.path.join(device_path, 'class'), pci_class)
+        if driver:
+            driver_path = os.path.join(self.sysfs_root, 'bus', 'pci', 'drivers', driver)
+            if not os.path.isdir(driver_path):
+                os.makedirs(driver_path)
+            os.symlink(os.path.relpath(driver_path, device_path), os.path.join(device_path, 'driver'))
+        if numvfs is not None:
+            self.write(os.path.join(device_path, 'sriov_numvfs'), numvfs)
+        if totalvfs is not None:
+            self.write(os.path.join(device_path, 'sriov_totalvfs'), totalvfs)
+
+    @staticmethod
+    def write(file_path, value):
+        with open(file_path, 'w') as f:
+            f.write(value + '\n')
+
+    def test_pci_devices(self):
+        devices = agent.get_pci_devices(self.sysfs_root)
+        self.assertEqual(len(devices), 5)
+        self.assertEqual(devices['0000:01:00.0'], {'class': '0x020000', 'driver': 'ixgbe'})
+        self.assertEqual(devices['0000:05:00.0'], {'class': '0x020000', 'driver': None})
+
+    def test_sriov_devices(self):
+        self.assertEqual(agent.get_sriov_devices(self.sysfs_root), {'0000:01:00.0': ('4', '63')})
+
+    def test_dpdk_devices(self):
+        self.assertEqual(agent.get_dpdk_devices(self.sysfs_root), ['0000:02:00.0'])
+
+    def test_missing_sysfs(self):
+        missing_root = os.path.join(self.sysfs_root, 'missing')
+        self.assertEqual(agent.get_pci_devices(missing_root), {})
+        self.assertEqual(agent.get_sriov_devices(missing_root), {})
+        self.assertEqual(agent.get_dpdk_devices(missing_root), [])
+
+    def test_sriov_file(self):
+        data_path = tempfile.mkdtemp()
+        try:
+            agent.create_sriov_file(data_path, 'host', self.sysfs_root)
+            with open(os.path.join(data_path, 'host' + agent.DATA_FILES['sriov'])) as f:
+                self.assertEqual(f.read(), '0000:01:00.0 4 63\n')
+        finally:
+            shutil.rmtree(data_path)
+
+
+if __name__ == '__main__':
+    unittest.main()